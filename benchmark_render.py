@@ -0,0 +1,127 @@
+# Este script mide cuánto cuesta dibujar_bimo sin pantalla ni audio
+# (driver "dummy" de SDL) y guarda los resultados en JSON
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import numpy
+import pygame
+import index
+
+EMOCIONES = ["NEUTRO", "FELIZ", "TRISTE", "ENOJADO", "SORPRENDIDO", "DUDOSO",
+             "AMOR", "ESCUCHANDO", "PENSANDO", "EMOCIONADO", "CANSADO"]
+PARTICULAS = [0, 10, 100, 1000, 4000]
+CUADROS_CALENTAMIENTO = 10
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def preparar_caso(emocion, hablando, generando):
+    index.ESTADO.actualizar(emocion=emocion, hablando=hablando, generando=generando, esperando_orden=False)
+    index.PARTICULAS.vaciar()
+    index.forzar_redibujado()
+
+def completar_particulas(cantidad):
+    faltan = cantidad - len(index.PARTICULAS)
+    if faltan > 0:
+        index.crear_particulas(250, 200, faltan, (255, 255, 100))
+
+def medir_caso(superficie, emocion, hablando, generando, particulas, cuadros):
+    preparar_caso(emocion, hablando, generando)
+    for _ in range(CUADROS_CALENTAMIENTO):
+        completar_particulas(particulas)
+        index.dibujar_bimo(superficie)
+
+    # Pasada de tiempos (sin tracemalloc, que frena todo)
+    tiempos = []
+    bloques = []
+    colecciones_antes = sum(s["collections"] for s in gc.get_stats())
+    for _ in range(cuadros):
+        completar_particulas(particulas)
+        bloques_antes = sys.getallocatedblocks()
+        inicio = time.perf_counter_ns()
+        index.dibujar_bimo(superficie)
+        tiempos.append((time.perf_counter_ns() - inicio) / 1000)
+        bloques.append(sys.getallocatedblocks() - bloques_antes)
+    colecciones = sum(s["collections"] for s in gc.get_stats()) - colecciones_antes
+
+    # Pasada de memoria: pico de bytes asignados durante un cuadro
+    picos = []
+    tracemalloc.start()
+    for _ in range(max(1, cuadros // 10)):
+        completar_particulas(particulas)
+        tracemalloc.reset_peak()
+        base, _ = tracemalloc.get_traced_memory()
+        index.dibujar_bimo(superficie)
+        picos.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+
+    return {
+        "emocion": emocion,
+        "hablando": hablando,
+        "generando": generando,
+        "particulas": particulas,
+        "cuadros": cuadros,
+        "us_p50": round(percentil(tiempos, 50), 1),
+        "us_p90": round(percentil(tiempos, 90), 1),
+        "us_p99": round(percentil(tiempos, 99), 1),
+        "us_max": round(max(tiempos), 1),
+        "us_media": round(sum(tiempos) / len(tiempos), 1),
+        "bloques_netos_por_cuadro": round(sum(bloques) / len(bloques), 2),
+        "bytes_pico_por_cuadro": int(sum(picos) / len(picos)),
+        "colecciones_gc": colecciones,
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark del motor gráfico de BIMO")
+    parser.add_argument("--cuadros", type=int, default=120, help="cuadros medidos por caso")
+    parser.add_argument("--particulas", type=int, nargs="+", default=PARTICULAS, help="cantidades de partículas a probar")
+    parser.add_argument("--emociones", nargs="+", default=EMOCIONES, help="emociones a probar")
+    parser.add_argument("--salida", help="archivo JSON de resultados (por defecto se imprime)")
+    args = parser.parse_args()
+
+    pygame.init()
+    pygame.display.set_mode(index.VENTANA_TAMAÑO)
+    superficie = pygame.Surface(index.VENTANA_TAMAÑO)
+
+    casos = []
+    for emocion in args.emociones:
+        for hablando in (False, True):
+            for generando in (False, True):
+                for particulas in args.particulas:
+                    caso = medir_caso(superficie, emocion, hablando, generando, particulas, args.cuadros)
+                    casos.append(caso)
+                    print(f"- {emocion:<12} hablando={hablando!s:<5} generando={generando!s:<5} "
+                          f"partículas={particulas:<5} p50={caso['us_p50']:>8.1f} us  p99={caso['us_p99']:>8.1f} us",
+                          file=sys.stderr)
+
+    resultado = {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "entorno": {
+            "python": platform.python_version(),
+            "pygame": pygame.version.ver,
+            "numpy": numpy.__version__,
+            "maquina": platform.machine(),
+            "ventana": list(index.VENTANA_TAMAÑO),
+        },
+        "casos": casos,
+    }
+
+    texto = json.dumps(resultado, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as archivo:
+            archivo.write(texto + "\n")
+        print(f"✅ Resultados en {args.salida}", file=sys.stderr)
+    else:
+        print(texto)
@@ -8,21 +8,51 @@ BIMO V7 ULTRA - Asistente Virtual Optimizado
 Versión: 7.0
 """
 
-import pygame
-import speech_recognition as sr
-import google.generativeai as genai
-import asyncio
-import edge_tts
+import importlib
 import threading
 import random
 import time
 import os
 import math
 import re
-import requests
 import datetime
-from queue import Queue
+import io
+import wave
+import atexit
+import contextvars
+import unicodedata
+from queue import Queue, Empty, Full
 import json
+import hashlib
+import heapq
+import itertools
+from collections import OrderedDict, namedtuple, deque
+from functools import lru_cache
+
+class _ImportacionPerezosa:
+    """Módulo que se importa hasta el primer uso de uno de sus atributos.
+    Así importar index.py no carga pygame, Gemini ni la red"""
+    
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+    
+    def __getattr__(self, atributo):
+        modulo = self._modulo
+        if modulo is None:
+            modulo = self._modulo = importlib.import_module(self._nombre)
+        return getattr(modulo, atributo)
+
+pygame = _ImportacionPerezosa("pygame")
+sr = _ImportacionPerezosa("speech_recognition")
+genai = _ImportacionPerezosa("google.generativeai")
+asyncio = _ImportacionPerezosa("asyncio")
+np = _ImportacionPerezosa("numpy")
+edge_tts = _ImportacionPerezosa("edge_tts")
+requests = _ImportacionPerezosa("requests")
+futures = _ImportacionPerezosa("concurrent.futures")
+difflib = _ImportacionPerezosa("difflib")
+ast = _ImportacionPerezosa("ast")
 
 # Importar configuración
 try:
@@ -50,94 +80,311 @@ except ImportError:
     INTERVALO_ALARMAS = 30
     DEBUG_MODE = True
 
+_RUTA_BASE = os.path.dirname(os.path.abspath(__file__))
+
+# Opciones nuevas: si config_bimo.py no las define se usan estos valores
+_OPCIONES_DEFECTO = {
+    "MODO_STREAMING": True,  # Hablar frase por frase mientras Gemini genera
+    "TTS_REPRODUCCION_PROGRESIVA": False,  # Sonar antes de que termine la síntesis
+    "TTS_BYTES_INICIO": 4800,  # Audio mínimo (~0.8 s de MP3) para empezar a sonar
+    "CACHE_VOZ_CARPETA": os.path.join(_RUTA_BASE, "cache_voz"),
+    "CACHE_VOZ_MAX_MB": 50,  # Límite en disco (se borran las frases menos usadas)
+    "CACHE_VOZ_RAM_MB": 4,  # Capa caliente en memoria
+    "ARCHIVO_TIEMPOS_ARRANQUE": os.path.join(_RUTA_BASE, "arranque_bimo.jsonl"),  # None = no guardar
+    "ARCHIVO_TAREAS": os.path.join(_RUTA_BASE, "tareas_bimo.json"),  # Temporizadores y alarmas pendientes
+    "GRACIA_TAREAS_VENCIDAS": 600,  # Segundos: tareas vencidas durante un reinicio que aún se avisan
+    "MAX_PARTICULAS": 4096,  # Tope del sistema de partículas
+    "FPS_REPOSO": 15,  # Cuadros por segundo cuando BIMO solo respira en NEUTRO
+    "SEGUNDOS_RAMPA": 2.0,  # Tiempo a FPS completos después de un evento o cambio de estado
+    "PALABRA_CLAVE_LOCAL": False,  # Descartar en el dispositivo las frases sin "bimo" (calibrar antes con probar_palabra_clave.py)
+    "PALABRA_CLAVE_CARPETA": os.path.join(_RUTA_BASE, "plantillas_bimo"),  # WAVs diciendo "bimo"; frases en si/ y no/ para calibrar
+    "UMBRAL_PALABRA_CLAVE": None,  # Distancia DTW máxima; None = calibrar con las frases o las plantillas
+    "PREROLL_SEGUNDOS": 0.5,  # Audio previo a la voz que se conserva para no cortar el inicio de "bimo"
+    "MAX_FRASES_EN_COLA": 4,  # Frases capturadas esperando reconocimiento (se descartan las más viejas)
+    "MOTORES_RECONOCIMIENTO": ["google", "vosk"],  # Se consultan en paralelo; vosk funciona sin internet
+    "MODELO_VOSK": os.path.join(_RUTA_BASE, "modelo_vosk"),  # Carpeta del modelo de Vosk en español
+    "PLAZO_RECONOCIMIENTO": 4.0,  # Segundos máximos esperando a los motores
+    "CONFIANZA_MINIMA_RECONOCIMIENTO": 0.6,  # Un resultado con menos confianza solo se usa si no hay otro
+    "INTENCIONES_LOCALES": True,  # Hora, fecha, cuentas, conversiones y temporizadores sin pasar por Gemini
+    # Cómo decir el resultado de cada comando: "local" (plantilla, sin otra vuelta
+    # a Gemini) o "gemini" (Gemini lo redacta, más lento y gasta tokens)
+    "MODO_RESPUESTA_HERRAMIENTAS": {
+        "hora": "local",
+        "fecha": "local",
+        "clima": "local",
+        "calculo": "local",
+        "conversion": "local",
+    },
+    "CARACTERES_POR_SEGUNDO_VOZ": 15,  # Para cambiar de emoción a mitad de una frase larga
+    "URLS_SERVICIOS": {  # Se pueden apuntar a un servidor local para pruebas (ver probar_http.py)
+        "ipapi": "https://ipapi.co/json/",
+        "ip-api": "http://ip-api.com/json/",
+        "geocodificacion": "https://geocoding-api.open-meteo.com/v1/search",
+        "pronostico": "https://api.open-meteo.com/v1/forecast",
+        "tipo_cambio": "https://api.exchangerate-api.com/v4/latest/{moneda}",
+    },
+    "ARCHIVO_GEOCODIFICACION": os.path.join(_RUTA_BASE, "geocodificacion_bimo.json"),  # Coordenadas ya buscadas
+    "TTL_CLIMA": 600,  # Segundos que el clima consultado se da por bueno
+    "TTL_CLIMA_VIEJO": 3600,  # Hasta aquí se responde con el clima viejo mientras se actualiza
+    "MONEDA_BASE_CAMBIO": "USD",  # Tabla que se descarga; los demás cruces salen de ella
+    "TTL_TIPO_CAMBIO": 6 * 3600,  # Segundos que una tabla de tipos de cambio se da por buena
+    "ARCHIVO_TIPO_CAMBIO": os.path.join(_RUTA_BASE, "tipo_cambio_bimo.json"),  # Última tabla, para usar sin red
+    "ARCHIVO_UBICACION": os.path.join(_RUTA_BASE, "ubicacion_bimo.json"),  # Última ubicación detectada por IP
+    "TTL_UBICACION": 3600,  # Después de esto la ubicación se actualiza en segundo plano
+    "UBICACION_FIJA": None,  # Ej. "Colima" o {"ciudad": "Colima", "pais": "México", "lat": 19.24, "lon": -103.72}
+    "MEMORIA_MAX_TURNOS": 12,  # Intercambios que se le mandan a Gemini tal cual
+    "MEMORIA_MAX_TOKENS": 2000,  # Tokens aproximados de esos intercambios
+    "MEMORIA_MAX_RESUMEN": 600,  # Caracteres del resumen de lo más viejo
+    "RESUMEN_CON_GEMINI": True,  # Gemini redacta el resumen en segundo plano (si falla, se arma localmente)
+    "CACHE_RESPUESTAS_ACTIVO": False,  # Repetir respuestas de Gemini a preguntas iguales (sin comandos)
+    "MAX_RESPUESTAS_CACHE": 200,  # Preguntas distintas guardadas (se expulsan las menos usadas)
+    "TTL_RESPUESTAS": 7 * 24 * 3600,  # Segundos que una respuesta guardada sirve
+    "VARIACIONES_RESPUESTA": 3,  # Respuestas que se juntan para preguntas que piden variedad
+    "SEGUNDOS_CONTEXTO_RESPUESTAS": 90,  # Tras platicar, las preguntas cortas no usan el cache (pueden depender de lo anterior)
+    "PALABRAS_VARIAR_RESPUESTA": ["chiste", "chistes", "cuento", "cuentame", "adivinanza", "dato", "cancion", "historia"],
+    "ARCHIVO_TRAZAS": os.path.join(_RUTA_BASE, "trazas_bimo.jsonl"),  # Tiempos por etapa de cada frase; None = no guardar
+    "ARCHIVO_REGISTRO": None,  # Copia en JSON de cada log() (ej. "registro_bimo.jsonl")
+    "MAX_MB_REGISTROS": 5,  # Tope de cada archivo de trazas/registro; al llenarse pasa a ".1" (se guarda uno viejo)
+    "MAX_REGISTROS_EN_COLA": 10000,  # Si el hilo de salida se atrasa, se descartan registros en vez de frenar
+}
+for _opcion, _valor in _OPCIONES_DEFECTO.items():
+    globals().setdefault(_opcion, _valor)
+
 # ==========================================
-# GEOLOCALIZACIÓN
+# CLIENTE HTTP
 # ==========================================
 
-UBICACION_CACHE = None
-UBICACION_TIMESTAMP = 0
-CACHE_DURACION = 3600  # 1 hora
+class ClienteHTTP:
+    """Una sola sesión de requests para todos los servicios: las conexiones
+    keep-alive se reutilizan (sin repetir TCP+TLS en cada consulta). Lleva
+    métricas de latencia por servicio"""
+    
+    def __init__(self, conexiones=8):
+        self.conexiones = conexiones
+        self.metricas = {}  # servicio -> {"llamadas", "errores", "segundos", "maximo"}
+        self._sesion = None
+        self._ejecutor = None
+        self._candado = threading.Lock()
+    
+    def _sesion_compartida(self):
+        with self._candado:
+            if self._sesion is None:
+                sesion = requests.Session()
+                adaptador = requests.adapters.HTTPAdapter(pool_connections=self.conexiones, pool_maxsize=self.conexiones)
+                sesion.mount("http://", adaptador)
+                sesion.mount("https://", adaptador)
+                self._sesion = sesion
+            return self._sesion
+    
+    def _anotar(self, servicio, segundos, error):
+        with self._candado:
+            metrica = self.metricas.setdefault(servicio, {"llamadas": 0, "errores": 0, "segundos": 0.0, "maximo": 0.0})
+            metrica["llamadas"] += 1
+            metrica["errores"] += error
+            metrica["segundos"] += segundos
+            metrica["maximo"] = max(metrica["maximo"], segundos)
+    
+    def obtener_json(self, servicio, params=None, timeout=5, **formato):
+        """GET al servicio de URLS_SERVICIOS (con {campos} llenados por formato)"""
+        url = URLS_SERVICIOS[servicio].format(**formato)
+        inicio = time.perf_counter()
+        error = True
+        try:
+            resp = self._sesion_compartida().get(url, params=params, timeout=timeout)
+            resp.raise_for_status()
+            datos = resp.json()
+            error = False
+            return datos
+        finally:
+            self._anotar(servicio, time.perf_counter() - inicio, error)
+    
+    def carrera(self, intentos, timeout):
+        """Corre todos los intentos {nombre: función} a la vez y devuelve
+        (nombre, resultado) del primero que dé algo; (None, None) si ninguno"""
+        with self._candado:
+            if self._ejecutor is None:
+                self._ejecutor = futures.ThreadPoolExecutor(max_workers=self.conexiones, thread_name_prefix="http")
+        futuros = {self._ejecutor.submit(funcion): nombre for nombre, funcion in intentos.items()}
+        try:
+            for futuro in futures.as_completed(futuros, timeout=timeout):
+                try:
+                    resultado = futuro.result()
+                except Exception as e:
+                    log(f"{futuros[futuro]} falló: {e}", "warning")
+                    continue
+                if resultado:
+                    return futuros[futuro], resultado
+        except futures.TimeoutError:
+            log(f"Ningún servicio respondió en {timeout} s", "warning")
+        return None, None
+    
+    def resumen(self):
+        with self._candado:
+            return " | ".join(
+                f"{servicio} {m['llamadas']}x media {m['segundos'] / m['llamadas'] * 1000:.0f} ms "
+                f"máx {m['maximo'] * 1000:.0f} ms errores {m['errores']}"
+                for servicio, m in sorted(self.metricas.items())
+            )
+
+HTTP = ClienteHTTP()
 
-def obtener_ubicacion_automatica():
-    """Obtiene la ubicación actual usando geolocalización IP"""
-    global UBICACION_CACHE, UBICACION_TIMESTAMP
+class ConsultasEnCurso:
+    """Junta las consultas iguales que llegan al mismo tiempo: solo la
+    primera va a la red y las demás esperan su resultado"""
     
-    # Usar cache si es reciente
-    if UBICACION_CACHE and (time.time() - UBICACION_TIMESTAMP < CACHE_DURACION):
-        log(f"Usando ubicación en cache: {UBICACION_CACHE['ciudad']}")
-        return UBICACION_CACHE
+    def __init__(self):
+        self._en_curso = {}  # clave -> Future
+        self._candado = threading.Lock()
     
-    try:
-        log("🌍 Obteniendo ubicación automática...")
+    def ocupada(self, clave):
+        with self._candado:
+            return clave in self._en_curso
+    
+    def ejecutar(self, clave, funcion):
+        with self._candado:
+            futuro = self._en_curso.get(clave)
+            propia = futuro is None
+            if propia:
+                futuro = self._en_curso[clave] = futures.Future()
+        if not propia:
+            return futuro.result()
         
-        # Método 1: ipapi.co (más preciso, gratis, no requiere API key)
         try:
-            resp = requests.get('https://ipapi.co/json/', timeout=3).json()
-            
-            if 'city' in resp and resp['city']:
-                ubicacion = {
-                    'ciudad': resp.get('city', CIUDAD_DEFECTO),
-                    'region': resp.get('region', ''),
-                    'pais': resp.get('country_name', ''),
-                    'lat': resp.get('latitude'),
-                    'lon': resp.get('longitude')
-                }
-                
-                UBICACION_CACHE = ubicacion
-                UBICACION_TIMESTAMP = time.time()
-                
-                log(f"✅ Ubicación detectada: {ubicacion['ciudad']}, {ubicacion['pais']}")
-                return ubicacion
-        except:
-            pass
+            resultado = funcion()
+        except BaseException as e:
+            futuro.set_exception(e)
+            raise
+        else:
+            futuro.set_result(resultado)
+            return resultado
+        finally:
+            with self._candado:
+                del self._en_curso[clave]
+
+# ==========================================
+# GEOLOCALIZACIÓN
+# ==========================================
+
+class CacheUbicacion:
+    """Última ubicación detectada, guardada en disco: al arrancar se carga al
+    instante y, si ya está vieja, se sigue usando mientras se actualiza en
+    segundo plano. Ninguna petición del usuario espera a la geolocalización"""
+    
+    def __init__(self, archivo, ttl, fija=None, reintento=300):
+        self.archivo = archivo
+        self.ttl = ttl
+        self.fija = fija  # Ciudad o dict puesto a mano: no se consulta la IP
+        self.reintento = reintento  # Segundos entre intentos fallidos
+        self._entrada = None  # {"momento", "ubicacion"}; se lee en el primer uso
+        self._leida = False
+        self._ultimo_intento = 0
+        self._candado = threading.Lock()
+        self._en_curso = ConsultasEnCurso()
+    
+    def _cargada(self):
+        if not self._leida:
+            self._leida = True
+            entrada = cargar_json(self.archivo, None) if self.archivo else None
+            if isinstance(entrada, dict) and entrada.get("ubicacion", {}).get("ciudad"):
+                self._entrada = entrada
+        return self._entrada
+    
+    def _detectar(self):
+        log("🌍 Obteniendo ubicación automática...")
+        self._ultimo_intento = time.time()
+        # Los dos servicios compiten: gana el primero que responda con ciudad
+        nombre, ubicacion = HTTP.carrera({"ipapi": _ubicacion_ipapi, "ip-api": _ubicacion_ip_api}, timeout=3.5)
+        if not ubicacion:
+            log("⚠️ No se pudo detectar la ubicación", "warning")
+            return None
         
-        # Método 2: ip-api.com (backup)
-        try:
-            resp = requests.get('http://ip-api.com/json/', timeout=3).json()
-            
-            if resp.get('status') == 'success':
-                ubicacion = {
-                    'ciudad': resp.get('city', CIUDAD_DEFECTO),
-                    'region': resp.get('regionName', ''),
-                    'pais': resp.get('country', ''),
-                    'lat': resp.get('lat'),
-                    'lon': resp.get('lon')
-                }
-                
-                UBICACION_CACHE = ubicacion
-                UBICACION_TIMESTAMP = time.time()
-                
-                log(f"✅ Ubicación detectada (backup): {ubicacion['ciudad']}")
-                return ubicacion
-        except:
-            pass
+        log(f"✅ Ubicación detectada ({nombre}): {ubicacion['ciudad']}, {ubicacion['pais']}")
+        entrada = {"momento": time.time(), "ubicacion": ubicacion}
+        with self._candado:
+            self._entrada = entrada
+            self._leida = True
+        if self.archivo:
+            guardar_json(self.archivo, entrada)
+        return ubicacion
+    
+    def actualizar(self):
+        """Consulta la IP ahora (juntándose con una consulta en curso)"""
+        return self._en_curso.ejecutar("ubicacion", self._detectar)
+    
+    def _actualizar_en_segundo_plano(self):
+        if self._en_curso.ocupada("ubicacion") or time.time() - self._ultimo_intento < self.reintento:
+            return
+        threading.Thread(target=self.actualizar, daemon=True).start()
+    
+    def obtener(self, esperar=False):
+        """Ubicación conocida al instante. Solo con esperar=True (el arranque)
+        se espera a la red cuando todavía no hay ninguna guardada"""
+        if self.fija:
+            return ubicacion_fija(self.fija)
         
-        # Fallback a ciudad por defecto
-        log(f"⚠️ No se pudo detectar ubicación, usando: {CIUDAD_DEFECTO}")
+        with self._candado:
+            entrada = self._cargada()
+        if entrada:
+            if time.time() - entrada["momento"] >= self.ttl:
+                self._actualizar_en_segundo_plano()
+            return entrada["ubicacion"]
+        
+        ubicacion = None
+        if esperar:
+            ubicacion = self.actualizar()
+        else:
+            self._actualizar_en_segundo_plano()
+        if ubicacion:
+            return ubicacion
+        log(f"⚠️ Ubicación desconocida por ahora, usando: {CIUDAD_DEFECTO}")
+        return ubicacion_fija(CIUDAD_DEFECTO)
+
+def ubicacion_fija(lugar):
+    """UBICACION_FIJA puede ser el nombre de una ciudad (se geocodifica al
+    pedir el clima) o un dict con ciudad, region, pais, lat y lon"""
+    ubicacion = {'ciudad': CIUDAD_DEFECTO, 'region': '', 'pais': 'México', 'lat': None, 'lon': None}
+    if isinstance(lugar, dict):
+        ubicacion.update(lugar)
+    else:
+        ubicacion['ciudad'] = lugar
+    return ubicacion
+
+UBICACION = CacheUbicacion(ARCHIVO_UBICACION, TTL_UBICACION, UBICACION_FIJA)
+
+def obtener_ubicacion_automatica():
+    """Obtiene la ubicación actual usando geolocalización IP (sin esperar a la red)"""
+    return UBICACION.obtener()
+
+def _ubicacion_ipapi():
+    """ipapi.co (más preciso, gratis, no requiere API key)"""
+    resp = HTTP.obtener_json("ipapi", timeout=3)
+    if resp.get('city'):
         return {
-            'ciudad': CIUDAD_DEFECTO,
-            'region': '',
-            'pais': 'México',
-            'lat': None,
-            'lon': None
+            'ciudad': resp['city'],
+            'region': resp.get('region', ''),
+            'pais': resp.get('country_name', ''),
+            'lat': resp.get('latitude'),
+            'lon': resp.get('longitude')
         }
-        
-    except Exception as e:
-        log(f"❌ Error geolocalización: {e}", "error")
+    return None
+
+def _ubicacion_ip_api():
+    """ip-api.com"""
+    resp = HTTP.obtener_json("ip-api", timeout=3)
+    if resp.get('status') == 'success':
         return {
-            'ciudad': CIUDAD_DEFECTO,
-            'region': '',
-            'pais': 'México',
-            'lat': None,
-            'lon': None
+            'ciudad': resp.get('city', CIUDAD_DEFECTO),
+            'region': resp.get('regionName', ''),
+            'pais': resp.get('country', ''),
+            'lat': resp.get('lat'),
+            'lon': resp.get('lon')
         }
+    return None
 
 # ==========================================
 # INICIALIZACIÓN DE GEMINI
 # ==========================================
 
-genai.configure(api_key=GEMINI_API_KEY)
-
 instruction = """
 Eres BIMO (BMO) de Hora de Aventura.
 Personalidad: Inocente, leal, gamer, curioso, amigable, juguetón. Tu creador es Mo.
@@ -154,6 +401,8 @@ COMANDOS DISPONIBLES:
 7. CONVERSIÓN: "[CMD_CONVERT:cantidad:de:a]"
 8. BÚSQUEDA: "[CMD_SEARCH:consulta]"
 9. RECORDATORIO: "[CMD_REMINDER:tiempo_minutos:mensaje]"
+10. PENDIENTES: "[CMD_TAREAS]" para decir temporizadores, alarmas y recordatorios pendientes
+11. CANCELAR: "[CMD_CANCELAR:numero]" para cancelar un pendiente por su número
 
 EMOCIONES (usa estas para expresarte):
 [FELIZ], [TRISTE], [ENOJADO], [SORPRENDIDO], [DUDOSO], [AMOR], [ESCUCHANDO], [PENSANDO], [EMOCIONADO], [CANSADO]
@@ -162,80 +411,670 @@ REGLAS:
 - Sé breve, tierno y divertido como BMO
 - Usa emociones frecuentemente para ser más expresivo
 - Si preguntan clima sin ciudad, usa [CMD_CLIMA:AUTO]
+- Si piden varias cosas, usa varios comandos en la misma respuesta
 - Para cálculos o datos reales, SIEMPRE usa comandos
 - Puedes ser juguetón y hacer chistes tontos
 - A veces menciona videojuegos o aventuras
 """
 
-model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=instruction)
-chat = model.start_chat(history=[])
+model = None
+
+def iniciar_gemini():
+    """Configura el cliente de Gemini y le pasa el modelo a la memoria de la conversación"""
+    global model
+    
+    genai.configure(api_key=GEMINI_API_KEY)
+    model = genai.GenerativeModel('gemini-2.5-flash', system_instruction=instruction)
+    MEMORIA.modelo = model
+    # Sin la personalidad de BIMO: solo resume
+    MEMORIA.modelo_resumen = genai.GenerativeModel('gemini-2.5-flash') if RESUMEN_CON_GEMINI else None
+
+# ==========================================
+# MEMORIA DE LA CONVERSACIÓN
+# ==========================================
+
+class MemoriaConversacion:
+    """Historial que se le manda a Gemini en cada mensaje. Se queda con los
+    últimos turnos dentro de un presupuesto de turnos y tokens; los más
+    viejos se doblan en un resumen corto. Los mensajes de herramientas
+    ("La hora es ...") no se guardan: solo lo que BIMO contestó"""
+    
+    def __init__(self, max_turnos, max_tokens, max_resumen):
+        self.max_turnos = max_turnos
+        self.max_tokens = max_tokens
+        self.max_resumen = max_resumen  # Caracteres
+        self.modelo = None
+        self.modelo_resumen = None  # Si es None el resumen se arma localmente
+        self.turnos = []  # [(texto del usuario, texto de BIMO)]
+        self.ultimo_turno = 0.0  # time.monotonic() del último intercambio guardado
+        self.resumen = ""
+        self.metricas = deque(maxlen=200)  # Una entrada por mensaje enviado
+        self._version_resumen = 0
+        self._candado = threading.Lock()
+    
+    @staticmethod
+    def _tokens(texto):
+        return len(texto) // 4 + 1  # Aproximado: ~4 caracteres por token en español
+    
+    def _contenidos(self, mensaje):
+        contenidos = []
+        if self.resumen:
+            contenidos.append({"role": "user", "parts": [f"(Resumen de lo que hablamos antes: {self.resumen})"]})
+            contenidos.append({"role": "model", "parts": ["¡Lo recuerdo!"]})
+        for usuario, bimo in self.turnos:
+            contenidos.append({"role": "user", "parts": [usuario]})
+            contenidos.append({"role": "model", "parts": [bimo]})
+        contenidos.append({"role": "user", "parts": [mensaje]})
+        return contenidos
+    
+    def _recortar(self):
+        """Dobla en el resumen los turnos que se pasan del presupuesto"""
+        doblados = []
+        tokens = sum(self._tokens(u) + self._tokens(b) for u, b in self.turnos)
+        while self.turnos and (len(self.turnos) > self.max_turnos or tokens > self.max_tokens):
+            usuario, bimo = self.turnos.pop(0)
+            tokens -= self._tokens(usuario) + self._tokens(bimo)
+            doblados.append((usuario, bimo))
+        if not doblados:
+            return
+        
+        previo = self.resumen
+        self.resumen = self._resumen_local(previo, doblados)
+        self._version_resumen += 1
+        if self.modelo_resumen is not None:
+            threading.Thread(target=self._resumir_con_gemini,
+                             args=(previo, doblados, self._version_resumen), daemon=True).start()
+    
+    def _resumen_local(self, previo, doblados):
+        """Respaldo sin red: lo esencial de cada turno, recortado"""
+        limpio = lambda texto: " ".join(re.sub(r"\[[^\]]*\]", " ", texto).split())[:80]
+        nuevos = " | ".join(f"Usuario: {limpio(u)}; BIMO: {limpio(b)}" for u, b in doblados)
+        resumen = f"{previo} | {nuevos}" if previo else nuevos
+        if len(resumen) > self.max_resumen:
+            resumen = resumen[-self.max_resumen:]
+            resumen = resumen[resumen.find(" | ") + 3:] if " | " in resumen else resumen
+        return resumen
+    
+    def _resumir_con_gemini(self, previo, doblados, version):
+        conversacion = "\n".join(f"Usuario: {u}\nBIMO: {b}" for u, b in doblados)
+        peticion = (f"Resume en español, en menos de {self.max_resumen} caracteres, lo que vale la pena "
+                    "recordar de esta conversación entre un usuario y su asistente BIMO (nombres, gustos, "
+                    "planes, pendientes). Solo el resumen, sin saludos.\n\n"
+                    f"Resumen anterior: {previo or '(nada)'}\n\nConversación nueva:\n{conversacion}")
+        try:
+            resumen = self.modelo_resumen.generate_content(peticion).text.strip()[:self.max_resumen]
+        except Exception as e:
+            log(f"Resumen local (Gemini no respondió: {e})", "warning")
+            return
+        with self._candado:
+            if resumen and self._version_resumen == version:  # Si ya se dobló algo más, gana el local
+                self.resumen = resumen
+    
+    def _registrar(self, mensaje, texto, efimero, tokens_estimados, uso):
+        with self._candado:
+            if efimero and self.turnos:
+                # El resultado de la herramienta se pega a la respuesta que lo pidió
+                usuario, bimo = self.turnos[-1]
+                self.turnos[-1] = (usuario, f"{bimo} {texto}")
+            elif not efimero:
+                self.turnos.append((mensaje, texto))
+            self.ultimo_turno = time.monotonic()
+            metrica = {
+                "turnos": len(self.turnos),
+                "caracteres_resumen": len(self.resumen),
+                "tokens_historial": tokens_estimados,
+                "tokens_prompt": getattr(uso, "prompt_token_count", None),
+                "tokens_respuesta": getattr(uso, "candidates_token_count", None),
+            }
+            self.metricas.append(metrica)
+        log(f"🧠 Memoria: {metrica['turnos']} turnos, resumen {metrica['caracteres_resumen']} caracteres, "
+            f"~{tokens_estimados} tokens de historial (prompt real: {metrica['tokens_prompt']})")
+    
+    def _fragmentos(self, respuesta, mensaje, efimero, tokens_estimados, etapa, inicio):
+        """Pasa los fragmentos del streaming y guarda el turno al terminar"""
+        texto = ""
+        uso = None
+        for fragmento in respuesta:
+            if not texto:
+                marcar(f"{etapa}_primer_fragmento", inicio)
+            texto += fragmento.text
+            uso = getattr(fragmento, "usage_metadata", None) or uso
+            yield fragmento
+        marcar(etapa, inicio, tokens_historial=tokens_estimados)
+        self._registrar(mensaje, texto, efimero, tokens_estimados, uso)
+    
+    def enviar(self, mensaje, stream=False, efimero=False):
+        """Como chat.send_message, pero con el historial acotado.
+        efimero=True para mensajes de herramientas que no se recuerdan"""
+        with self._candado:
+            self._recortar()
+            contenidos = self._contenidos(mensaje)
+        tokens_estimados = sum(self._tokens(c["parts"][0]) for c in contenidos[:-1])
+        
+        inicio = time.perf_counter()
+        etapa = "gemini_herramienta" if efimero else "gemini"
+        if stream:
+            respuesta = self.modelo.generate_content(contenidos, stream=True)
+            return self._fragmentos(respuesta, mensaje, efimero, tokens_estimados, etapa, inicio)
+        with Tramo(etapa, tokens_historial=tokens_estimados):
+            respuesta = self.modelo.generate_content(contenidos)
+        self._registrar(mensaje, respuesta.text, efimero, tokens_estimados, getattr(respuesta, "usage_metadata", None))
+        return respuesta
+    
+    def anotar(self, mensaje, texto):
+        """Guarda un intercambio que se respondió sin Gemini (para que tenga contexto después)"""
+        with self._candado:
+            self.turnos.append((mensaje, texto))
+            self.ultimo_turno = time.monotonic()
+    
+    def reciente(self, segundos):
+        """¿Hubo un intercambio hace menos de estos segundos?"""
+        return bool(self.turnos) and time.monotonic() - self.ultimo_turno < segundos
+    
+    def olvidar(self):
+        with self._candado:
+            self.turnos.clear()
+            self.resumen = ""
+            self._version_resumen += 1
+
+MEMORIA = MemoriaConversacion(MEMORIA_MAX_TURNOS, MEMORIA_MAX_TOKENS, MEMORIA_MAX_RESUMEN)
+
+# ==========================================
+# CACHE DE RESPUESTAS
+# ==========================================
+
+MULETILLAS = {"eh", "em", "emm", "mm", "mmm", "ah", "aja", "pues", "bueno", "oye", "hey", "ey",
+              "porfa", "porfis", "plis"}
+# Preguntas que empiezan así siguen una conversación ("¿y mañana?", "¿por qué?", "sí")
+CONECTORES_SEGUIMIENTO = {"y", "e", "pero", "entonces", "por", "porque", "si", "no", "tambien", "otra", "otro",
+                          "mas", "osea", "ok", "va", "ya"}
+REFERENCIAS_SEGUIMIENTO = {"eso", "esa", "ese", "esos", "esas", "esto", "ello", "mismo", "anterior"}
+
+class CacheRespuestas:
+    """Respuestas de Gemini a preguntas que se repiten ("cuéntame un chiste",
+    "¿quién eres?"). La clave es el texto reconocido sin acentos, muletillas
+    ni la palabra de activación. Solo se usan para preguntas que se
+    entienden solas (no para "¿y por qué?"). Expiran por tiempo y se expulsan
+    por LRU. Las preguntas que piden variedad juntan varias respuestas y se
+    van turnando; las respuestas con comandos nunca se guardan"""
+    
+    def __init__(self, max_entradas, ttl, variaciones, palabras_variar):
+        self.max_entradas = max_entradas
+        self.ttl = ttl
+        self.variaciones = variaciones  # Respuestas distintas por pregunta que pide variedad
+        self.palabras_variar = set(palabras_variar)
+        self._entradas = OrderedDict()  # clave -> {"momento", "respuestas", "siguiente", "variar"}
+        self._candado = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+    
+    def clave(self, texto):
+        """texto es lo que se escuchó completo, con la palabra de activación.
+        Esa se quita solo como palabra entera en una orilla (al principio o,
+        si ahí no estaba, al final): "¿cómo se llama mi primo?" no pierde "primo" """
+        activacion = {normalizar_texto(t) for t in TRIGGERS}
+        texto = re.sub(r"\ba ver\b", " ", normalizar_texto(texto))
+        palabras = [p for p in texto.split() if p not in MULETILLAS]
+        es_activacion = lambda palabra: any(palabra == t or palabra.rstrip("s") == t for t in activacion)
+        if palabras and es_activacion(palabras[0]):
+            palabras.pop(0)
+        elif palabras and es_activacion(palabras[-1]):
+            palabras.pop()
+        return " ".join(palabras)
+    
+    @staticmethod
+    def independiente(clave, conversacion_reciente):
+        """¿La pregunta se entiende sin lo que se venía hablando?"""
+        palabras = clave.split()
+        if len(palabras) < 2 or palabras[0] in CONECTORES_SEGUIMIENTO:
+            return False
+        if REFERENCIAS_SEGUIMIENTO & set(palabras):
+            return False
+        # Justo después de platicar, las preguntas cortas suelen depender del contexto
+        return not conversacion_reciente or len(palabras) >= 3
+    
+    def obtener(self, texto, conversacion_reciente=False):
+        """Respuesta guardada o None (también None cuando falta juntar
+        variaciones o la pregunta depende de la conversación)"""
+        clave = self.clave(texto)
+        if not self.independiente(clave, conversacion_reciente):
+            return None
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada and time.time() - entrada["momento"] > self.ttl:
+                del self._entradas[clave]
+                entrada = None
+            if not entrada or (entrada["variar"] and len(entrada["respuestas"]) < self.variaciones):
+                self.fallos += 1
+                return None
+            self._entradas.move_to_end(clave)
+            respuestas = entrada["respuestas"]
+            respuesta = respuestas[entrada["siguiente"] % len(respuestas)]
+            entrada["siguiente"] += 1
+            self.aciertos += 1
+            return respuesta
+    
+    def guardar(self, texto, respuesta, conversacion_reciente=False):
+        """Guarda la respuesta si se puede repetir tal cual. Devuelve True si se guardó"""
+        clave = self.clave(texto)
+        if not self.independiente(clave, conversacion_reciente) or not respuesta or not respuesta.strip():
+            return False
+        if any(f.tipo == "comando" for f in tokenizar_respuesta(respuesta)):
+            return False  # Hora, clima, temporizadores...: cambian o tienen efectos
+        
+        with self._candado:
+            entrada = self._entradas.get(clave)
+            if entrada is None:
+                entrada = self._entradas[clave] = {
+                    "momento": time.time(), "respuestas": [], "siguiente": 0,
+                    "variar": bool(self.palabras_variar & set(clave.split())),
+                }
+            if respuesta in entrada["respuestas"] or len(entrada["respuestas"]) >= self.variaciones:
+                return False
+            entrada["respuestas"].append(respuesta)
+            self._entradas.move_to_end(clave)
+            while len(self._entradas) > self.max_entradas:
+                self._entradas.popitem(last=False)
+        return True
+    
+    def resumen(self):
+        total = self.aciertos + self.fallos
+        return f"{len(self._entradas)} preguntas, {self.aciertos}/{total} respondidas desde cache"
+
+CACHE_RESPUESTAS = CacheRespuestas(MAX_RESPUESTAS_CACHE, TTL_RESPUESTAS, VARIACIONES_RESPUESTA, PALABRAS_VARIAR_RESPUESTA)
 
 # ==========================================
 # VARIABLES GLOBALES
 # ==========================================
 
-ESTADO_EMOCION = "NEUTRO"
-ESTADO_HABLANDO = False
-ESPERANDO_ORDEN = False
-GENERANDO_RESPUESTA = False  # Nueva: para mostrar "pensando"
+Instantanea = namedtuple("Instantanea", "emocion hablando esperando_orden generando version version_emocion")
+
+class EstadoAsistente:
+    """Estado compartido entre el hilo de escucha, los temporizadores y el render.
+    Cada cambio sube la versión y avisa a los suscriptores; el render lee una
+    instantánea consistente por cuadro en vez de varios globals sueltos"""
+    
+    def __init__(self):
+        self._candado = threading.Lock()
+        self._valores = {"emocion": "NEUTRO", "hablando": False,
+                         "esperando_orden": False, "generando": False}  # generando: mostrar "pensando"
+        self._versiones = dict.fromkeys(self._valores, 0)
+        self._version = 0
+        self._suscriptores = []
+    
+    @property
+    def emocion(self):
+        return self._valores["emocion"]
+    
+    @property
+    def hablando(self):
+        return self._valores["hablando"]
+    
+    @property
+    def esperando_orden(self):
+        return self._valores["esperando_orden"]
+    
+    @property
+    def generando(self):
+        return self._valores["generando"]
+    
+    def instantanea(self):
+        with self._candado:
+            return self._instantanea()
+    
+    def _instantanea(self):
+        v = self._valores
+        return Instantanea(v["emocion"], v["hablando"], v["esperando_orden"], v["generando"],
+                           self._version, self._versiones["emocion"])
+    
+    def suscribir(self, funcion):
+        """funcion(instantanea, campos_cambiados) se llama tras cada cambio"""
+        with self._candado:
+            self._suscriptores.append(funcion)
+    
+    def actualizar(self, **cambios):
+        """Aplica los cambios y devuelve la instantánea resultante"""
+        return self._aplicar(cambios, None)
+    
+    def actualizar_si(self, campo, version, valor):
+        """Cambia campo solo si nadie lo modificó desde la versión dada.
+        Así un reset de emoción viejo no pisa una emoción más nueva"""
+        return self._aplicar({campo: valor}, (campo, version))
+    
+    def _aplicar(self, cambios, condicion):
+        with self._candado:
+            if condicion and self._versiones[condicion[0]] != condicion[1]:
+                return None
+            cambiados = [c for c, valor in cambios.items() if self._valores[c] != valor]
+            if cambiados:
+                self._version += 1
+                for campo in cambiados:
+                    self._valores[campo] = cambios[campo]
+                    self._versiones[campo] = self._version
+            instantanea = self._instantanea()
+            suscriptores = list(self._suscriptores) if cambiados else []
+        
+        for funcion in suscriptores:
+            try:
+                funcion(instantanea, cambiados)
+            except Exception as e:
+                log(f"Error en suscriptor de estado: {e}", "error")
+        return instantanea
+
+ESTADO = EstadoAsistente()
 
 # Animación mejorada
 TICK = 0
 PARPADEO_TIMER = 0
+OJOS_ABIERTOS = True
 BRILLO_OJOS = 0
 ANIMACION_BOCA = 0
 EXPRESION_TIMER = 0
-PARTICULAS = []  # Para efectos especiales
 
 # ==========================================
-# CLASE PARTÍCULA (para efectos visuales)
+# SISTEMA DE PARTÍCULAS (para efectos visuales)
 # ==========================================
 
-class Particula:
-    def __init__(self, x, y, color=(255, 255, 255)):
-        self.x = x
-        self.y = y
-        self.vx = random.uniform(-2, 2)
-        self.vy = random.uniform(-3, -1)
-        self.vida = 30
-        self.color = color
-        self.tamano = random.randint(2, 5)
+class SistemaParticulas:
+    """Partículas guardadas en arreglos de NumPy preasignados. Se actualizan
+    todas en un paso vectorizado y se dibujan con sprites de alpha en cache"""
     
-    def update(self):
-        self.x += self.vx
-        self.y += self.vy
-        self.vy += 0.1  # Gravedad
-        self.vida -= 1
+    VIDA = 30
+    NIVELES_ALPHA = 16
     
-    def dibujar(self, pantalla):
-        if self.vida > 0:
-            alpha = int((self.vida / 30) * 255)
-            s = pygame.Surface((self.tamano * 2, self.tamano * 2))
-            s.set_alpha(alpha)
-            pygame.draw.circle(s, self.color, (self.tamano, self.tamano), self.tamano)
-            pantalla.blit(s, (int(self.x - self.tamano), int(self.y - self.tamano)))
+    def __init__(self, capacidad):
+        self.capacidad = capacidad
+        self.n = 0
+        self._arreglos = None
+        self._paleta = {}  # color -> índice
+        self._sprites = {}  # (tamaño, índice de color, nivel de alpha) -> Surface
+        self._secuencia = None  # [[sprite, [x, y]]] reutilizada por blits en cada cuadro
+        self._candado = threading.Lock()
+    
+    def __len__(self):
+        return self.n
+    
+    def _reservar(self):
+        # Se reserva en el primer uso para no importar NumPy al cargar el módulo
+        if self._arreglos is None:
+            self._rng = np.random.default_rng()
+            self._arreglos = {
+                "x": np.zeros(self.capacidad, np.float32),
+                "y": np.zeros(self.capacidad, np.float32),
+                "vx": np.zeros(self.capacidad, np.float32),
+                "vy": np.zeros(self.capacidad, np.float32),
+                "vida": np.zeros(self.capacidad, np.float32),
+                "tamano": np.zeros(self.capacidad, np.int16),
+                "color": np.zeros(self.capacidad, np.int16),
+            }
+            self._secuencia = [[None, [0, 0]] for _ in range(self.capacidad)]
+        return self._arreglos
+    
+    def vaciar(self):
+        with self._candado:
+            self.n = 0
+    
+    def emitir(self, x, y, cantidad, color):
+        """Agrega partículas; las que no quepan en la capacidad se descartan"""
+        with self._candado:
+            a = self._reservar()
+            cantidad = min(cantidad, self.capacidad - self.n)
+            if cantidad <= 0:
+                return
+            
+            tramo = slice(self.n, self.n + cantidad)
+            a["x"][tramo] = x
+            a["y"][tramo] = y
+            a["vx"][tramo] = self._rng.uniform(-2, 2, cantidad)
+            a["vy"][tramo] = self._rng.uniform(-3, -1, cantidad)
+            a["vida"][tramo] = self.VIDA
+            a["tamano"][tramo] = self._rng.integers(2, 6, cantidad)
+            a["color"][tramo] = self._paleta.setdefault(tuple(color), len(self._paleta))
+            self.n += cantidad
+    
+    def actualizar(self):
+        """Descarta las partículas muertas y mueve las demás un cuadro"""
+        with self._candado:
+            if self.n == 0:
+                return
+            a = self._arreglos
+            n = self.n
+            
+            vivas = a["vida"][:n] > 0
+            if not vivas.all():
+                n = int(vivas.sum())
+                for arreglo in a.values():
+                    arreglo[:n] = arreglo[:self.n][vivas]
+                self.n = n
+            
+            a["x"][:n] += a["vx"][:n]
+            a["y"][:n] += a["vy"][:n]
+            a["vy"][:n] += 0.1  # Gravedad
+            a["vida"][:n] -= 1
+    
+    def _sprite(self, clave):
+        sprite = self._sprites.get(clave)
+        if sprite is None:
+            tamano, color, nivel = clave
+            rgb = next(c for c, i in self._paleta.items() if i == color)
+            sprite = pygame.Surface((tamano * 2, tamano * 2))
+            sprite.set_colorkey((0, 0, 0))
+            sprite.set_alpha(nivel * 255 // (self.NIVELES_ALPHA - 1))
+            pygame.draw.circle(sprite, rgb, (tamano, tamano), tamano)
+            self._sprites[clave] = sprite
+        return sprite
+    
+    def dibujar(self, pantalla, devolver_rects=True):
+        """Dibuja las partículas vivas y devuelve los rectángulos que tocó"""
+        with self._candado:
+            if self.n == 0:
+                return []
+            a = self._arreglos
+            n = self.n
+            vivas = a["vida"][:n] > 0
+            tamanos = a["tamano"][:n][vivas]
+            xs = (a["x"][:n][vivas] - tamanos).astype(np.int32)
+            ys = (a["y"][:n][vivas] - tamanos).astype(np.int32)
+            niveles = (a["vida"][:n][vivas] * (self.NIVELES_ALPHA - 1) / self.VIDA).round().astype(np.int32)
+            
+            # Un sprite por combinación distinta, no uno por partícula
+            claves = (tamanos.astype(np.int32) * 65536 + a["color"][:n][vivas]) * self.NIVELES_ALPHA + niveles
+            unicas, indices = np.unique(claves, return_inverse=True)
+            sprites = [
+                self._sprite((c // self.NIVELES_ALPHA // 65536, c // self.NIVELES_ALPHA % 65536, c % self.NIVELES_ALPHA))
+                for c in unicas.tolist()
+            ]
+            # Se rellenan en su lugar las mismas listas de cada cuadro: armar miles
+            # de tuplas nuevas disparaba varias recolecciones del GC por cuadro
+            secuencia = self._secuencia
+            for elemento, sprite, x, y in zip(secuencia, map(sprites.__getitem__, indices.ravel().tolist()),
+                                               xs.tolist(), ys.tolist()):
+                elemento[0] = sprite
+                destino = elemento[1]
+                destino[0] = x
+                destino[1] = y
+            cuantas = len(xs)
+        
+        rects = pantalla.blits(itertools.islice(secuencia, cuantas), doreturn=devolver_rects)
+        return rects if devolver_rects else []
+
+PARTICULAS = SistemaParticulas(MAX_PARTICULAS)  # Para efectos especiales
 
 # ==========================================
-# FUNCIONES AUXILIARES
+# REGISTRO Y TRAZAS
 # ==========================================
 
+PREFIJOS_LOG = {
+    'info': '📝',
+    'success': '✅',
+    'error': '❌',
+    'warning': '⚠️',
+    'mic': '🎤',
+    'robot': '🤖',
+    'voice': '🗣️',
+}
+
+class SalidaRegistros:
+    """Escribe los logs y las trazas desde un hilo propio: quien llama solo
+    mete un dict en una cola y sigue, así una terminal o una tarjeta SD
+    lentas no frenan la escucha ni el render"""
+    
+    def __init__(self, max_en_cola, max_bytes_archivo):
+        self.max_bytes_archivo = max_bytes_archivo
+        self._cola = Queue(maxsize=max_en_cola)
+        self._hilo = None
+        self._archivos = {}  # ruta -> archivo abierto
+        self._candado = threading.Lock()
+        self.descartados = 0
+    
+    def enviar(self, registro):
+        if self._hilo is None:
+            self._arrancar()
+        try:
+            self._cola.put_nowait(registro)
+        except Full:
+            self.descartados += 1
+    
+    def _arrancar(self):
+        with self._candado:
+            if self._hilo is None:
+                self._hilo = threading.Thread(target=self._escribir, daemon=True, name="salida")
+                self._hilo.start()
+                atexit.register(self.vaciar)
+    
+    def _escribir(self):
+        while True:
+            registro = self._cola.get()
+            try:
+                self._emitir(registro)
+                if self._cola.empty():
+                    for archivo in self._archivos.values():
+                        archivo.flush()
+            except Exception:
+                pass  # Un registro raro nunca tumba la salida
+            finally:
+                self._cola.task_done()
+    
+    def _emitir(self, registro):
+        if registro["clase"] == "log":
+            print(f"{PREFIJOS_LOG.get(registro['tipo'], '📝')} {registro['mensaje']}")
+            ruta = ARCHIVO_REGISTRO
+        else:
+            ruta = ARCHIVO_TRAZAS
+        if ruta:
+            archivo = self._archivos.get(ruta)
+            if archivo is None:
+                archivo = self._archivos[ruta] = open(ruta, "a", encoding="utf-8")
+            archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+            if archivo.tell() > self.max_bytes_archivo:
+                self._rotar(ruta)
+    
+    def _rotar(self, ruta):
+        """El archivo lleno pasa a ruta.1 (reemplazando al anterior) y se empieza otro"""
+        self._archivos.pop(ruta).close()
+        try:
+            os.replace(ruta, f"{ruta}.1")
+        except OSError:
+            pass
+    
+    def vaciar(self, timeout=2.0):
+        """Espera a que se escriba lo pendiente (se llama al salir)"""
+        limite = time.monotonic() + timeout
+        while self._cola.unfinished_tasks and time.monotonic() < limite:
+            time.sleep(0.01)
+
+SALIDA = SalidaRegistros(MAX_REGISTROS_EN_COLA, int(MAX_MB_REGISTROS * 1024 * 1024))
+
 def log(mensaje, tipo="info"):
-    """Imprime mensajes con formato"""
+    """Imprime mensajes con formato (desde el hilo de salida, sin esperar)"""
     if not DEBUG_MODE:
         return
+    traza = _TRAZA.get()
+    SALIDA.enviar({
+        "clase": "log",
+        "momento": round(time.time(), 3),
+        "tipo": tipo,
+        "mensaje": str(mensaje),
+        "traza": traza.id if traza else None,
+        "hilo": threading.current_thread().name,
+    })
+
+_TRAZA = contextvars.ContextVar("traza_bimo", default=None)
+
+class Traza:
+    """Tiempos de todas las etapas de una frase, desde que empezó la voz
+    hasta que BIMO terminó de contestar"""
     
-    prefijos = {
-        'info': '📝',
-        'success': '✅',
-        'error': '❌',
-        'warning': '⚠️',
-        'mic': '🎤',
-        'robot': '🤖',
-        'voice': '🗣️',
-    }
+    def __init__(self, inicio=None):
+        self.id = os.urandom(4).hex()
+        self.inicio = inicio or time.perf_counter()
+        self.momento = time.time() - (time.perf_counter() - self.inicio)
+        self.tramos = []
+        self.datos = {}  # ruta, texto...
     
-    prefijo = prefijos.get(tipo, '📝')
-    print(f"{prefijo} {mensaje}")
+    def agregar(self, etapa, inicio, fin, **datos):
+        tramo = {"etapa": etapa, "inicio_ms": round((inicio - self.inicio) * 1000, 1),
+                 "ms": round((fin - inicio) * 1000, 1)}
+        tramo.update((clave, valor) for clave, valor in datos.items() if valor is not None)
+        self.tramos.append(tramo)
+
+class Tramo:
+    """with Tramo("sintesis"): ... mide esa etapa dentro de la traza actual (si la hay)"""
+    __slots__ = ("etapa", "datos", "inicio")
+    
+    def __init__(self, etapa, **datos):
+        self.etapa = etapa
+        self.datos = datos
+    
+    def __enter__(self):
+        self.inicio = time.perf_counter()
+        return self
+    
+    def __exit__(self, tipo, valor, rastreo):
+        marcar(self.etapa, self.inicio, error=tipo.__name__ if tipo else None, **self.datos)
+        return False
+
+def marcar(etapa, inicio, **datos):
+    """Anota en la traza actual una etapa que empezó en inicio (perf_counter) y termina ahora"""
+    traza = _TRAZA.get()
+    if traza is not None:
+        traza.agregar(etapa, inicio, time.perf_counter(), **datos)
+
+def iniciar_traza(audio=None):
+    """Abre la traza de una frase. Si el audio trae los tiempos de la
+    captura, la traza empieza cuando empezó la voz"""
+    tiempos = getattr(audio, "tiempos", None)
+    traza = Traza(tiempos[0] if tiempos else None)
+    if tiempos:
+        inicio_voz, ultima_voz, cierre = tiempos
+        traza.agregar("voz", inicio_voz, ultima_voz)
+        traza.agregar("fin_de_frase", ultima_voz, cierre)  # Silencio hasta dar la frase por terminada
+        traza.agregar("cola_audio", cierre, time.perf_counter())
+    _TRAZA.set(traza)
+    return traza
+
+def terminar_traza(traza):
+    _TRAZA.set(None)
+    if traza.datos.get("ruta") in (None, "descartada"):
+        return  # Ruido o frases sin "bimo": no llenan la terminal ni la tarjeta SD
+    total = (time.perf_counter() - traza.inicio) * 1000
+    if DEBUG_MODE:
+        etapas = " | ".join(f"{t['etapa']} {t['ms']:.0f}" for t in traza.tramos if t["ms"] >= 50)
+        log(f"⏱️ Traza {traza.id} ({traza.datos['ruta']}): {total:.0f} ms — {etapas}")
+    if ARCHIVO_TRAZAS:
+        registro = {"clase": "traza", "id": traza.id, "momento": round(traza.momento, 3), "total_ms": round(total, 1)}
+        registro.update(traza.datos)
+        registro["tramos"] = traza.tramos
+        SALIDA.enviar(registro)
+
+def con_traza(funcion):
+    """Para pasar a otro hilo o ejecutor: la función corre con la traza de quien la llamó"""
+    contexto = contextvars.copy_context()
+    return lambda *args, **kwargs: contexto.run(funcion, *args, **kwargs)
+
+# ==========================================
+# FUNCIONES AUXILIARES
+# ==========================================
 
 def obtener_hora_sistema():
     ahora = datetime.datetime.now()
@@ -248,76 +1087,234 @@ def obtener_fecha_sistema():
     dias = ["lunes", "martes", "miércoles", "jueves", "viernes", "sábado", "domingo"]
     return f"{dias[ahora.weekday()]} {ahora.day} de {meses[ahora.month-1]} de {ahora.year}"
 
-def calcular_expresion(expresion):
+def buscar_web(consulta):
+    return f"Necesitarías configurar una API de búsqueda para '{consulta}'."
+
+def cargar_json(ruta, defecto):
+    """Lee un archivo JSON; si no existe o está dañado devuelve el defecto"""
     try:
-        expresion = expresion.replace("x", "*").replace("÷", "/").replace("^", "**")
-        import math
-        funciones_permitidas = {
-            'sqrt': math.sqrt, 'sin': math.sin, 'cos': math.cos,
-            'tan': math.tan, 'log': math.log, 'abs': abs,
-            'round': round, 'pi': math.pi, 'e': math.e
-        }
-        resultado = eval(expresion, {"__builtins__": {}}, funciones_permitidas)
-        return str(resultado)
-    except Exception as e:
-        log(f"Error en cálculo: {e}", "error")
-        return "No pude calcular eso"
+        with open(ruta, encoding="utf-8") as archivo:
+            return json.load(archivo)
+    except (OSError, ValueError):
+        return defecto
 
-def convertir_unidades(cantidad, de, a):
+def guardar_json(ruta, datos):
+    """Escribe un JSON de forma atómica (un corte de luz no deja el archivo a medias)"""
+    temporal = f"{ruta}.tmp"
     try:
-        if de.lower() in ['c', 'celsius'] and a.lower() in ['f', 'fahrenheit']:
-            return (cantidad * 9/5) + 32
-        elif de.lower() in ['f', 'fahrenheit'] and a.lower() in ['c', 'celsius']:
-            return (cantidad - 32) * 5/9
-        
-        conversiones = {
-            ('km', 'mi'): 0.621371, ('mi', 'km'): 1.60934,
-            ('m', 'ft'): 3.28084, ('ft', 'm'): 0.3048,
-            ('cm', 'in'): 0.393701, ('in', 'cm'): 2.54,
-            ('kg', 'lb'): 2.20462, ('lb', 'kg'): 0.453592,
-            ('g', 'oz'): 0.035274, ('oz', 'g'): 28.3495
-        }
-        
-        clave = (de.lower(), a.lower())
-        if clave in conversiones:
-            return cantidad * conversiones[clave]
-        
-        if de.upper() in ['USD', 'EUR', 'MXN', 'GBP', 'JPY']:
-            return convertir_moneda(cantidad, de.upper(), a.upper())
-        
-        return None
-    except Exception as e:
-        log(f"Error conversión: {e}", "error")
-        return None
+        with open(temporal, "w", encoding="utf-8") as archivo:
+            json.dump(datos, archivo, ensure_ascii=False)
+        os.replace(temporal, ruta)
+    except OSError as e:
+        log(f"No pude guardar {ruta}: {e}", "error")
 
-def convertir_moneda(cantidad, de, a):
+# ==========================================
+# CALCULADORA SEGURA
+# ==========================================
+
+# La expresión viene de Gemini (o de lo que dijo un niño curioso): nunca se
+# le pasa a eval. Se compila el árbol sintáctico a funciones de Python con
+# una lista blanca de nodos y límites que impiden trabarse en un número enorme
+MAX_LONGITUD_CALCULO = 200  # Caracteres
+MAX_PROFUNDIDAD_CALCULO = 30  # Niveles del árbol sintáctico
+MAX_EXPONENTE_CALCULO = 1000
+MAX_MAGNITUD_CALCULO = 1e100  # Resultados (y pasos intermedios) más grandes se rechazan
+PLAZO_CALCULO = 0.05  # Segundos máximos evaluando
+
+FUNCIONES_CALCULO = {
+    "sqrt": (math.sqrt, 1), "raiz": (math.sqrt, 1),
+    "sin": (math.sin, 1), "cos": (math.cos, 1), "tan": (math.tan, 1),
+    "log": (math.log, 2), "log10": (math.log10, 1), "exp": (math.exp, 1),
+    "abs": (abs, 1), "round": (round, 2),
+}  # nombre -> (función, máximo de argumentos)
+CONSTANTES_CALCULO = {"pi": math.pi, "e": math.e}
+
+class ErrorCalculo(ValueError):
+    """La expresión no está permitida o se sale de los límites"""
+
+def _acotar(valor):
+    if isinstance(valor, complex):
+        raise ErrorCalculo("resultado complejo")
+    if isinstance(valor, float) and not math.isfinite(valor):
+        raise ErrorCalculo("resultado no finito")
+    if abs(valor) > MAX_MAGNITUD_CALCULO:
+        raise ErrorCalculo("resultado demasiado grande")
+    return valor
+
+def _potencia(base, exponente):
+    """Revisa el tamaño antes de calcular: 9**9**9 se rechaza sin intentarlo"""
+    if abs(exponente) > MAX_EXPONENTE_CALCULO:
+        raise ErrorCalculo("exponente demasiado grande")
+    if abs(base) > 1 and exponente > 0 and exponente * math.log10(abs(base)) > math.log10(MAX_MAGNITUD_CALCULO):
+        raise ErrorCalculo("resultado demasiado grande")
+    return base ** exponente
+
+_OPERACIONES_CALCULO = {
+    "Add": lambda a, b: a + b,
+    "Sub": lambda a, b: a - b,
+    "Mult": lambda a, b: a * b,
+    "Div": lambda a, b: a / b,
+    "FloorDiv": lambda a, b: a // b,
+    "Mod": lambda a, b: a % b,
+    "Pow": _potencia,
+}
+_UNARIAS_CALCULO = {"UAdd": lambda a: a, "USub": lambda a: -a}
+
+def _compilar_nodo(nodo, profundidad):
+    """Convierte un nodo permitido en una función limite -> número"""
+    if profundidad > MAX_PROFUNDIDAD_CALCULO:
+        raise ErrorCalculo("expresión demasiado anidada")
+    tipo = type(nodo).__name__
+
+    if tipo == "Constant" and type(nodo.value) in (int, float):
+        valor = _acotar(nodo.value)
+        return lambda limite: valor
+    if tipo == "Name" and nodo.id in CONSTANTES_CALCULO:
+        valor = CONSTANTES_CALCULO[nodo.id]
+        return lambda limite: valor
+    if tipo == "UnaryOp" and type(nodo.op).__name__ in _UNARIAS_CALCULO:
+        operacion = _UNARIAS_CALCULO[type(nodo.op).__name__]
+        operando = _compilar_nodo(nodo.operand, profundidad + 1)
+        return lambda limite: operacion(operando(limite))
+    if tipo == "BinOp" and type(nodo.op).__name__ in _OPERACIONES_CALCULO:
+        operacion = _OPERACIONES_CALCULO[type(nodo.op).__name__]
+        izquierda = _compilar_nodo(nodo.left, profundidad + 1)
+        derecha = _compilar_nodo(nodo.right, profundidad + 1)
+
+        def binaria(limite):
+            a, b = izquierda(limite), derecha(limite)
+            if time.perf_counter() > limite:
+                raise ErrorCalculo("se acabó el tiempo")
+            return _acotar(operacion(a, b))
+        return binaria
+    if (tipo == "Call" and type(nodo.func).__name__ == "Name" and nodo.func.id in FUNCIONES_CALCULO
+            and not nodo.keywords and 1 <= len(nodo.args) <= FUNCIONES_CALCULO[nodo.func.id][1]):
+        funcion = FUNCIONES_CALCULO[nodo.func.id][0]
+        argumentos = [_compilar_nodo(argumento, profundidad + 1) for argumento in nodo.args]
+        return lambda limite: _acotar(funcion(*[argumento(limite) for argumento in argumentos]))
+
+    raise ErrorCalculo(f"no se permite {tipo}")
+
+@lru_cache(maxsize=256)
+def compilar_calculo(expresion):
+    """Texto -> función compilada (memorizada: la misma cuenta no se vuelve a analizar)"""
+    if len(expresion) > MAX_LONGITUD_CALCULO:
+        raise ErrorCalculo("expresión demasiado larga")
+    expresion = re.sub(r"(?<![a-z_])x(?![a-z_])|×", "*", expresion.lower())
+    expresion = expresion.replace("÷", "/").replace("^", "**").replace("π", "pi").replace("√", "sqrt")
     try:
-        url = f"https://api.exchangerate-api.com/v4/latest/{de}"
-        resp = requests.get(url, timeout=5).json()
-        tasa = resp['rates'][a]
-        return cantidad * tasa
-    except Exception as e:
-        log(f"Error conversión moneda: {e}", "error")
-        return None
+        arbol = ast.parse(expresion.strip(), mode="eval")
+    except (SyntaxError, RecursionError) as e:
+        raise ErrorCalculo("no es una expresión") from e
+    return _compilar_nodo(arbol.body, 0)
 
-def buscar_web(consulta):
-    return f"Necesitarías configurar una API de búsqueda para '{consulta}'."
+def calcular_expresion(expresion):
+    try:
+        resultado = compilar_calculo(expresion)(time.perf_counter() + PLAZO_CALCULO)
+        return str(resultado)
+    except (ArithmeticError, ValueError, TypeError) as e:
+        log(f"Error en cálculo: {e}", "error")
+        return "No pude calcular eso"
 
 # ==========================================
 # CLIMA CON GEOLOCALIZACIÓN
 # ==========================================
 
+class CacheGeocodificacion:
+    """Coordenadas por nombre de ciudad, guardadas en disco (no cambian).
+    La clave va sin acentos ni mayúsculas y se toleran errores del
+    reconocimiento de voz ("colimma" -> "colima") por parecido"""
+    
+    def __init__(self, archivo, parecido=0.85):
+        self.archivo = archivo
+        self.parecido = parecido
+        self._ciudades = None  # clave -> {"lat", "lon", "nombre"}; se lee en el primer uso
+        self._candado = threading.Lock()
+    
+    def _cargadas(self):
+        if self._ciudades is None:
+            self._ciudades = cargar_json(self.archivo, {}) if self.archivo else {}
+        return self._ciudades
+    
+    def obtener(self, ciudad):
+        clave = normalizar_texto(ciudad)
+        with self._candado:
+            ciudades = self._cargadas()
+            if clave not in ciudades:
+                parecidas = difflib.get_close_matches(clave, list(ciudades), n=1, cutoff=self.parecido)
+                if not parecidas:
+                    return None
+                clave = parecidas[0]
+            return ciudades[clave]
+    
+    def guardar(self, ciudad, lat, lon, nombre):
+        entrada = {"lat": lat, "lon": lon, "nombre": nombre}
+        with self._candado:
+            ciudades = self._cargadas()
+            ciudades[normalizar_texto(ciudad)] = entrada
+            # El nombre oficial también sirve de clave ("cdmx" -> "Ciudad de México")
+            ciudades.setdefault(normalizar_texto(nombre.split(",")[0]), entrada)
+            if self.archivo:
+                guardar_json(self.archivo, ciudades)
+
+class CacheClima:
+    """Clima actual por coordenadas redondeadas (~1 km). Fresco: se usa tal
+    cual. Viejo pero no tanto: se usa y se actualiza en segundo plano.
+    Más viejo: se consulta y se espera"""
+    
+    def __init__(self, ttl, ttl_viejo):
+        self.ttl = ttl
+        self.ttl_viejo = ttl_viejo
+        self._entradas = {}  # (lat, lon) -> (momento, datos)
+        self._candado = threading.Lock()
+        self._en_curso = ConsultasEnCurso()
+    
+    def _consultar(self, clave, consultar):
+        datos = consultar()
+        with self._candado:
+            self._entradas[clave] = (time.time(), datos)
+        return datos
+    
+    def _refrescar(self, clave, consultar):
+        try:
+            self._en_curso.ejecutar(clave, lambda: self._consultar(clave, consultar))
+        except Exception as e:
+            log(f"No se pudo refrescar el clima: {e}", "warning")
+    
+    def obtener(self, lat, lon, consultar):
+        clave = (round(lat, 2), round(lon, 2))
+        with self._candado:
+            entrada = self._entradas.get(clave)
+        
+        if entrada:
+            edad = time.time() - entrada[0]
+            if edad < self.ttl:
+                return entrada[1]
+            if edad < self.ttl_viejo:
+                if not self._en_curso.ocupada(clave):
+                    threading.Thread(target=self._refrescar, args=(clave, consultar), daemon=True).start()
+                return entrada[1]
+        
+        return self._en_curso.ejecutar(clave, lambda: self._consultar(clave, consultar))
+
+CACHE_GEOCODIFICACION = CacheGeocodificacion(ARCHIVO_GEOCODIFICACION)
+CACHE_CLIMA = CacheClima(TTL_CLIMA, TTL_CLIMA_VIEJO)
+
 def obtener_coordenadas(ciudad):
+    guardada = CACHE_GEOCODIFICACION.obtener(ciudad)
+    if guardada:
+        return guardada["lat"], guardada["lon"], guardada["nombre"]
+    
     try:
         log(f"Buscando coordenadas de: {ciudad}")
-        url = f"https://geocoding-api.open-meteo.com/v1/search?name={ciudad}&count=1&language=es&format=json"
-        resp = requests.get(url, timeout=5).json()
+        resp = HTTP.obtener_json("geocodificacion", params={"name": ciudad, "count": 1, "language": "es", "format": "json"})
         
         if "results" in resp and resp["results"]:
             lat = resp['results'][0]['latitude']
             lon = resp['results'][0]['longitude']
             nombre = resp['results'][0]['name']
             pais = resp['results'][0].get('country', '')
+            CACHE_GEOCODIFICACION.guardar(ciudad, lat, lon, f"{nombre}, {pais}")
             return lat, lon, f"{nombre}, {pais}"
         else:
             return None, None, None
@@ -325,7 +1322,19 @@ def obtener_coordenadas(ciudad):
         log(f"Error Geocoding: {e}", "error")
         return None, None, None
 
-def obtener_clima_dinamico(ciudad_solicitada):
+def describir_codigo_clima(codigo):
+    """Código WMO de Open-Meteo -> estado del cielo en palabras"""
+    if codigo == 0: return "cielo despejado"
+    if codigo <= 3: return "nublado"
+    if codigo <= 48: return "con neblina"
+    if codigo <= 67: return "lluvioso"
+    if codigo >= 95: return "con truenos"
+    if codigo >= 80: return "tormentoso"
+    return "normal"
+
+def obtener_datos_clima(ciudad_solicitada):
+    """Devuelve {"lugar", "temperatura", "estado", "viento", "codigo"}
+    o {"error": mensaje} si algo falló"""
     try:
         # Si es AUTO, usar geolocalización
         if ciudad_solicitada.upper() == "AUTO":
@@ -339,93 +1348,491 @@ def obtener_clima_dinamico(ciudad_solicitada):
                 # Si no, geocodificar la ciudad
                 lat, lon, nombre_real = obtener_coordenadas(ubicacion['ciudad'])
                 if not lat:
-                    return f"No pude detectar tu ubicación correctamente."
+                    return {"error": "No pude detectar tu ubicación correctamente."}
         else:
             lat, lon, nombre_real = obtener_coordenadas(ciudad_solicitada)
             if not lat:
-                return f"No pude encontrar {ciudad_solicitada}."
+                return {"error": f"No pude encontrar {ciudad_solicitada}."}
 
-        log(f"Consultando clima en {nombre_real}")
-        url = f"https://api.open-meteo.com/v1/forecast?latitude={lat}&longitude={lon}&current_weather=true"
-        datos = requests.get(url, timeout=5).json()
-        
-        temp = datos['current_weather']['temperature']
-        codigo = datos['current_weather']['weathercode']
-        viento = datos['current_weather']['windspeed']
+        def consultar():
+            log(f"Consultando clima en {nombre_real}")
+            params = {"latitude": lat, "longitude": lon, "current_weather": "true"}
+            return HTTP.obtener_json("pronostico", params=params)['current_weather']
         
-        estado = "normal"
-        if codigo == 0: estado = "cielo despejado"
-        elif codigo <= 3: estado = "nublado"
-        elif codigo <= 48: estado = "con neblina"
-        elif codigo <= 67: estado = "lluvioso"
-        elif codigo >= 80: estado = "tormentoso"
-        elif codigo >= 95: estado = "con truenos"
-
-        return f"En {nombre_real} hay {temp}°C, está {estado} con viento de {viento} km/h."
+        actual = CACHE_CLIMA.obtener(lat, lon, consultar)
+        codigo = actual['weathercode']
+        return {
+            "lugar": nombre_real,
+            "temperatura": actual['temperature'],
+            "estado": describir_codigo_clima(codigo),
+            "viento": actual['windspeed'],
+            "codigo": codigo,
+        }
 
     except Exception as e:
         log(f"Error Clima: {e}", "error")
-        return "Mis sensores fallaron."
+        return {"error": "Mis sensores fallaron."}
+
+def describir_clima(datos):
+    if "error" in datos:
+        return datos["error"]
+    return f"En {datos['lugar']} hay {datos['temperatura']}°C, está {datos['estado']} con viento de {datos['viento']} km/h."
+
+def obtener_clima_dinamico(ciudad_solicitada):
+    return describir_clima(obtener_datos_clima(ciudad_solicitada))
 
 # ==========================================
-# MOTOR GRÁFICO MEJORADO
+# CONVERSIONES
 # ==========================================
 
-def crear_particulas(x, y, cantidad=10, color=(255, 255, 255)):
-    """Crea partículas para efectos especiales"""
-    global PARTICULAS
-    for _ in range(cantidad):
-        PARTICULAS.append(Particula(x, y, color))
+# Conversiones directas conocidas: de -> a es a = factor * de + desplazamiento.
+# El resto de pares sale del grafo (km -> ft, oz -> kg, K -> °F, ...)
+CONVERSIONES_DIRECTAS = [
+    ("km", "m", 1000, 0), ("m", "cm", 100, 0), ("cm", "mm", 10, 0),
+    ("mi", "km", 1.609344, 0), ("ft", "m", 0.3048, 0), ("in", "cm", 2.54, 0), ("yd", "ft", 3, 0),
+    ("kg", "g", 1000, 0), ("t", "kg", 1000, 0), ("lb", "kg", 0.45359237, 0), ("oz", "g", 28.349523125, 0),
+    ("l", "ml", 1000, 0), ("gal", "l", 3.785411784, 0),
+    ("h", "min", 60, 0), ("min", "s", 60, 0),
+    ("c", "f", 9 / 5, 32), ("k", "c", 1, -273.15),
+]
+ALIAS_UNIDADES = {
+    "celsius": "c", "°c": "c", "fahrenheit": "f", "°f": "f", "kelvin": "k",
+    "lbs": "lb", "kgs": "kg", "mts": "m", "millas": "mi", "litros": "l", "hr": "h", "seg": "s",
+}
+_GRAFO_UNIDADES = None
 
-def dibujar_bimo(pantalla):
-    """Dibuja BIMO con animaciones mejoradas y expresivas"""
-    global TICK, PARPADEO_TIMER, ESTADO_EMOCION, ESPERANDO_ORDEN
-    global BRILLO_OJOS, ANIMACION_BOCA, EXPRESION_TIMER, GENERANDO_RESPUESTA
-    
-    TICK += 1
-    
-    # Color de fondo dinámico
-    if GENERANDO_RESPUESTA:
-        # Efecto de "pensando" (pulsación suave)
-        brillo = int(abs(math.sin(TICK * 0.1)) * 30)
-        COLOR_PIEL = (96 + brillo, 172 + brillo, 168 + brillo)
-    elif ESPERANDO_ORDEN:
-        COLOR_PIEL = COLOR_PIEL_ESPERANDO
-    else:
-        COLOR_PIEL = COLOR_PIEL_NORMAL
-    
-    pantalla.fill(COLOR_PIEL)
-    ancho, alto = pantalla.get_size()
-    cx, cy = ancho // 2, alto // 2
-    
-    # Movimiento de respiración más natural
-    respiracion_y = math.sin(TICK * 0.04) * 8
-    respiracion_x = math.sin(TICK * 0.03) * 3
+def _grafo_unidades():
+    """Cierre transitivo del grafo de conversiones: para cada unidad, su
+    unidad raíz y (a, b) con valor_raiz = a * valor + b. Se calcula una vez;
+    después cualquier par conectado se convierte en O(1)"""
+    global _GRAFO_UNIDADES
+    if _GRAFO_UNIDADES is None:
+        vecinos = {}
+        for de, a, factor, desplazamiento in CONVERSIONES_DIRECTAS:
+            # valor_a = factor * valor_de + desplazamiento, y su inversa
+            vecinos.setdefault(de, []).append((a, factor, desplazamiento))
+            vecinos.setdefault(a, []).append((de, 1 / factor, -desplazamiento / factor))
+        
+        grafo = {}
+        for raiz in vecinos:
+            if raiz in grafo:
+                continue
+            # Recorrido desde la raíz: guardamos valor_unidad = p * valor_raiz + q
+            directo = {raiz: (1.0, 0.0)}
+            pendientes = [raiz]
+            while pendientes:
+                unidad = pendientes.pop()
+                p, q = directo[unidad]
+                for vecina, factor, desplazamiento in vecinos[unidad]:
+                    if vecina not in directo:
+                        directo[vecina] = (factor * p, factor * q + desplazamiento)
+                        pendientes.append(vecina)
+            for unidad, (p, q) in directo.items():
+                grafo[unidad] = (raiz, 1 / p, -q / p)  # Invertido: valor_raiz = a * valor + b
+        _GRAFO_UNIDADES = grafo
+    return _GRAFO_UNIDADES
+
+def _codigo_unidad(unidad):
+    unidad = unidad.strip()
+    return ALIAS_UNIDADES.get(unidad.lower(), unidad.lower())
+
+def convertir_magnitud(cantidad, de, a):
+    """Unidades físicas sin red. None si no están conectadas"""
+    grafo = _grafo_unidades()
+    de, a = _codigo_unidad(de), _codigo_unidad(a)
+    if de not in grafo or a not in grafo or grafo[de][0] != grafo[a][0]:
+        return None
+    _, a_de, b_de = grafo[de]
+    _, a_a, b_a = grafo[a]
+    return (a_de * cantidad + b_de - b_a) / a_a
+
+# Tabla aproximada (USD, octubre de 2025) para un equipo nuevo que nunca ha
+# tenido red: mejor una conversión vieja que ninguna
+TASAS_INCLUIDAS = {
+    "base": "USD",
+    "momento": 1759276800,
+    "tasas": {
+        "USD": 1.0, "MXN": 18.4, "EUR": 0.86, "GBP": 0.75, "JPY": 148.0, "CAD": 1.39,
+        "CHF": 0.80, "CNY": 7.12, "BRL": 5.35, "COP": 3900.0, "CLP": 960.0, "PEN": 3.48,
+        "GTQ": 7.66, "DOP": 63.0, "UYU": 40.0, "CRC": 505.0, "KRW": 1400.0, "INR": 88.7,
+    },
+}
+
+class TablaCambios:
+    """Tipos de cambio: una tabla por moneda base, en memoria con TTL. De
+    una sola tabla salen todos los cruces (EUR -> MXN con la tabla de USD).
+    La última tabla buena queda en disco para cuando no hay red, y si nunca
+    hubo red se usa TASAS_INCLUIDAS"""
     
-    # Sistema de parpadeo mejorado
-    if PARPADEO_TIMER == 0:
-        # Parpadeo aleatorio o por emoción
-        if random.randint(0, 120) == 1 or (ESTADO_EMOCION == "SORPRENDIDO" and random.randint(0, 60) == 1):
-            PARPADEO_TIMER = 10
+    def __init__(self, base, ttl, archivo):
+        self.base = base
+        self.ttl = ttl
+        self.archivo = archivo
+        self._tablas = {}  # base -> (momento, {moneda: tasa})
+        self._desconocidas = {}  # moneda -> momento de la descarga que no la traía
+        self._candado = threading.Lock()
+        self._en_curso = ConsultasEnCurso()
     
-    ojos_abiertos = PARPADEO_TIMER == 0
-    if PARPADEO_TIMER > 0:
-        PARPADEO_TIMER -= 1
+    def _descargar(self, base):
+        tasas = HTTP.obtener_json("tipo_cambio", moneda=base)["rates"]
+        tasas = {moneda.upper(): float(tasa) for moneda, tasa in tasas.items()}
+        tasas.setdefault(base, 1.0)
+        momento = time.time()
+        with self._candado:
+            self._tablas[base] = (momento, tasas)
+        if self.archivo:
+            guardar_json(self.archivo, {"base": base, "momento": momento, "tasas": tasas})
+        return tasas
     
-    # Brillo en los ojos para emociones positivas
-    if ESTADO_EMOCION in ["FELIZ", "EMOCIONADO", "AMOR"]:
-        BRILLO_OJOS = min(BRILLO_OJOS + 2, 50)
-    else:
-        BRILLO_OJOS = max(BRILLO_OJOS - 2, 0)
+    def _respaldo(self):
+        """La tabla guardada en disco, por vieja que sea (o la incluida)"""
+        guardada = cargar_json(self.archivo, None) if self.archivo else None
+        if not guardada:
+            guardada = TASAS_INCLUIDAS
+            log("Sin red ni tabla guardada: usando los tipos de cambio incluidos (aproximados)", "warning")
+        else:
+            edad_horas = (time.time() - guardada.get("momento", 0)) / 3600
+            log(f"Sin red: usando tipos de cambio de hace {edad_horas:.0f} h", "warning")
+        with self._candado:
+            self._tablas.setdefault(guardada["base"], (guardada["momento"], guardada["tasas"]))
+        return guardada["tasas"]
     
-    # Posiciones de los ojos con movimiento
-    offset_ojo_y = respiracion_y
-    pos_ojo_izq = (int(cx - 70 + respiracion_x), int(cy - 40 + offset_ojo_y))
-    pos_ojo_der = (int(cx + 70 + respiracion_x), int(cy - 40 + offset_ojo_y))
+    def tasas_para(self, *monedas):
+        """Una tabla que tenga todas las monedas pedidas (o None)"""
+        ahora = time.time()
+        with self._candado:
+            vigentes = [t for momento, t in self._tablas.values() if ahora - momento < self.ttl]
+        for tasas in vigentes:
+            if all(m in tasas for m in monedas):
+                return tasas
+        # Una moneda que la última descarga no traía no se vuelve a buscar hasta el TTL
+        with self._candado:
+            if any(ahora - self._desconocidas.get(m, -math.inf) < self.ttl for m in monedas):
+                return None
+        
+        try:
+            tasas = self._en_curso.ejecutar(self.base, lambda: self._descargar(self.base))
+            with self._candado:
+                for moneda in monedas:
+                    if moneda not in tasas:
+                        self._desconocidas[moneda] = time.time()
+            return tasas
+        except Exception as e:
+            log(f"Error tipo de cambio: {e}", "error")
+        
+        with self._candado:
+            viejas = [t for _, t in self._tablas.values()]
+        for tasas in viejas:
+            if all(m in tasas for m in monedas):
+                return tasas
+        return self._respaldo()
+
+CAMBIOS = TablaCambios(MONEDA_BASE_CAMBIO, TTL_TIPO_CAMBIO, ARCHIVO_TIPO_CAMBIO)
+
+def convertir_moneda(cantidad, de, a):
+    de, a = de.upper(), a.upper()
+    tasas = CAMBIOS.tasas_para(de, a)
+    if not tasas or de not in tasas or a not in tasas:
+        return None
+    # 1 base = tasas[X] X, así que 1 de = tasas[a] / tasas[de] a
+    return cantidad * tasas[a] / tasas[de]
+
+def convertir_unidades(cantidad, de, a):
+    try:
+        resultado = convertir_magnitud(cantidad, de, a)
+        if resultado is not None:
+            return resultado
+        
+        # Códigos ISO de moneda (cualquiera que venga en la tabla)
+        if len(de.strip()) == 3 and len(a.strip()) == 3 and de.strip().isalpha() and a.strip().isalpha():
+            return convertir_moneda(cantidad, de.strip(), a.strip())
+        
+        return None
+    except Exception as e:
+        log(f"Error conversión: {e}", "error")
+        return None
+
+# ==========================================
+# PLANIFICADOR DE TAREAS
+# ==========================================
+
+class Planificador:
+    """Un solo hilo con cola de prioridad para temporizadores, alarmas,
+    recordatorios y cambios de emoción. Dispara por hora de reloj (epoch)
+    y guarda en disco las tareas con mensaje para sobrevivir reinicios"""
+    
+    def __init__(self, archivo=None):
+        self.archivo = archivo
+        self._cola = []  # heap de (momento, id)
+        self._tareas = {}  # id -> {"id", "momento", "tipo", "mensaje"}
+        self._acciones = {}  # id -> función (tareas internas, no se guardan)
+        self._siguiente_id = 1
+        self._siguiente_interna = -1  # Las internas van en negativo: no gastan los números del usuario
+        self._condicion = threading.Condition()
+        self._hilo = None
+    
+    def iniciar(self):
+        """Recupera las tareas guardadas y arranca el hilo del planificador"""
+        with self._condicion:
+            if self._hilo:
+                return
+            if self.archivo:
+                self._recuperar()
+            self._hilo = threading.Thread(target=self._bucle, daemon=True)
+            self._hilo.start()
+    
+    def programar(self, momento, tipo, mensaje="", accion=None):
+        """Programa una tarea para el momento (epoch) indicado.
+        Sin accion, al vencer BIMO dice el mensaje. Devuelve el id"""
+        with self._condicion:
+            if accion:
+                id_tarea = self._siguiente_interna
+                self._siguiente_interna -= 1
+            else:
+                id_tarea = self._siguiente_id
+                self._siguiente_id += 1
+            self._tareas[id_tarea] = {"id": id_tarea, "momento": momento, "tipo": tipo, "mensaje": mensaje}
+            heapq.heappush(self._cola, (momento, id_tarea))
+            if accion:
+                self._acciones[id_tarea] = accion
+            else:
+                self._guardar()
+            self._condicion.notify()
+        return id_tarea
+    
+    def programar_en(self, segundos, tipo, mensaje="", accion=None):
+        return self.programar(time.time() + segundos, tipo, mensaje, accion)
+    
+    def cancelar(self, id_tarea, interna=False):
+        """Cancela una tarea pendiente. Devuelve False si no existía o si es
+        interna y no se pidió con interna=True (el usuario no puede cancelarlas)"""
+        with self._condicion:
+            if id_tarea not in self._tareas or (id_tarea in self._acciones) != interna:
+                return False
+            del self._tareas[id_tarea]
+            if self._acciones.pop(id_tarea, None) is None:
+                self._guardar()
+            self._condicion.notify()
+        return True
+    
+    def listar(self):
+        """Tareas con mensaje pendientes, de la más próxima a la más lejana"""
+        with self._condicion:
+            tareas = [dict(t) for t in self._pendientes()]
+        return sorted(tareas, key=lambda t: t["momento"])
+    
+    def _bucle(self):
+        while True:
+            with self._condicion:
+                while True:
+                    # Las tareas canceladas se quedan en el heap hasta llegar al frente
+                    while self._cola and self._cola[0][1] not in self._tareas:
+                        heapq.heappop(self._cola)
+                    if not self._cola:
+                        self._condicion.wait()
+                        continue
+                    espera = self._cola[0][0] - time.time()
+                    if espera <= 0:
+                        break
+                    # Despertar al menos cada minuto por si cambia la hora del sistema
+                    self._condicion.wait(min(espera, 60))
+                
+                _, id_tarea = heapq.heappop(self._cola)
+                tarea = self._tareas.pop(id_tarea)
+                accion = self._acciones.pop(id_tarea, None)
+                if accion is None:
+                    self._guardar()
+            
+            self._disparar(tarea, accion)
+    
+    def _disparar(self, tarea, accion):
+        try:
+            if accion:
+                accion()
+            else:
+                log(f"⏰ {tarea['tipo']}: {tarea['mensaje']}")
+                # Hablar en otro hilo para no retrasar las siguientes tareas
+                threading.Thread(target=hablar, args=(tarea["mensaje"],), daemon=True).start()
+        except Exception as e:
+            log(f"Error en tarea {tarea['tipo']}: {e}", "error")
+    
+    def _guardar(self):
+        if self.archivo:
+            guardar_json(self.archivo, self._pendientes())
+    
+    def _pendientes(self):
+        return [t for i, t in self._tareas.items() if i not in self._acciones]
+    
+    def _recuperar(self):
+        ahora = time.time()
+        for tarea in cargar_json(self.archivo, []):
+            try:
+                momento = float(tarea["momento"])
+                if momento < ahora - GRACIA_TAREAS_VENCIDAS:
+                    log(f"Descartando {tarea['tipo']} vencido: {tarea['mensaje']}", "warning")
+                    continue
+                id_tarea = int(tarea["id"])
+                self._tareas[id_tarea] = {"id": id_tarea, "momento": momento,
+                                          "tipo": tarea["tipo"], "mensaje": tarea["mensaje"]}
+                heapq.heappush(self._cola, (momento, id_tarea))
+                self._siguiente_id = max(self._siguiente_id, id_tarea + 1)
+            except (KeyError, TypeError, ValueError):
+                continue
+        if self._tareas:
+            log(f"Recuperé {len(self._tareas)} tareas pendientes", "success")
+        self._guardar()
+
+PLANIFICADOR = Planificador(ARCHIVO_TAREAS)
+_ID_RESET_EMOCION = None
+
+def proximo_momento(hora):
+    """Epoch de la próxima vez que el reloj marque HH:MM (hoy o mañana)"""
+    horas, minutos = [int(x) for x in hora.split(":")[:2]]
+    ahora = datetime.datetime.now()
+    objetivo = ahora.replace(hour=horas, minute=minutos, second=0, microsecond=0)
+    if objetivo <= ahora:
+        objetivo += datetime.timedelta(days=1)
+    return objetivo.timestamp()
+
+def programar_reset_emocion():
+    """Vuelve a NEUTRO tras TIEMPO_RESET_EMOCION; reemplaza el reset anterior.
+    Si la emoción cambia antes, el reset se ignora por la versión"""
+    global _ID_RESET_EMOCION
+    if _ID_RESET_EMOCION is not None:
+        PLANIFICADOR.cancelar(_ID_RESET_EMOCION, interna=True)
+    version = ESTADO.instantanea().version_emocion
+    _ID_RESET_EMOCION = PLANIFICADOR.programar_en(
+        TIEMPO_RESET_EMOCION, "emocion", accion=lambda: ESTADO.actualizar_si("emocion", version, "NEUTRO"))
+
+def describir_tareas():
+    tareas = PLANIFICADOR.listar()
+    if not tareas:
+        return "No tienes nada pendiente"
+    partes = []
+    for tarea in tareas:
+        hora = datetime.datetime.fromtimestamp(tarea["momento"]).strftime("%I:%M %p")
+        partes.append(f"número {tarea['id']}, {tarea['tipo']} a las {hora}: {tarea['mensaje']}")
+    return "Tienes pendiente " + "; ".join(partes)
+
+# ==========================================
+# MOTOR GRÁFICO MEJORADO
+# ==========================================
+
+def crear_particulas(x, y, cantidad=10, color=(255, 255, 255)):
+    """Crea partículas para efectos especiales"""
+    PARTICULAS.emitir(x, y, cantidad, color)
+    despertar_render()
+
+def _geometria(ancho, alto):
+    """Centro de la cara, posición de los ojos y altura de la boca en este cuadro"""
+    cx, cy = ancho // 2, alto // 2
     
-    # ===== DIBUJAR OJOS SEGÚN EMOCIÓN =====
+    # Movimiento de respiración más natural
+    respiracion_y = math.sin(TICK * 0.04) * 8
+    respiracion_x = math.sin(TICK * 0.03) * 3
     
-    if ESTADO_EMOCION == "ENOJADO":
+    # Posiciones de los ojos con movimiento
+    pos_ojo_izq = (int(cx - 70 + respiracion_x), int(cy - 40 + respiracion_y))
+    pos_ojo_der = (int(cx + 70 + respiracion_x), int(cy - 40 + respiracion_y))
+    pos_boca_y = int(cy + 50 + respiracion_y)
+    return cx, cy, pos_ojo_izq, pos_ojo_der, pos_boca_y
+
+def actualizar_animacion(ancho, alto, estado):
+    """Avanza un cuadro: parpadeo, brillo, boca y partículas.
+    Todo lo aleatorio de la animación ocurre aquí, no al dibujar"""
+    global TICK, PARPADEO_TIMER, OJOS_ABIERTOS, BRILLO_OJOS, ANIMACION_BOCA
+    
+    TICK += 1
+    cx, cy, pos_ojo_izq, _, _ = _geometria(ancho, alto)
+    
+    # Sistema de parpadeo mejorado
+    if PARPADEO_TIMER == 0:
+        # Parpadeo aleatorio o por emoción
+        if random.randint(0, 120) == 1 or (estado.emocion == "SORPRENDIDO" and random.randint(0, 60) == 1):
+            PARPADEO_TIMER = 10
+    
+    OJOS_ABIERTOS = PARPADEO_TIMER == 0
+    if PARPADEO_TIMER > 0:
+        PARPADEO_TIMER -= 1
+    
+    # Brillo en los ojos para emociones positivas
+    if estado.emocion in ["FELIZ", "EMOCIONADO", "AMOR"]:
+        BRILLO_OJOS = min(BRILLO_OJOS + 2, 50)
+    else:
+        BRILLO_OJOS = max(BRILLO_OJOS - 2, 0)
+    
+    # Lágrima ocasional (solo con los ojos tristes visibles)
+    pensando = estado.emocion == "PENSANDO" or estado.generando
+    if estado.emocion in ["TRISTE", "CANSADO"] and not pensando and OJOS_ABIERTOS:
+        if random.randint(0, 30) == 1 and estado.emocion == "TRISTE":
+            crear_particulas(pos_ojo_izq[0], pos_ojo_izq[1] + 15, 1, (100, 200, 255))
+    
+    if estado.hablando:
+        ANIMACION_BOCA = (ANIMACION_BOCA + 1) % 20
+    elif estado.emocion == "AMOR":
+        # Corazones flotantes ocasionales
+        if random.randint(0, 20) == 1:
+            crear_particulas(cx + random.randint(-50, 50), 
+                           cy - 80, 1, (255, 100, 100))
+    
+    PARTICULAS.actualizar()
+
+def _color_fondo(estado):
+    if estado.generando:
+        # Efecto de "pensando" (pulsación suave)
+        brillo = int(abs(math.sin(TICK * 0.1)) * 30)
+        return (96 + brillo, 172 + brillo, 168 + brillo)
+    elif estado.esperando_orden:
+        return COLOR_PIEL_ESPERANDO
+    return COLOR_PIEL_NORMAL
+
+def _capas_escena(ancho, alto, estado):
+    """Describe ojos y boca del cuadro actual como [(clave, ancla)].
+    La clave identifica la forma; el ancla es el ojo izquierdo o el centro de la boca"""
+    cx, _, pos_ojo_izq, _, pos_boca_y = _geometria(ancho, alto)
+    
+    # ===== OJOS SEGÚN EMOCIÓN =====
+    if estado.emocion == "ENOJADO":
+        ojos = ("ojos", "ENOJADO")
+    elif estado.emocion == "PENSANDO" or estado.generando:
+        # Ojos mirando hacia arriba y a un lado
+        ojos = ("ojos", "PENSANDO", int(math.sin(TICK * 0.05) * 8))
+    elif OJOS_ABIERTOS:
+        if estado.emocion in ["FELIZ", "AMOR", "EMOCIONADO"]:
+            ojos = ("ojos", "FELIZ", int(BRILLO_OJOS / 10) if BRILLO_OJOS > 0 else None)
+        elif estado.emocion == "TRISTE" or estado.emocion == "CANSADO":
+            ojos = ("ojos", "TRISTE")
+        elif estado.emocion in ["SORPRENDIDO", "DUDOSO"]:
+            ojos = ("ojos", estado.emocion)
+        else:  # NEUTRO, ESCUCHANDO
+            ojos = ("ojos", "NORMAL", 16 if estado.emocion == "ESCUCHANDO" else 14)
+    else:
+        ojos = ("ojos", "CERRADOS")
+    
+    # ===== BOCA =====
+    if estado.hablando:
+        # Animación de boca al hablar (más realista)
+        apertura = int(abs(math.sin(TICK * 0.4)) * 15) + 5
+        if ANIMACION_BOCA < 10:
+            boca = ("boca", "ABIERTA", apertura)
+        else:
+            boca = ("boca", "SEMICERRADA", int(abs(math.sin(TICK * 0.4)) * 15 + 5))
+    elif estado.emocion in ["FELIZ", "EMOCIONADO", "NEUTRO", "ESCUCHANDO"]:
+        boca = ("boca", "LINEA")
+    elif estado.emocion in ["AMOR", "TRISTE", "ENOJADO", "SORPRENDIDO"]:
+        boca = ("boca", estado.emocion)
+    elif estado.emocion in ["DUDOSO", "PENSANDO"]:
+        # Boca de lado (pensativo)
+        boca = ("boca", "DUDOSO", int(math.sin(TICK * 0.05) * 5))
+    else:
+        boca = ("boca", "NEUTRO")
+    
+    return [(ojos, pos_ojo_izq), (boca, (cx, pos_boca_y))]
+
+def _dibujar_ojos(pantalla, pos_ojo_izq, variante, *parametros):
+    pos_ojo_der = (pos_ojo_izq[0] + 140, pos_ojo_izq[1])
+    
+    if variante == "ENOJADO":
         # Cejas enojadas más marcadas
         pygame.draw.line(pantalla, COLOR_LINEA, 
                         (pos_ojo_izq[0]-25, pos_ojo_izq[1]-20), 
@@ -437,9 +1844,8 @@ def dibujar_bimo(pantalla):
         pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 10, 5)
         pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, 10, 5)
     
-    elif ESTADO_EMOCION == "PENSANDO" or GENERANDO_RESPUESTA:
-        # Ojos mirando hacia arriba y a un lado
-        offset_pupila = int(math.sin(TICK * 0.05) * 8)
+    elif variante == "PENSANDO":
+        offset_pupila, = parametros
         pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 18, 4)
         pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, 18, 4)
         pygame.draw.circle(pantalla, COLOR_LINEA, 
@@ -447,57 +1853,54 @@ def dibujar_bimo(pantalla):
         pygame.draw.circle(pantalla, COLOR_LINEA, 
                           (pos_ojo_der[0] + offset_pupila, pos_ojo_der[1] - 5), 8)
     
-    elif ojos_abiertos:
-        if ESTADO_EMOCION in ["FELIZ", "AMOR", "EMOCIONADO"]:
-            # Ojos felices (arcos sonrientes)
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (pos_ojo_izq[0]-20, pos_ojo_izq[1]-20, 40, 40), 
-                          0, 3.14, 6)
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (pos_ojo_der[0]-20, pos_ojo_der[1]-20, 40, 40), 
-                          0, 3.14, 6)
-            
-            # Brillo en los ojos
-            if BRILLO_OJOS > 0:
-                pygame.draw.circle(pantalla, (255, 255, 255), 
-                                 (pos_ojo_izq[0] - 5, pos_ojo_izq[1] - 5), 
-                                 int(BRILLO_OJOS / 10), 0)
-                pygame.draw.circle(pantalla, (255, 255, 255), 
-                                 (pos_ojo_der[0] - 5, pos_ojo_der[1] - 5), 
-                                 int(BRILLO_OJOS / 10), 0)
-        
-        elif ESTADO_EMOCION == "TRISTE" or ESTADO_EMOCION == "CANSADO":
-            # Ojos tristes caídos
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (pos_ojo_izq[0]-20, pos_ojo_izq[1]+5, 40, 30), 
-                          0, 3.14, 6)
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (pos_ojo_der[0]-20, pos_ojo_der[1]+5, 40, 30), 
-                          0, 3.14, 6)
-            
-            # Lágrima ocasional
-            if random.randint(0, 30) == 1 and ESTADO_EMOCION == "TRISTE":
-                crear_particulas(pos_ojo_izq[0], pos_ojo_izq[1] + 15, 1, (100, 200, 255))
-        
-        elif ESTADO_EMOCION == "SORPRENDIDO":
-            # Ojos muy abiertos
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 20, 5)
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, 20, 5)
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 10)
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, 10)
-        
-        elif ESTADO_EMOCION == "DUDOSO":
-            # Un ojo más cerrado que el otro
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 15, 4)
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (pos_ojo_der[0]-15, pos_ojo_der[1]-10, 30, 20), 
-                          0, 3.14, 5)
+    elif variante == "FELIZ":
+        # Ojos felices (arcos sonrientes)
+        radio_brillo, = parametros
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (pos_ojo_izq[0]-20, pos_ojo_izq[1]-20, 40, 40), 
+                      0, 3.14, 6)
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (pos_ojo_der[0]-20, pos_ojo_der[1]-20, 40, 40), 
+                      0, 3.14, 6)
         
-        else:  # NEUTRO, ESCUCHANDO
-            # Ojos normales con personalidad
-            tamano = 16 if ESTADO_EMOCION == "ESCUCHANDO" else 14
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, tamano, 4)
-            pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, tamano, 4)
+        # Brillo en los ojos
+        if radio_brillo is not None:
+            pygame.draw.circle(pantalla, (255, 255, 255), 
+                             (pos_ojo_izq[0] - 5, pos_ojo_izq[1] - 5), 
+                             radio_brillo, 0)
+            pygame.draw.circle(pantalla, (255, 255, 255), 
+                             (pos_ojo_der[0] - 5, pos_ojo_der[1] - 5), 
+                             radio_brillo, 0)
+    
+    elif variante == "TRISTE":
+        # Ojos tristes caídos
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (pos_ojo_izq[0]-20, pos_ojo_izq[1]+5, 40, 30), 
+                      0, 3.14, 6)
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (pos_ojo_der[0]-20, pos_ojo_der[1]+5, 40, 30), 
+                      0, 3.14, 6)
+    
+    elif variante == "SORPRENDIDO":
+        # Ojos muy abiertos
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 20, 5)
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, 20, 5)
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 10)
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, 10)
+    
+    elif variante == "DUDOSO":
+        # Un ojo más cerrado que el otro
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, 15, 4)
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (pos_ojo_der[0]-15, pos_ojo_der[1]-10, 30, 20), 
+                      0, 3.14, 5)
+    
+    elif variante == "NORMAL":
+        # Ojos normales con personalidad
+        tamano, = parametros
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_izq, tamano, 4)
+        pygame.draw.circle(pantalla, COLOR_LINEA, pos_ojo_der, tamano, 4)
+    
     else:
         # Ojos cerrados (parpadeo)
         grosor = 5
@@ -507,349 +1910,1739 @@ def dibujar_bimo(pantalla):
         pygame.draw.line(pantalla, COLOR_LINEA, 
                         (pos_ojo_der[0]-15, pos_ojo_der[1]), 
                         (pos_ojo_der[0]+15, pos_ojo_der[1]), grosor)
+
+def _dibujar_boca(pantalla, centro, variante, *parametros):
+    cx, pos_boca_y = centro
     
-    # ===== DIBUJAR BOCA =====
+    if variante == "ABIERTA":
+        apertura, = parametros
+        pygame.draw.rect(pantalla, (0,0,0), (cx - 15, pos_boca_y, 30, apertura), 0)
     
-    pos_boca_y = int(cy + 50 + respiracion_y)
+    elif variante == "SEMICERRADA":
+        apertura, = parametros
+        pygame.draw.ellipse(pantalla, COLOR_LINEA, 
+                           (cx - 20, pos_boca_y + 5, 40, apertura), 4)
     
-    if ESTADO_HABLANDO:
-        # Animación de boca al hablar (más realista)
-        ANIMACION_BOCA = (ANIMACION_BOCA + 1) % 20
-        
-        if ANIMACION_BOCA < 10:
-            # Boca abierta
-            apertura = int(abs(math.sin(TICK * 0.4)) * 15) + 5
-            pygame.draw.rect(
-                pantalla,
-                (0,0,0),
-                (cx - 15, pos_boca_y, 30, apertura),
-                0
-            )
-        else:
-            # Boca semicerrada
-            apertura = abs(math.sin(TICK * 0.4)) * 15 + 5
-            pygame.draw.ellipse(pantalla, COLOR_LINEA, 
-                               (cx - 20, pos_boca_y + 5, 40, int(apertura)), 4)
+    elif variante == "LINEA":
+        pygame.draw.line(pantalla, (0,0,0), (cx - 15, pos_boca_y + 8), (cx + 15, pos_boca_y + 8), 4)
+    
+    elif variante == "AMOR":
+        # Boca de corazón
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (cx - 35, pos_boca_y - 10, 70, 40), 
+                      3.14, 0, 6)
+    
+    elif variante == "TRISTE":
+        pygame.draw.line(pantalla, (0,0,0), (cx - 15, pos_boca_y + 15), (cx + 15, pos_boca_y + 10), 4)
+    
+    elif variante == "ENOJADO":
+        # Boca enojada con dientes
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (cx - 30, pos_boca_y + 10, 60, 35), 
+                      0, 3.14, 7)
+        # Líneas de dientes
+        for i in range(-15, 20, 10):
+            pygame.draw.line(pantalla, COLOR_LINEA,
+                           (cx + i, pos_boca_y + 15),
+                           (cx + i, pos_boca_y + 25), 3)
+    
+    elif variante == "SORPRENDIDO":
+        pygame.draw.rect(pantalla, (0,0,0), (cx - 10, pos_boca_y, 20, 20), 3)
+    
+    elif variante == "DUDOSO":
+        offset_boca, = parametros
+        pygame.draw.arc(pantalla, COLOR_LINEA, 
+                      (cx - 25 + offset_boca, pos_boca_y + 5, 50, 25), 
+                      0, 3.14, 5)
+    
+    else:  # NEUTRO
+        # Línea neutral con ligera curvatura
+        pygame.draw.line(pantalla, COLOR_LINEA, 
+                       (cx - 25, pos_boca_y + 10), 
+                       (cx + 25, pos_boca_y + 10), 5)
+
+def _dibujar_capa(pantalla, clave, ancla):
+    if clave[0] == "ojos":
+        _dibujar_ojos(pantalla, ancla, *clave[1:])
     else:
-        # Bocas estáticas según emoción
-        if ESTADO_EMOCION in ["FELIZ", "EMOCIONADO", "NEUTRO", "ESCUCHANDO"]:
-            pygame.draw.line(
-                pantalla,
-                (0,0,0),
-                (cx - 15, pos_boca_y + 8),
-                (cx + 15, pos_boca_y + 8),
-                4
-            )
+        _dibujar_boca(pantalla, ancla, *clave[1:])
 
-        
-        elif ESTADO_EMOCION == "AMOR":
-            # Boca de corazón
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (cx - 35, pos_boca_y - 10, 70, 40), 
-                          3.14, 0, 6)
-            # Corazones flotantes ocasionales
-            if random.randint(0, 20) == 1:
-                crear_particulas(cx + random.randint(-50, 50), 
-                               cy - 80, 1, (255, 100, 100))
-        
-        elif ESTADO_EMOCION == "TRISTE":
-            pygame.draw.line(
-                pantalla,
-                (0,0,0),
-                (cx - 15, pos_boca_y + 15),
-                (cx + 15, pos_boca_y + 10),
-                4
-            )
+def _dibujar_efectos(pantalla, ancho, alto, estado, devolver_rects=True):
+    """Partículas y puntos de "pensando". Devuelve los rectángulos que tocó"""
+    rects = PARTICULAS.dibujar(pantalla, devolver_rects)
+    
+    # Efecto de "pensando" - puntos suspensivos animados
+    if estado.generando:
+        cx = ancho // 2
+        for i in range(3):
+            offset = int(abs(math.sin(TICK * 0.15 + i * 0.5)) * 10)
+            centro = (cx - 30 + i * 30, alto - 30 - offset)
+            pygame.draw.circle(pantalla, COLOR_LINEA, centro, 5)
+            rects.append(pygame.Rect(centro[0] - 5, centro[1] - 5, 11, 11))
+    
+    return rects
 
-        
-        elif ESTADO_EMOCION == "ENOJADO":
-            # Boca enojada con dientes
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (cx - 30, pos_boca_y + 10, 60, 35), 
-                          0, 3.14, 7)
-            # Líneas de dientes
-            for i in range(-15, 20, 10):
-                pygame.draw.line(pantalla, COLOR_LINEA,
-                               (cx + i, pos_boca_y + 15),
-                               (cx + i, pos_boca_y + 25), 3)
-        
-        elif ESTADO_EMOCION == "SORPRENDIDO":
-            pygame.draw.rect(
-                pantalla,
-                (0,0,0),
-                (cx - 10, pos_boca_y, 20, 20),
-                3
-            )
+def pintar_bimo_directo(pantalla, estado=None):
+    """Pinta el cuadro completo con primitivas (referencia para pintar_bimo)"""
+    estado = estado or ESTADO.instantanea()
+    ancho, alto = pantalla.get_size()
+    pantalla.fill(_color_fondo(estado))
+    for clave, ancla in _capas_escena(ancho, alto, estado):
+        _dibujar_capa(pantalla, clave, ancla)
+    _dibujar_efectos(pantalla, ancho, alto, estado)
 
+# ==========================================
+# CACHE DE CAPAS Y RECTÁNGULOS SUCIOS
+# ==========================================
+
+# Lienzo y ancla con que se prerenderiza cada parte (cubre cejas, brillo y dientes)
+_LIENZO_CAPA = {"ojos": ((260, 120), (60, 50)), "boca": ((120, 100), (60, 30))}
+_COLOR_TRANSPARENTE = (255, 0, 255)
+
+MAX_RECTS_SUCIOS = 64
+
+_CACHE_CAPAS = {}
+_RECTS_ANTERIORES = []
+_FONDO_ANTERIOR = None
+_ESCENA_ANTERIOR = None
+_HABIA_EFECTOS = False
+
+def _capa_prerenderizada(clave):
+    """Devuelve (superficie, desplazamiento) de la forma, dibujándola solo la primera vez"""
+    capa = _CACHE_CAPAS.get(clave)
+    if capa is None:
+        tamano, ancla = _LIENZO_CAPA[clave[0]]
+        lienzo = pygame.Surface(tamano)
+        lienzo.fill(_COLOR_TRANSPARENTE)
+        lienzo.set_colorkey(_COLOR_TRANSPARENTE)
+        _dibujar_capa(lienzo, clave, ancla)
         
-        elif ESTADO_EMOCION in ["DUDOSO", "PENSANDO"]:
-            # Boca de lado (pensativo)
-            offset_boca = int(math.sin(TICK * 0.05) * 5)
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (cx - 25 + offset_boca, pos_boca_y + 5, 50, 25), 
-                          0, 3.14, 5)
-        
-        elif ESTADO_EMOCION == "ESCUCHANDO":
-            # Pequeña sonrisa expectante
-            pygame.draw.arc(pantalla, COLOR_LINEA, 
-                          (cx - 30, pos_boca_y - 5, 60, 35), 
-                          3.14, 0, 5)
-        
-        else:  # NEUTRO
-            # Línea neutral con ligera curvatura
-            pygame.draw.line(pantalla, COLOR_LINEA, 
-                           (cx - 25, pos_boca_y + 10), 
-                           (cx + 25, pos_boca_y + 10), 5)
+        # Recortar al área realmente pintada
+        area = lienzo.get_bounding_rect()
+        superficie = lienzo.subsurface(area).copy()
+        superficie.set_colorkey(_COLOR_TRANSPARENTE)
+        if pygame.display.get_surface() is not None:
+            superficie = superficie.convert()
+        capa = (superficie, (area.x - ancla[0], area.y - ancla[1]))
+        _CACHE_CAPAS[clave] = capa
+    return capa
+
+def forzar_redibujado():
+    """El siguiente cuadro se pinta completo (ventana expuesta, cambio de tamaño...)"""
+    global _FONDO_ANTERIOR
+    _FONDO_ANTERIOR = None
+
+def pintar_bimo(pantalla, estado=None):
+    """Pinta el cuadro usando las capas prerenderizadas y solo sobre lo que cambió.
+    Devuelve la lista de rectángulos a actualizar en pantalla ([] si nada cambió)"""
+    global _RECTS_ANTERIORES, _FONDO_ANTERIOR, _ESCENA_ANTERIOR, _HABIA_EFECTOS
     
-    # ===== EFECTOS ESPECIALES =====
+    estado = estado or ESTADO.instantanea()
+    ancho, alto = pantalla.get_size()
+    fondo = _color_fondo(estado)
+    escena = _capas_escena(ancho, alto, estado)
+    hay_efectos = bool(PARTICULAS) or estado.generando
     
-    # Dibujar y actualizar partículas
-    global PARTICULAS
-    PARTICULAS = [p for p in PARTICULAS if p.vida > 0]
-    for particula in PARTICULAS:
-        particula.update()
-        particula.dibujar(pantalla)
+    # Con muchas partículas sale más barato repintar todo que miles de rectángulos
+    completo = fondo != _FONDO_ANTERIOR or len(PARTICULAS) > MAX_RECTS_SUCIOS
+    if not completo and not hay_efectos and not _HABIA_EFECTOS and escena == _ESCENA_ANTERIOR:
+        return []  # Cuadro idéntico al anterior
     
-    # Efecto de "pensando" - puntos suspensivos animados
-    if GENERANDO_RESPUESTA:
-        for i in range(3):
-            offset = int(abs(math.sin(TICK * 0.15 + i * 0.5)) * 10)
-            pygame.draw.circle(pantalla, COLOR_LINEA, 
-                             (cx - 30 + i * 30, alto - 30 - offset), 5)
+    if completo:
+        pantalla.fill(fondo)
+    else:
+        # Borrar lo dibujado en el cuadro anterior deja la pantalla solo con el fondo
+        for rect in _RECTS_ANTERIORES:
+            pantalla.fill(fondo, rect)
+    
+    rects = []
+    for clave, ancla in escena:
+        superficie, (dx, dy) = _capa_prerenderizada(clave)
+        rects.append(pantalla.blit(superficie, (ancla[0] + dx, ancla[1] + dy)))
+    rects.extend(_dibujar_efectos(pantalla, ancho, alto, estado, devolver_rects=not completo))
+    
+    sucios = [pantalla.get_rect()] if completo else _RECTS_ANTERIORES + rects
+    
+    _RECTS_ANTERIORES = rects
+    # Si no se guardaron los rectángulos de las partículas, el siguiente cuadro va completo
+    _FONDO_ANTERIOR = None if completo and PARTICULAS else fondo
+    _ESCENA_ANTERIOR = escena
+    _HABIA_EFECTOS = hay_efectos
+    return sucios
+
+def dibujar_bimo(pantalla, pasos=1):
+    """Dibuja BIMO con animaciones mejoradas y expresivas.
+    pasos: cuadros de animación (a FPS) transcurridos desde el último dibujo.
+    Devuelve los rectángulos que hay que pasar a pygame.display.update"""
+    estado = ESTADO.instantanea()  # Una sola lectura del estado por cuadro
+    ancho, alto = pantalla.get_size()
+    for _ in range(pasos):
+        actualizar_animacion(ancho, alto, estado)
+    return pintar_bimo(pantalla, estado)
+
+# ==========================================
+# RITMO ADAPTATIVO DE CUADROS
+# ==========================================
+
+EVENTO_DESPERTAR = None  # Tipo de evento de pygame para despertar al render
+_ULTIMA_ACTIVIDAD = 0.0
+
+def registrar_actividad():
+    """Reinicia la rampa a FPS completos (sin despertar al bucle)"""
+    global _ULTIMA_ACTIVIDAD
+    _ULTIMA_ACTIVIDAD = time.monotonic()
+
+def despertar_render():
+    """Avisa al bucle principal (desde cualquier hilo) que algo cambió"""
+    registrar_actividad()
+    if EVENTO_DESPERTAR is not None:
+        try:
+            pygame.event.post(pygame.event.Event(EVENTO_DESPERTAR))
+        except Exception:
+            pass  # Cola de eventos llena o pygame cerrándose
+
+def fps_objetivo():
+    """FPS completos si algo se mueve o acaba de cambiar; FPS_REPOSO si solo respira.
+    Los cambios de estado (emoción incluida) llegan por suscripción a ESTADO
+    (despertar_render) y solo dan SEGUNDOS_RAMPA: una emoción que se queda
+    puesta, como ESCUCHANDO, no mantiene los FPS completos"""
+    estado = ESTADO.instantanea()
+    activo = (estado.hablando or estado.generando
+              or len(PARTICULAS) > 0 or time.monotonic() - _ULTIMA_ACTIVIDAD < SEGUNDOS_RAMPA)
+    return FPS if activo else min(FPS_REPOSO, FPS)
 
 # ==========================================
 # SISTEMA DE VOZ OPTIMIZADO
 # ==========================================
 
-async def hablar_async(texto):
-    """Convierte texto a voz - OPTIMIZADO para menor latencia"""
-    global ESTADO_HABLANDO, GENERANDO_RESPUESTA
+_CANDADO_VOZ = threading.Lock()  # Una sola frase a la vez en el mixer
+
+def _nuevo_communicate(texto):
+    return edge_tts.Communicate(texto, VOZ_TTS, pitch=PITCH_VOZ, rate=VELOCIDAD_VOZ)
+
+async def sintetizar_voz(texto):
+    """Genera el MP3 de la frase en memoria, sin archivos temporales"""
+    audio = bytearray()
+    async for trozo in _nuevo_communicate(texto).stream():
+        if trozo["type"] == "audio":
+            audio.extend(trozo["data"])
+    return bytes(audio)
+
+def _cargar_y_reproducir(datos):
+    """Entrega un MP3 en memoria al mixer y lo empieza a reproducir"""
+    with Tramo("carga_audio", bytes=len(datos)):
+        pygame.mixer.music.load(io.BytesIO(datos), "mp3")
+        pygame.mixer.music.play()
+
+def _encolar_o_reproducir(datos):
+    """Deja el MP3 en la cola del mixer para que empiece en cuanto termine el
+    que suena, sin hueco. Si ya no sonaba nada lo reproduce de inmediato.
+    Devuelve True si quedó en la cola"""
+    with Tramo("carga_audio", bytes=len(datos)):
+        if pygame.mixer.music.get_busy():
+            pygame.mixer.music.queue(io.BytesIO(datos), "mp3")
+            # El fin de pista y queue no se pisan: si ahora no suena nada, la
+            # pista terminó antes de encolar y la cola ya no se va a leer
+            if pygame.mixer.music.get_busy():
+                return True
+        pygame.mixer.music.load(io.BytesIO(datos), "mp3")  # load vacía la cola
+        pygame.mixer.music.play()
+    return False
+
+async def _esperar_reproduccion():
+    while pygame.mixer.music.get_busy():
+        await asyncio.sleep(0.05)
+
+# Tablas de cabeceras MP3 (Layer III): bitrate en kbps y frecuencia en Hz
+_BITRATES_MP3 = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2
+    0: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2.5
+}
+_FRECUENCIAS_MP3 = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+def cuadros_mp3(datos, desde=0):
+    """Recorre los cuadros MP3 completos a partir de desde: [(inicio, fin, autonomo)].
+    autonomo es True si el cuadro no usa bits de los anteriores (main_data_begin
+    = 0): cortando justo antes de él, el tramo siguiente se decodifica limpio"""
+    cuadros = []
+    posicion = desde
+    if datos[posicion:posicion + 3] == b"ID3" and len(datos) >= posicion + 10:
+        tamaño = datos[posicion + 6] << 21 | datos[posicion + 7] << 14 | datos[posicion + 8] << 7 | datos[posicion + 9]
+        posicion += 10 + tamaño
+    while posicion + 6 <= len(datos):
+        b1, b2 = datos[posicion + 1], datos[posicion + 2]
+        version, capa = (b1 >> 3) & 3, (b1 >> 1) & 3
+        indice_bitrate, indice_frecuencia = b2 >> 4, (b2 >> 2) & 3
+        if (datos[posicion] != 0xFF or b1 & 0xE0 != 0xE0 or version == 1 or capa != 1
+                or indice_bitrate in (0, 15) or indice_frecuencia == 3):
+            break  # No es (o todavía no es) un cuadro válido
+        bitrate = _BITRATES_MP3[version][indice_bitrate] * 1000
+        frecuencia = _FRECUENCIAS_MP3[version][indice_frecuencia]
+        relleno = (b2 >> 1) & 1
+        largo = (144 if version == 3 else 72) * bitrate // frecuencia + relleno
+        if posicion + largo > len(datos):
+            break  # Cuadro a medio llegar
+        lado = posicion + 4 + (0 if b1 & 1 else 2)  # Sin CRC / con CRC
+        main_data_begin = (datos[lado] << 1 | datos[lado + 1] >> 7) if version == 3 else datos[lado]
+        cuadros.append((posicion, posicion + largo, main_data_begin == 0))
+        posicion += largo
+    return cuadros
+
+def punto_de_corte_mp3(datos, desde, terminado):
+    """Hasta dónde se puede mandar al mixer sin partir un cuadro ni dejar al
+    siguiente tramo sin los bits que necesita del anterior (depósito de bits).
+    Devuelve desde si todavía no conviene cortar"""
+    cuadros = cuadros_mp3(datos, desde)
+    if not cuadros:
+        return len(datos) if terminado else desde
+    if terminado and cuadros[-1][1] == len(datos):
+        return len(datos)
+    autonomos = [inicio for inicio, _, autonomo in cuadros[1:] if autonomo]
+    if autonomos:
+        return autonomos[-1]
+    if len(datos) - desde >= 4 * TTS_BYTES_INICIO:
+        return cuadros[-1][1]  # Sin cuadros autónomos: al menos no partir un cuadro
+    return cuadros[-1][1] if terminado else desde
+
+async def _reproducir_progresivo(texto):
+    """Empieza a sonar en cuanto llegan TTS_BYTES_INICIO bytes de audio y
+    reproduce lo que siga llegando por tramos mientras termina la síntesis.
+    Los tramos se cortan en cuadros MP3 completos (punto_de_corte_mp3) para
+    que las uniones no truenen, y cada uno espera en pygame.mixer.music.queue
+    mientras suena el anterior para que no quede silencio entre ellos"""
+    recibido = bytearray()
+    terminado = asyncio.Event()
     
+    async def recolectar():
+        try:
+            async for trozo in _nuevo_communicate(texto).stream():
+                if trozo["type"] == "audio":
+                    recibido.extend(trozo["data"])
+        finally:
+            terminado.set()
+    
+    tarea = asyncio.create_task(recolectar())
+    reproducido = 0
+    en_cola = False  # Hay un tramo en la cola del mixer que todavía no empieza
+    posicion = 0
+    try:
+        while True:
+            if en_cola:
+                # La cola solo guarda un tramo; cuando empieza, get_pos vuelve a cero
+                actual = pygame.mixer.music.get_pos()
+                en_cola = pygame.mixer.music.get_busy() and actual >= posicion
+                posicion = actual
+            if not en_cola:
+                listo = terminado.is_set()  # Leído antes de cortar: lo recibido ya está completo
+                disponible = len(recibido) - reproducido
+                if disponible >= TTS_BYTES_INICIO or (listo and disponible > 0):
+                    corte = punto_de_corte_mp3(recibido, reproducido, listo)
+                    if corte > reproducido:
+                        tramo = bytes(recibido[reproducido:corte])
+                        if cuadros_mp3(tramo):  # Una etiqueta ID3v1 al final no se reproduce sola
+                            en_cola = _encolar_o_reproducir(tramo)
+                            posicion = pygame.mixer.music.get_pos()
+                        reproducido = corte
+                elif listo:
+                    break
+            await asyncio.sleep(0.02)
+        await tarea  # Propaga errores de la síntesis
+    finally:
+        if not tarea.done():
+            tarea.cancel()
+    return bytes(recibido)
+
+async def hablar_async(texto, cachear=False):
+    """Convierte texto a voz - OPTIMIZADO para menor latencia.
+    Con cachear=True la frase se sirve/guarda en CACHE_VOZ"""
     # Marcar que terminó de generar respuesta
-    GENERANDO_RESPUESTA = False
+    ESTADO.actualizar(generando=False)
     
     # Pequeña pausa antes de hablar (sincronización)
     await asyncio.sleep(0.1)
     
-    ESTADO_HABLANDO = True
-    nombre = f"temp_bimo_{int(time.time())}_{random.randint(1000,9999)}.mp3"
+    ESTADO.actualizar(hablando=True)
     
     try:
-        # Generar audio (edge-tts es bastante rápido)
-        com = edge_tts.Communicate(texto, VOZ_TTS, pitch=PITCH_VOZ, rate=VELOCIDAD_VOZ)
-        await com.save(nombre)
-        
-        # Reproducir inmediatamente
-        pygame.mixer.music.load(nombre)
-        pygame.mixer.music.play()
+        with Tramo("cache_voz"):
+            datos = CACHE_VOZ.obtener(texto) if cachear else None
         
-        while pygame.mixer.music.get_busy():
-            await asyncio.sleep(0.05)
+        if datos:
+            # Frase conocida: suena al instante aunque edge-tts esté lento
+            _cargar_y_reproducir(datos)
+            with Tramo("reproduccion"):
+                await _esperar_reproduccion()
+        elif TTS_REPRODUCCION_PROGRESIVA:
+            with Tramo("sintesis_progresiva", caracteres=len(texto)):
+                datos = await _reproducir_progresivo(texto)
+            if cachear:
+                CACHE_VOZ.guardar(texto, datos)
+        else:
+            # Generar audio completo en memoria y reproducirlo
+            with Tramo("sintesis", caracteres=len(texto)):
+                datos = await sintetizar_voz(texto)
+            if cachear:
+                CACHE_VOZ.guardar(texto, datos)
+            _cargar_y_reproducir(datos)
+            with Tramo("reproduccion"):
+                await _esperar_reproduccion()
         
         pygame.mixer.music.unload()
         
     except Exception as e:
         log(f"Error TTS: {e}", "error")
     finally:
-        ESTADO_HABLANDO = False
-        if os.path.exists(nombre):
-            try:
-                await asyncio.sleep(0.05)
-                os.remove(nombre)
-            except:
-                pass
+        ESTADO.actualizar(hablando=False)
 
-def hablar(texto):
+def hablar(texto, cachear=False):
     """Wrapper sincrónico"""
+    inicio = time.perf_counter()
     try:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(hablar_async(texto))
-        loop.close()
+        with _CANDADO_VOZ:
+            marcar("espera_voz", inicio)  # Otra frase sonando
+            loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(loop)
+            loop.run_until_complete(hablar_async(texto, cachear))
+            loop.close()
     except Exception as e:
         log(f"Error al hablar: {e}", "error")
 
+def hablar_en_segundo_plano(texto, cachear=False):
+    """Habla sin bloquear al hilo que llama (por ejemplo, el bucle de pygame)"""
+    threading.Thread(target=hablar, args=(texto, cachear), daemon=True).start()
+
 # ==========================================
-# PROCESADOR DE COMANDOS
+# CACHE DE VOZ
 # ==========================================
 
-def procesar_respuesta_gemini(texto_respuesta):
-    """Procesa respuesta de Gemini"""
-    global ESTADO_EMOCION, GENERANDO_RESPUESTA
+class CacheVoz:
+    """Cache de audio TTS direccionado por contenido: archivos MP3 en disco
+    con expulsión LRU por tamaño y una capa caliente en RAM"""
     
-    GENERANDO_RESPUESTA = False
-    log(f"Gemini: {texto_respuesta}", "robot")
+    def __init__(self, carpeta, max_bytes_disco, max_bytes_ram):
+        self.carpeta = carpeta
+        self.max_bytes_disco = max_bytes_disco
+        self.max_bytes_ram = max_bytes_ram
+        self._ram = OrderedDict()
+        self._bytes_ram = 0
+        self._candado = threading.Lock()
     
-    # HORA
-    if "[CMD_HORA]" in texto_respuesta:
-        hora = obtener_hora_sistema()
+    @staticmethod
+    def clave(texto):
+        """La clave depende del texto y de la voz con la que se sintetizó"""
+        datos = "\n".join([texto, VOZ_TTS, PITCH_VOZ, VELOCIDAD_VOZ])
+        return hashlib.sha256(datos.encode("utf-8")).hexdigest()
+    
+    def _ruta(self, clave):
+        return os.path.join(self.carpeta, f"{clave}.mp3")
+    
+    def obtener(self, texto):
+        """Devuelve el MP3 de la frase o None si no está en cache"""
+        clave = self.clave(texto)
+        with self._candado:
+            if clave in self._ram:
+                self._ram.move_to_end(clave)
+                return self._ram[clave]
+        
+        ruta = self._ruta(clave)
         try:
-            resp = chat.send_message(f"La hora es {hora}. Dila amigable.")
-            procesar_respuesta_gemini(resp.text)
-        except:
-            hablar(f"Son las {hora}")
-        return
-
-    # FECHA
-    if "[CMD_FECHA]" in texto_respuesta:
-        fecha = obtener_fecha_sistema()
+            with open(ruta, "rb") as archivo:
+                datos = archivo.read()
+            os.utime(ruta)  # Marca de uso para el LRU en disco
+        except OSError:
+            return None
+        
+        self._guardar_ram(clave, datos)
+        return datos
+    
+    def contiene(self, texto):
+        clave = self.clave(texto)
+        with self._candado:
+            if clave in self._ram:
+                return True
+        return os.path.exists(self._ruta(clave))
+    
+    def guardar(self, texto, datos):
+        if not datos:
+            return
+        clave = self.clave(texto)
+        self._guardar_ram(clave, datos)
+        
         try:
-            resp = chat.send_message(f"La fecha es {fecha}. Dila amigable.")
-            procesar_respuesta_gemini(resp.text)
-        except:
-            hablar(f"Hoy es {fecha}")
+            os.makedirs(self.carpeta, exist_ok=True)
+            ruta = self._ruta(clave)
+            temporal = f"{ruta}.{threading.get_ident()}.tmp"
+            with open(temporal, "wb") as archivo:
+                archivo.write(datos)
+            os.replace(temporal, ruta)
+            self._recortar_disco()
+        except OSError as e:
+            log(f"Error cache de voz: {e}", "error")
+    
+    def _guardar_ram(self, clave, datos):
+        with self._candado:
+            if clave in self._ram:
+                self._ram.move_to_end(clave)
+                return
+            self._ram[clave] = datos
+            self._bytes_ram += len(datos)
+            while self._bytes_ram > self.max_bytes_ram and len(self._ram) > 1:
+                _, viejo = self._ram.popitem(last=False)
+                self._bytes_ram -= len(viejo)
+    
+    def _recortar_disco(self):
+        """Borra los archivos menos usados hasta quedar bajo el límite"""
+        archivos = []
+        total = 0
+        for entrada in os.scandir(self.carpeta):
+            if not entrada.name.endswith(".mp3"):
+                continue
+            info = entrada.stat()
+            archivos.append((info.st_mtime, info.st_size, entrada.path))
+            total += info.st_size
+        
+        archivos.sort()
+        for _, tamano, ruta in archivos:
+            if total <= self.max_bytes_disco:
+                break
+            try:
+                os.remove(ruta)
+                total -= tamano
+            except OSError:
+                pass
+
+CACHE_VOZ = CacheVoz(CACHE_VOZ_CARPETA, CACHE_VOZ_MAX_MB * 1024 * 1024, CACHE_VOZ_RAM_MB * 1024 * 1024)
+
+def frases_fijas():
+    """Frases que BIMO repite siempre y conviene tener sintetizadas"""
+    return list(RESPUESTAS_ACTIVACION) + [
+        "No te escuché bien",
+        "Tuve un problema procesando eso",
+        "No pude hacer esa conversión",
+        "¡Hola! ¿Quieres jugar videojuegos?",
+        "¡Te quiero mucho!",
+    ]
+
+def precalentar_cache_voz():
+    """Sintetiza en segundo plano las frases fijas que aún no están en cache"""
+    precalentar_frases(frases_fijas())
+
+def precalentar_frases(frases):
+    """Deja en el cache de voz las frases que falten (sin reproducirlas)"""
+    faltantes = [f for f in frases if f and not CACHE_VOZ.contiene(f)]
+    if not faltantes:
         return
+    
+    log(f"Precalentando {len(faltantes)} frases de voz...")
+    loop = asyncio.new_event_loop()
+    try:
+        for frase in faltantes:
+            try:
+                CACHE_VOZ.guardar(frase, loop.run_until_complete(sintetizar_voz(frase)))
+            except Exception as e:
+                log(f"Error precalentando '{frase}': {e}", "error")
+    finally:
+        loop.close()
+    log("Frases de voz listas", "success")
+
+# ==========================================
+# PROCESADOR DE COMANDOS
+# ==========================================
+
+# Una sola pasada sobre la respuesta: texto, [EMOCION] y [CMD_NOMBRE:argumentos]
+PATRON_RESPUESTA = re.compile(r"\[(?:CMD_([A-Z_]+)(?::([^\]]*))?|([A-Z]+))\]")
+Fragmento = namedtuple("Fragmento", "tipo valor argumento")  # tipo: texto, emocion o comando
+
+# frase: lo que BIMO dice (con etiquetas de emoción). mensaje_gemini: si el
+# comando está en modo "gemini", lo que se le manda para que lo redacte
+ResultadoComando = namedtuple("ResultadoComando", "frase mensaje_gemini cachear", defaults=(None, False))
+Manejador = namedtuple("Manejador", "funcion plazo en_orden modo")
+MANEJADORES_COMANDOS = {}
+_EJECUTOR_COMANDOS = None
+
+def comando(nombre, plazo=5.0, en_orden=False, modo=None):
+    """Registra el manejador de [CMD_NOMBRE:argumentos]. Recibe el texto de
+    los argumentos y devuelve un ResultadoComando. Los en_orden (los que
+    tocan el planificador) corren uno tras otro en el orden de la respuesta;
+    el resto corre en paralelo con su propio plazo en segundos. modo es la
+    clave en MODO_RESPUESTA_HERRAMIENTAS"""
+    def registrar(funcion):
+        MANEJADORES_COMANDOS[nombre] = Manejador(funcion, plazo, en_orden, modo)
+        return funcion
+    return registrar
 
-    # CLIMA
-    match_clima = re.search(r"\[CMD_CLIMA:(.*?)\]", texto_respuesta)
-    if match_clima:
-        ciudad = match_clima.group(1).strip()
-        info = obtener_clima_dinamico(ciudad)
+def tokenizar_respuesta(texto):
+    """Devuelve los fragmentos de la respuesta en orden"""
+    fragmentos = []
+    inicio = 0
+    for etiqueta in PATRON_RESPUESTA.finditer(texto):
+        if etiqueta.start() > inicio:
+            fragmentos.append(Fragmento("texto", texto[inicio:etiqueta.start()], None))
+        if etiqueta.group(1):
+            fragmentos.append(Fragmento("comando", etiqueta.group(1), (etiqueta.group(2) or "").strip()))
+        else:
+            fragmentos.append(Fragmento("emocion", etiqueta.group(3), None))
+        inicio = etiqueta.end()
+    if inicio < len(texto):
+        fragmentos.append(Fragmento("texto", texto[inicio:], None))
+    return fragmentos
+
+def _ejecutor_comandos():
+    global _EJECUTOR_COMANDOS
+    if _EJECUTOR_COMANDOS is None:
+        _EJECUTOR_COMANDOS = futures.ThreadPoolExecutor(max_workers=4, thread_name_prefix="comando")
+    return _EJECUTOR_COMANDOS
+
+def _correr_manejador(nombre, manejador, argumento):
+    try:
+        with Tramo(f"comando:{nombre}"):
+            return manejador.funcion(argumento)
+    except Exception as e:
+        log(f"Error en comando {nombre}: {e}", "error")
+        return ResultadoComando(frase_bimo("comando_error"))
+
+def ejecutar_comandos(comandos):
+    """comandos: [(indice, Fragmento)]. Devuelve {indice: (Manejador, ResultadoComando)}"""
+    resultados = {}
+    pendientes = []
+    for indice, fragmento in comandos:
+        manejador = MANEJADORES_COMANDOS.get(fragmento.valor)
+        if manejador is None:
+            log(f"Comando desconocido: {fragmento.valor}", "warning")
+        elif not manejador.en_orden:
+            futuro = _ejecutor_comandos().submit(con_traza(_correr_manejador), fragmento.valor, manejador, fragmento.argumento)
+            pendientes.append((indice, fragmento.valor, manejador, futuro, time.monotonic() + manejador.plazo))
+    
+    # Los del planificador aquí mismo, mientras los demás avanzan
+    for indice, fragmento in comandos:
+        manejador = MANEJADORES_COMANDOS.get(fragmento.valor)
+        if manejador and manejador.en_orden:
+            resultados[indice] = (manejador, _correr_manejador(fragmento.valor, manejador, fragmento.argumento))
+    
+    for indice, nombre, manejador, futuro, limite in pendientes:
         try:
-            resp = chat.send_message(f"Clima: {info}. Explícalo divertido.")
-            procesar_respuesta_gemini(resp.text)
-        except:
-            hablar(info)
-        return
+            resultados[indice] = (manejador, futuro.result(timeout=max(0, limite - time.monotonic())))
+        except futures.TimeoutError:
+            log(f"Comando {nombre} pasó de {manejador.plazo:g} s", "warning")
+            resultados[indice] = (manejador, ResultadoComando(frase_bimo("comando_lento")))
+    return resultados
 
-    # CÁLCULO
-    match_calc = re.search(r"\[CMD_CALC:(.*?)\]", texto_respuesta)
-    if match_calc:
-        expr = match_calc.group(1).strip()
-        resultado = calcular_expresion(expr)
+def procesar_respuesta_gemini(texto_respuesta, profundidad=0):
+    """Procesa respuesta de Gemini: ejecuta todos sus comandos y dice en una
+    sola respuesta el texto y los resultados, en el orden en que vienen"""
+    ESTADO.actualizar(generando=False)
+    log(f"Gemini: {texto_respuesta}", "robot")
+    
+    fragmentos = tokenizar_respuesta(texto_respuesta)
+    comandos = [(i, f) for i, f in enumerate(fragmentos) if f.tipo == "comando"]
+    resultados = {}
+    if comandos:
+        with Tramo("comandos", cantidad=len(comandos)):
+            resultados = ejecutar_comandos(comandos)
+    
+    partes = []
+    para_gemini = []  # (mensaje, frase de respaldo)
+    cachear = bool(resultados)
+    for indice, fragmento in enumerate(fragmentos):
+        if fragmento.tipo == "texto":
+            partes.append(fragmento.valor)
+            cachear = cachear and not fragmento.valor.strip()
+        elif fragmento.tipo == "emocion":
+            partes.append(f"[{fragmento.valor}]")
+        elif indice in resultados:
+            manejador, resultado = resultados[indice]
+            # La respuesta a un mensaje de herramienta ya no vuelve a Gemini
+            if (resultado.mensaje_gemini and profundidad == 0
+                    and MODO_RESPUESTA_HERRAMIENTAS.get(manejador.modo, "gemini") == "gemini"):
+                para_gemini.append((resultado.mensaje_gemini, resultado.frase))
+            else:
+                partes.append(f" {resultado.frase} ")
+                cachear = cachear and resultado.cachear
+    
+    # Gemini redacta los resultados mientras BIMO dice lo local
+    futuro_gemini = None
+    if para_gemini:
+        mensaje = "\n".join(m for m, _ in para_gemini)
+        futuro_gemini = _ejecutor_comandos().submit(con_traza(MEMORIA.enviar), mensaje, efimero=True)
+    
+    if not para_gemini or "".join(partes).strip():
+        decir_con_emocion("".join(partes), cachear=cachear and len(resultados) == 1)
+    
+    if futuro_gemini:
         try:
-            resp = chat.send_message(f"Resultado de {expr} es {resultado}.")
-            procesar_respuesta_gemini(resp.text)
-        except:
-            hablar(f"El resultado es {resultado}")
-        return
+            procesar_respuesta_gemini(futuro_gemini.result().text, profundidad + 1)
+        except Exception as e:
+            log(f"Error Gemini: {e}", "error")
+            decir_con_emocion(" ".join(frase for _, frase in para_gemini))
 
-    # CONVERSIÓN
-    match_convert = re.search(r"\[CMD_CONVERT:([\d.]+):(.*?):(.*?)\]", texto_respuesta)
-    if match_convert:
-        cant = float(match_convert.group(1))
-        de = match_convert.group(2).strip()
-        a = match_convert.group(3).strip()
-        resultado = convertir_unidades(cant, de, a)
-        if resultado:
-            try:
-                resp = chat.send_message(f"{cant} {de} = {resultado} {a}.")
-                procesar_respuesta_gemini(resp.text)
-            except:
-                hablar(f"{cant} {de} son {resultado:.2f} {a}")
-        else:
-            hablar("No pude hacer esa conversión")
-        return
+# Manejadores de comandos
 
-    # TEMPORIZADOR
-    match_timer = re.search(r"\[CMD_TIMER:(\d+):(.*?)\]", texto_respuesta)
-    if match_timer:
-        seg = int(match_timer.group(1))
-        msg = match_timer.group(2).strip()
+@comando("HORA", modo="hora")
+def _cmd_hora(argumento):
+    hora = obtener_hora_sistema()
+    return ResultadoComando(frase_hora(hora), f"La hora es {hora}. Dila amigable.")
+
+@comando("FECHA", modo="fecha")
+def _cmd_fecha(argumento):
+    fecha = obtener_fecha_sistema()
+    return ResultadoComando(frase_bimo("fecha", fecha=fecha), f"La fecha es {fecha}. Dila amigable.")
+
+@comando("CLIMA", plazo=10.0, modo="clima")
+def _cmd_clima(argumento):
+    datos = obtener_datos_clima(argumento)
+    return ResultadoComando(frase_clima(datos), f"Clima: {describir_clima(datos)} Explícalo divertido.")
+
+@comando("CALC", plazo=2.0, modo="calculo")
+def _cmd_calc(argumento):
+    resultado = calcular_expresion(argumento)
+    return ResultadoComando(frase_calculo(argumento, resultado), f"Resultado de {argumento} es {resultado}.")
+
+@comando("CONVERT", plazo=6.0, modo="conversion")
+def _cmd_convert(argumento):
+    cantidad, de, a = [parte.strip() for parte in argumento.split(":")]
+    cantidad = float(cantidad)
+    resultado = convertir_unidades(cantidad, de, a)
+    if resultado is None:
+        return ResultadoComando("No pude hacer esa conversión", cachear=True)
+    return ResultadoComando(frase_conversion(cantidad, de, a, resultado), f"{cantidad} {de} = {resultado} {a}.")
+
+@comando("TIMER", en_orden=True)
+def _cmd_timer(argumento):
+    segundos, _, mensaje = argumento.partition(":")
+    return ResultadoComando(programar_temporizador(int(segundos), mensaje.strip()), cachear=True)
+
+@comando("ALARMA", en_orden=True)
+def _cmd_alarma(argumento):
+    match = re.match(r"(\d{1,2}:\d{2})(?::(.*))?$", argumento)
+    if not match:
+        return ResultadoComando("No entendí la hora de la alarma", cachear=True)
+    hora, mensaje = match.group(1), (match.group(2) or "").strip()
+    try:
+        PLANIFICADOR.programar(proximo_momento(hora), "alarma", mensaje)
+    except ValueError:
+        return ResultadoComando("No entendí la hora de la alarma", cachear=True)
+    return ResultadoComando(f"Alarma a las {hora}", cachear=True)
+
+@comando("SEARCH")
+def _cmd_search(argumento):
+    return ResultadoComando(buscar_web(argumento))
+
+@comando("REMINDER", en_orden=True)
+def _cmd_reminder(argumento):
+    minutos, _, mensaje = argumento.partition(":")
+    minutos = int(minutos)
+    PLANIFICADOR.programar_en(minutos * 60, "recordatorio", f"Recordatorio: {mensaje.strip()}")
+    return ResultadoComando(f"Te lo recordaré en {minutos} minutos", cachear=True)
+
+@comando("TAREAS", en_orden=True)
+def _cmd_tareas(argumento):
+    return ResultadoComando(describir_tareas())
+
+@comando("CANCELAR", en_orden=True)
+def _cmd_cancelar(argumento):
+    if PLANIFICADOR.cancelar(int(argumento)):
+        return ResultadoComando("Listo, lo cancelé", cachear=True)
+    return ResultadoComando("No encontré ese pendiente", cachear=True)
+
+def separar_emociones(texto_respuesta):
+    """Texto que se va a decir (sin etiquetas) y [(caracteres antes de la etiqueta, emoción)]"""
+    texto_limpio = ""
+    emociones = []
+    for fragmento in tokenizar_respuesta(texto_respuesta):
+        if fragmento.tipo == "texto":
+            texto_limpio += " ".join(fragmento.valor.split()) + " "
+        elif fragmento.tipo == "emocion":
+            emociones.append((len(texto_limpio.strip()), fragmento.valor))
+    return texto_limpio.strip(), emociones
+
+def decir_con_emocion(texto_respuesta, cachear=False):
+    """Dice el texto sin etiquetas. La primera emoción se aplica de
+    inmediato y las demás cuando la voz llega (más o menos) a ellas"""
+    texto_limpio, emociones = separar_emociones(texto_respuesta)
+    
+    if emociones:
+        aplicar_emocion(emociones[0][1])
+        if len(emociones) > 1:
+            threading.Thread(target=_emociones_durante_voz, args=(emociones[1:],), daemon=True).start()
+    
+    if texto_limpio:
+        log(f"BIMO ({ESTADO.emocion}): {texto_limpio}", "voice")
+        hablar(texto_limpio, cachear=cachear)
+    
+    programar_reset_emocion()
+
+def _emociones_durante_voz(emociones, espera_maxima=10.0):
+    """Espera a que empiece a sonar la voz y aplica cada emoción cuando
+    toca según su posición en el texto"""
+    limite = time.monotonic() + espera_maxima
+    try:
+        while not pygame.mixer.music.get_busy():
+            if time.monotonic() > limite:
+                return
+            time.sleep(0.05)
+    except pygame.error:
+        return  # Sin mixer no hay voz que seguir
+    
+    inicio = time.monotonic()
+    for posicion, emocion in emociones:
+        time.sleep(max(0, inicio + posicion / CARACTERES_POR_SEGUNDO_VOZ - time.monotonic()))
+        if not ESTADO.hablando:
+            return
+        aplicar_emocion(emocion)
+
+def aplicar_emocion(emocion):
+    """Cambia la emoción actual y lanza sus efectos especiales"""
+    nueva_emocion = emocion.upper()
+    ESTADO.actualizar(emocion=nueva_emocion)
+    
+    # Efectos especiales según emoción
+    if nueva_emocion == "FELIZ" or nueva_emocion == "EMOCIONADO":
+        crear_particulas(250, 200, 5, (255, 255, 100))
+    elif nueva_emocion == "AMOR":
+        crear_particulas(250, 150, 3, (255, 100, 100))
+
+# ==========================================
+# INTENCIONES LOCALES
+# ==========================================
+
+# Frases al estilo BMO para lo que se responde sin Gemini (con etiqueta de emoción)
+PLANTILLAS_BMO = {
+    "hora": [
+        "[FELIZ] ¡{Son_las} {hora}! Mi relojito nunca falla.",
+        "[EMOCIONADO] ¡Ding, ding! {Son_las} {hora}.",
+        "[FELIZ] Según mi reloj interno {son_las} {hora}.",
+    ],
+    "fecha": [
+        "[FELIZ] Hoy es {fecha}. ¡Un gran día para una aventura!",
+        "[EMOCIONADO] ¡Hoy es {fecha}!",
+        "[FELIZ] Mi calendario dice que hoy es {fecha}.",
+    ],
+    "calculo": [
+        "[FELIZ] ¡Fácil! {expresion} es {resultado}.",
+        "[EMOCIONADO] ¡Bip bup! Da {resultado}.",
+        "[FELIZ] Mis circuitos dicen que {expresion} es {resultado}.",
+    ],
+    "calculo_error": [
+        "[DUDOSO] Mmm, esa cuenta no me sale.",
+        "[DUDOSO] Mis circuitos se hicieron bolas con esa cuenta.",
+    ],
+    "conversion": [
+        "[FELIZ] {cantidad} {de} son {resultado} {a}.",
+        "[EMOCIONADO] ¡Listo! {cantidad} {de} equivalen a {resultado} {a}.",
+    ],
+    "conversion_error": [
+        "[TRISTE] No pude hacer esa conversión.",
+    ],
+    "clima": [
+        "[{emocion}] En {lugar} hay {temperatura} grados y está {estado}. {comentario}",
+        "[{emocion}] ¡Reporte del clima! {lugar}: {temperatura} grados, {estado}. {comentario}",
+        "[{emocion}] Mis sensores dicen que en {lugar} está {estado}, a {temperatura} grados. {comentario}",
+    ],
+    "clima_error": [
+        "[TRISTE] {mensaje}",
+    ],
+    "comando_error": [
+        "[DUDOSO] Mmm, no entendí ese comando.",
+    ],
+    "comando_lento": [
+        "[TRISTE] Mis sensores tardaron demasiado con eso.",
+    ],
+    "temporizador": [
+        "[FELIZ] ¡Listo! Te aviso en {duracion}.",
+        "[EMOCIONADO] ¡Temporizador de {duracion} en marcha!",
+        "[FELIZ] Cuento {duracion} y te aviso.",
+    ],
+}
+_ULTIMA_PLANTILLA = {}
+
+# Emoción y comentario según el estado del cielo
+REACCIONES_CLIMA = {
+    "cielo despejado": ("FELIZ", "¡Perfecto para una aventura!"),
+    "nublado": ("DUDOSO", "Las nubes están jugando a las escondidas."),
+    "con neblina": ("SORPRENDIDO", "¡No se ve nada, como en un calabozo!"),
+    "lluvioso": ("TRISTE", "Mejor lleva paraguas."),
+    "tormentoso": ("SORPRENDIDO", "¡Cuidado allá afuera!"),
+    "con truenos": ("SORPRENDIDO", "¡Truenos! Mejor quedémonos jugando videojuegos."),
+    "normal": ("FELIZ", ""),
+}
+
+def frase_bimo(tipo, **datos):
+    """Elige una plantilla del tipo (sin repetir la anterior) y la llena"""
+    opciones = PLANTILLAS_BMO[tipo]
+    indices = [i for i in range(len(opciones)) if i != _ULTIMA_PLANTILLA.get(tipo)] or [0]
+    elegida = random.choice(indices)
+    _ULTIMA_PLANTILLA[tipo] = elegida
+    return opciones[elegida].format(**datos)
+
+def numero_bonito(valor):
+    """12.0 -> "12", 3.14159 -> "3.14" (así se escucha mejor)"""
+    if abs(valor - round(valor)) < 1e-9:
+        return str(int(round(valor)))
+    return f"{valor:.2f}".rstrip("0").rstrip(".")
+
+def duracion_hablada(segundos):
+    partes = []
+    horas, resto = divmod(int(segundos), 3600)
+    minutos, segs = divmod(resto, 60)
+    for cantidad, singular, plural in ((horas, "hora", "horas"), (minutos, "minuto", "minutos"), (segs, "segundo", "segundos")):
+        if cantidad:
+            partes.append(f"{cantidad} {singular if cantidad == 1 else plural}")
+    return " y ".join(partes) or "0 segundos"
+
+def frase_hora(hora):
+    """hora viene de obtener_hora_sistema ("03:15 PM")"""
+    hora = hora.lstrip("0")
+    una = hora.startswith("1:")
+    return frase_bimo("hora", hora=hora, son_las="es la" if una else "son las", Son_las="Es la" if una else "Son las")
+
+def frase_calculo(expresion, resultado):
+    """resultado viene de calcular_expresion (texto)"""
+    try:
+        return frase_bimo("calculo", expresion=expresion, resultado=numero_bonito(float(resultado)))
+    except ValueError:
+        return frase_bimo("calculo_error")
+
+def frase_conversion(cantidad, de, a, resultado):
+    nombre = lambda unidad: NOMBRES_UNIDAD.get(unidad) or NOMBRES_UNIDAD.get(unidad.lower()) or NOMBRES_UNIDAD.get(unidad.upper(), unidad)
+    return frase_bimo("conversion", cantidad=numero_bonito(cantidad), de=nombre(de),
+                      resultado=numero_bonito(resultado), a=nombre(a))
+
+def frase_clima(datos):
+    """datos viene de obtener_datos_clima"""
+    if "error" in datos:
+        return frase_bimo("clima_error", mensaje=datos["error"])
+    emocion, comentario = REACCIONES_CLIMA.get(datos["estado"], ("FELIZ", ""))
+    temperatura = datos["temperatura"]
+    if temperatura >= 32:
+        comentario = "¡Hace muchísimo calor, mis circuitos se derriten!"
+    elif temperatura <= 8:
+        emocion, comentario = "SORPRENDIDO", "¡Brrr! Ponte un suéter."
+    return frase_bimo("clima", emocion=emocion, lugar=datos["lugar"], temperatura=numero_bonito(temperatura),
+                      estado=datos["estado"], comentario=comentario).strip()
+
+def programar_temporizador(segundos, mensaje):
+    """Programa el temporizador en el planificador y devuelve la confirmación"""
+    duracion = duracion_hablada(segundos)
+    PLANIFICADOR.programar_en(segundos, "temporizador", mensaje or f"¡Tiempo! Terminó tu temporizador de {duracion}")
+    return frase_bimo("temporizador", duracion=duracion)
+
+NUMEROS_PALABRA = {
+    "cero": 0, "un": 1, "uno": 1, "una": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5,
+    "seis": 6, "siete": 7, "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12,
+    "trece": 13, "catorce": 14, "quince": 15, "dieciseis": 16, "diecisiete": 17,
+    "dieciocho": 18, "diecinueve": 19, "veinte": 20, "treinta": 30, "cuarenta": 40,
+    "cincuenta": 50, "sesenta": 60, "noventa": 90, "cien": 100, "media": 0.5, "medio": 0.5,
+}
+UNIDADES_HABLADAS = {
+    "kilometros": "km", "kilometro": "km", "km": "km", "millas": "mi", "milla": "mi",
+    "metros": "m", "metro": "m", "pies": "ft", "pie": "ft",
+    "centimetros": "cm", "centimetro": "cm", "pulgadas": "in", "pulgada": "in",
+    "kilogramos": "kg", "kilogramo": "kg", "kilos": "kg", "kilo": "kg", "libras": "lb", "libra": "lb",
+    "gramos": "g", "gramo": "g", "onzas": "oz", "onza": "oz",
+    "grados celsius": "c", "grados centigrados": "c", "celsius": "c", "centigrados": "c",
+    "grados fahrenheit": "f", "fahrenheit": "f",
+    "milimetros": "mm", "milimetro": "mm", "yardas": "yd", "yarda": "yd",
+    "toneladas": "t", "tonelada": "t", "litros": "l", "litro": "l", "mililitros": "ml", "mililitro": "ml",
+    "galones": "gal", "galon": "gal", "grados kelvin": "k", "kelvin": "k",
+    "dolares": "USD", "dolar": "USD", "euros": "EUR", "euro": "EUR", "pesos": "MXN", "peso": "MXN",
+    "libras esterlinas": "GBP", "yenes": "JPY", "yen": "JPY", "dolares canadienses": "CAD",
+    "pesos colombianos": "COP", "pesos argentinos": "ARS", "pesos chilenos": "CLP", "reales": "BRL",
+    "soles": "PEN", "quetzales": "GTQ", "francos suizos": "CHF", "yuanes": "CNY",
+}
+NOMBRES_UNIDAD = {
+    "km": "kilómetros", "mi": "millas", "m": "metros", "ft": "pies", "cm": "centímetros",
+    "in": "pulgadas", "kg": "kilos", "lb": "libras", "g": "gramos", "oz": "onzas",
+    "mm": "milímetros", "yd": "yardas", "t": "toneladas", "l": "litros", "ml": "mililitros",
+    "gal": "galones", "h": "horas", "min": "minutos", "s": "segundos",
+    "c": "grados Celsius", "f": "grados Fahrenheit", "k": "kelvin", "USD": "dólares", "EUR": "euros",
+    "MXN": "pesos", "GBP": "libras esterlinas", "JPY": "yenes", "CAD": "dólares canadienses",
+    "COP": "pesos colombianos", "ARS": "pesos argentinos", "CLP": "pesos chilenos", "BRL": "reales",
+    "PEN": "soles", "GTQ": "quetzales", "CHF": "francos suizos", "CNY": "yuanes",
+}
+SEGUNDOS_UNIDAD = {"segundo": 1, "segundos": 1, "minuto": 60, "minutos": 60, "hora": 3600, "horas": 3600}
+
+_PATRONES_INTENCION = None
+
+def _patrones_intencion():
+    """Compila las expresiones de las intenciones locales en el primer uso
+    (son muchas alternativas y frenarían el import de index.py)"""
+    global _PATRONES_INTENCION
+    if _PATRONES_INTENCION is None:
+        numero = r"(\d+(?:\.\d+)?|" + "|".join(NUMEROS_PALABRA) + r")"
+        unidad = "(" + "|".join(sorted(UNIDADES_HABLADAS, key=len, reverse=True)) + ")"
+        _PATRONES_INTENCION = {
+            "hora": re.compile(r"(?:me (?:dices|puedes decir) |dime |sabes )?(?:que horas? (?:es|son)(?: ahorita| ahora)?|la hora)"),
+            "fecha": re.compile(r"(?:me (?:dices|puedes decir) |dime |sabes )?(?:que (?:dia|fecha) es(?: hoy)?|cual es la fecha(?: de hoy)?|la fecha(?: de hoy)?|a que estamos(?: hoy)?)"),
+            "temporizador": re.compile(
+                r"(?:pon(?:me)?|programa(?:me)?|activa|inicia) (?:un )?(?:temporizador|timer|cronometro) (?:de |por |para )?"
+                rf"{numero} (segundos?|minutos?|horas?)(?: y {numero} (segundos?|minutos?))?"
+                rf"|avisame en {numero} (segundos?|minutos?|horas?)"
+            ),
+            "conversion": re.compile(
+                rf"(?:convierte |pasa |cuanto (?:es|son) |cuantos (?:es|son) )?{numero} {unidad} (?:a|en) {unidad}"
+            ),
+            "conversion_inversa": re.compile(rf"cuant[oa]s? {unidad} (?:son|es|hay en|equivalen a) {numero} {unidad}"),
+            "calculo": re.compile(r"(?:cuanto (?:es|son|da)|calcula(?:me)?|resuelve) (?:la )?(.+)"),
+            "operaciones": [
+                (re.compile(r"\braiz cuadrada de (\d+(?:\.\d+)?)"), r"sqrt(\1)"),
+                (re.compile(r"\bdividido (?:entre|por|en)\b|\bentre\b|÷"), "/"),
+                (re.compile(r"\bmultiplicado por\b|\bpor\b|\bx\b|×"), "*"),
+                (re.compile(r"\belevado a(?: la)?\b"), "**"),
+                (re.compile(r"\bal cuadrado\b"), "**2"),
+                (re.compile(r"\bal cubo\b"), "**3"),
+                (re.compile(r"\bmas\b"), "+"),
+                (re.compile(r"\bmenos\b"), "-"),
+            ],
+            "expresion": re.compile(r"(?:sqrt\([\d.]+\)|[\d.]+)(?: ?(?:\*\*|[-+*/]) ?(?:sqrt\([\d.]+\)|[\d.]+))+|sqrt\([\d.]+\)"),
+        }
+    return _PATRONES_INTENCION
+
+def normalizar_texto(texto):
+    """Minúsculas, sin acentos ni signos, con decimales en punto"""
+    texto = unicodedata.normalize("NFD", texto.lower())
+    texto = "".join(c for c in texto if unicodedata.category(c) != "Mn")
+    texto = re.sub(r"(?<=\d),(?=\d)", ".", texto)
+    texto = re.sub(r"[¿?¡!,;:\"']", " ", texto)
+    texto = re.sub(r"\bpor favor\b|^(?:oye|hey|ey)\b", " ", texto)
+    return " ".join(texto.split())
+
+def _numero(texto):
+    return NUMEROS_PALABRA[texto] if texto in NUMEROS_PALABRA else float(texto)
+
+def _responder_calculo(expresion_hablada):
+    patrones = _patrones_intencion()
+    expresion = f" {expresion_hablada} "
+    for patron, reemplazo in patrones["operaciones"]:
+        expresion = patron.sub(lambda m: " " + m.expand(reemplazo) + " ", expresion)
+    expresion = " ".join(
+        str(NUMEROS_PALABRA[t]) if t in NUMEROS_PALABRA else t
+        for t in expresion.split()
+    )
+    if not patrones["expresion"].fullmatch(expresion):
+        return None  # No es una cuenta sencilla: que la vea Gemini
+    return frase_calculo(expresion_hablada, calcular_expresion(expresion))
+
+def _responder_conversion(cantidad, de, a):
+    de, a = UNIDADES_HABLADAS[de], UNIDADES_HABLADAS[a]
+    resultado = convertir_unidades(cantidad, de, a)
+    if resultado is None:
+        return frase_bimo("conversion_error")
+    return frase_conversion(cantidad, de, a, resultado)
+
+def resolver_intencion_local(texto):
+    """Responde sin Gemini los comandos deterministas (hora, fecha, cuentas,
+    conversiones y temporizadores). Devuelve la frase con emoción o None"""
+    texto = normalizar_texto(texto)
+    patrones = _patrones_intencion()
+    
+    if patrones["hora"].fullmatch(texto):
+        return frase_hora(obtener_hora_sistema())
+    
+    if patrones["fecha"].fullmatch(texto):
+        return frase_bimo("fecha", fecha=obtener_fecha_sistema())
+    
+    match = patrones["temporizador"].fullmatch(texto)
+    if match:
+        cantidad, unidad, extra, unidad_extra, cantidad_corta, unidad_corta = match.groups()
+        if cantidad_corta:
+            cantidad, unidad = cantidad_corta, unidad_corta
+        segundos = _numero(cantidad) * SEGUNDOS_UNIDAD[unidad]
+        if extra:
+            segundos += _numero(extra) * SEGUNDOS_UNIDAD[unidad_extra]
+        if segundos >= 1:
+            return programar_temporizador(int(segundos), "")
+    
+    match = patrones["conversion"].fullmatch(texto)
+    if match:
+        return _responder_conversion(_numero(match.group(1)), match.group(2), match.group(3))
+    
+    match = patrones["conversion_inversa"].fullmatch(texto)
+    if match:
+        return _responder_conversion(_numero(match.group(2)), match.group(3), match.group(1))
+    
+    match = patrones["calculo"].fullmatch(texto)
+    if match:
+        return _responder_calculo(match.group(1))
+    
+    return None
+
+# ==========================================
+# RESPUESTAS EN STREAMING
+# ==========================================
+
+PATRON_ETIQUETA = re.compile(r"\[([A-Z_]+)(?::[^\]]*)?\]")
+PATRON_FIN_FRASE = re.compile(r"[.!?…]+[\"')»]*\s+|\n+")
+
+def extraer_frases(buffer):
+    """Separa las frases completas del buffer. Devuelve (frases, resto)"""
+    frases = []
+    inicio = 0
+    for fin in PATRON_FIN_FRASE.finditer(buffer):
+        frase = buffer[inicio:fin.end()].strip()
+        if frase:
+            frases.append(frase)
+        inicio = fin.end()
+    return frases, buffer[inicio:]
+
+def consumir_etiquetas(buffer):
+    """Aplica las emociones completas del buffer y las quita del texto.
+    Devuelve (buffer_limpio, hay_comando)"""
+    for etiqueta in PATRON_ETIQUETA.finditer(buffer):
+        if etiqueta.group(1).startswith("CMD_"):
+            return buffer, True
+    
+    def _aplicar(etiqueta):
+        aplicar_emocion(etiqueta.group(1))
+        return ""
+    
+    return PATRON_ETIQUETA.sub(_aplicar, buffer), False
+
+def _hablar_desde_cola(cola_frases):
+    """Habla las frases según llegan; junta las que se acumulen mientras habla"""
+    terminado = False
+    while not terminado:
+        frase = cola_frases.get()
+        if frase is None:
+            break
         
-        def timer():
-            time.sleep(seg)
-            hablar(msg)
+        partes = [frase]
+        while True:
+            try:
+                siguiente = cola_frases.get_nowait()
+            except Empty:
+                break
+            if siguiente is None:
+                terminado = True
+                break
+            partes.append(siguiente)
         
-        threading.Thread(target=timer, daemon=True).start()
-        minutos = seg / 60
-        if minutos >= 1:
-            hablar(f"Te avisaré en {minutos:.0f} minutos")
-        else:
-            hablar(f"Te avisaré en {seg} segundos")
-        return
+        texto = " ".join(partes)
+        log(f"BIMO ({ESTADO.emocion}): {texto}", "voice")
+        hablar(texto)
 
-    # ALARMA
-    match_alarma = re.search(r"\[CMD_ALARMA:([\d:]+):(.*?)\]", texto_respuesta)
-    if match_alarma:
-        hora = match_alarma.group(1).strip()
-        msg = match_alarma.group(2).strip()
-        
-        def alarma():
-            while True:
-                if datetime.datetime.now().strftime("%H:%M") == hora:
-                    hablar(msg)
-                    break
-                time.sleep(INTERVALO_ALARMAS)
+def procesar_respuesta_streaming(respuesta):
+    """Consume la respuesta de Gemini por fragmentos y empieza a hablar
+    en cuanto hay una frase completa. Si aparece un comando, lo que falta
+    por decir se procesa con procesar_respuesta_gemini. Devuelve el texto completo"""
+    cola_frases = Queue()
+    hilo_voz = threading.Thread(target=con_traza(_hablar_desde_cola), args=(cola_frases,), daemon=True)
+    hilo_voz.start()
+    
+    texto_completo = ""
+    pendiente = ""
+    sin_hablar = ""  # Desde el primer comando: lo que aún no se ha dicho
+    hay_comando = False
+    
+    try:
+        for fragmento in respuesta:
+            trozo = fragmento.text
+            texto_completo += trozo
+            if hay_comando:
+                sin_hablar += trozo
+                continue
+            
+            pendiente, hay_comando = consumir_etiquetas(pendiente + trozo)
+            if hay_comando:
+                sin_hablar = pendiente
+                continue
+            
+            # No cortar frases dentro de una etiqueta que aún no se cierra
+            abierta = pendiente.rfind("[")
+            if abierta != -1 and "]" not in pendiente[abierta:]:
+                frases, resto = extraer_frases(pendiente[:abierta])
+                pendiente = resto + pendiente[abierta:]
+            else:
+                frases, pendiente = extraer_frases(pendiente)
+            
+            for frase in frases:
+                cola_frases.put(frase)
         
-        threading.Thread(target=alarma, daemon=True).start()
-        hablar(f"Alarma a las {hora}")
-        return
+        if not hay_comando:
+            resto = re.sub(r"\[[^\]]*$", "", pendiente).strip()
+            if resto:
+                cola_frases.put(resto)
+    finally:
+        cola_frases.put(None)
+        hilo_voz.join()
+    
+    log(f"Gemini: {texto_completo}", "robot")
+    
+    if hay_comando:
+        procesar_respuesta_gemini(sin_hablar)
+    else:
+        programar_reset_emocion()
+    return texto_completo
 
-    # BÚSQUEDA
-    match_search = re.search(r"\[CMD_SEARCH:(.*?)\]", texto_respuesta)
-    if match_search:
-        consulta = match_search.group(1).strip()
-        resultado = buscar_web(consulta)
-        hablar(resultado)
-        return
+# ==========================================
+# DETECTOR LOCAL DE PALABRA CLAVE
+# ==========================================
+
+FRECUENCIA_MFCC = 16000
+VENTANA_MFCC = 400  # 25 ms
+SALTO_MFCC = 160  # 10 ms
+N_FFT_MFCC = 512
+FILTROS_MEL = 26
+COEFICIENTES_MFCC = 12  # Del 1 al 12: el 0 es la energía y depende del volumen
+VENTANA_MEDIA_MFCC = 100  # Cuadros (1 s) de la media que se resta a cada cuadro
+RANGO_VOZ_MFCC_DB = 20  # Cuadros más débiles que esto respecto al más fuerte no entran en la media
+UMBRAL_SIN_CALIBRAR = 20.0  # Si solo hay una plantilla no se puede calibrar
+_MATRICES_MFCC = None
 
-    # RECORDATORIO
-    match_reminder = re.search(r"\[CMD_REMINDER:(\d+):(.*?)\]", texto_respuesta)
-    if match_reminder:
-        mins = int(match_reminder.group(1))
-        msg = match_reminder.group(2).strip()
+def _matrices_mfcc():
+    """Banco de filtros mel y matriz DCT (se calculan una sola vez)"""
+    global _MATRICES_MFCC
+    if _MATRICES_MFCC is None:
+        mel_maximo = 2595 * np.log10(1 + FRECUENCIA_MFCC / 2 / 700)
+        puntos_hz = 700 * (10 ** (np.linspace(0, mel_maximo, FILTROS_MEL + 2) / 2595) - 1)
+        bins = np.floor((N_FFT_MFCC + 1) * puntos_hz / FRECUENCIA_MFCC).astype(int)
         
-        def recordatorio():
-            time.sleep(mins * 60)
-            hablar(f"Recordatorio: {msg}")
+        banco = np.zeros((N_FFT_MFCC // 2 + 1, FILTROS_MEL), dtype=np.float32)
+        for m in range(FILTROS_MEL):
+            izq, centro, der = bins[m], bins[m + 1], bins[m + 2]
+            banco[izq:centro, m] = (np.arange(izq, centro) - izq) / max(centro - izq, 1)
+            banco[centro:der, m] = (der - np.arange(centro, der)) / max(der - centro, 1)
         
-        threading.Thread(target=recordatorio, daemon=True).start()
-        hablar(f"Te lo recordaré en {mins} minutos")
-        return
+        n = np.arange(FILTROS_MEL) + 0.5
+        dct = np.cos(np.pi / FILTROS_MEL * np.outer(n, np.arange(1, COEFICIENTES_MFCC + 1)))
+        _MATRICES_MFCC = (banco, dct.astype(np.float32))
+    return _MATRICES_MFCC
+
+def recortar_silencio(muestras, rango_db=35):
+    """Quita el silencio del inicio y del final (bloques de 10 ms más de
+    rango_db por debajo del bloque más fuerte)"""
+    bloques = len(muestras) // SALTO_MFCC
+    if bloques == 0:
+        return muestras
+    energia = (muestras[:bloques * SALTO_MFCC].astype(np.float32).reshape(bloques, SALTO_MFCC) ** 2).mean(axis=1)
+    db = 10 * np.log10(energia + 1e-9)
+    voz = np.flatnonzero(db > db.max() - rango_db)
+    return muestras[voz[0] * SALTO_MFCC:(voz[-1] + 1) * SALTO_MFCC]
 
-    # CHARLA NORMAL
-    match_emocion = re.search(r"\[([A-Z]+)\]", texto_respuesta)
-    texto_limpio = re.sub(r"\[[A-Z]+\]", "", texto_respuesta).strip()
+def calcular_mfcc(muestras):
+    """MFCC por cuadro de 10 ms menos la media de los cuadros con voz
+    anteriores (así no importan el volumen ni el micrófono). La media solo
+    mira hacia atrás: si a "bimo" le sigue una orden, sus cuadros quedan igual
+    que en la plantilla; y el ruido del preroll no entra en ella.
+    muestras: int16 mono a 16 kHz"""
+    banco, dct = _matrices_mfcc()
+    senal = np.asarray(muestras, dtype=np.float32)
+    if len(senal) < VENTANA_MFCC:
+        return np.zeros((0, COEFICIENTES_MFCC), dtype=np.float32)
+    
+    senal = np.append(senal[0], senal[1:] - 0.97 * senal[:-1])  # Preénfasis
+    n_cuadros = 1 + (len(senal) - VENTANA_MFCC) // SALTO_MFCC
+    indices = np.arange(VENTANA_MFCC) + SALTO_MFCC * np.arange(n_cuadros)[:, None]
+    cuadros = senal[indices] * np.hamming(VENTANA_MFCC).astype(np.float32)
+    potencia = np.abs(np.fft.rfft(cuadros, N_FFT_MFCC)) ** 2 / N_FFT_MFCC
+    coeficientes = np.log(potencia @ banco + 1e-3) @ dct
+    
     
-    if match_emocion:
-        nueva_emocion = match_emocion.group(1).upper()
-        ESTADO_EMOCION = nueva_emocion
+    db = 10 * np.log10(potencia.sum(axis=1) + 1e-9)
+    voz = (db > db.max() - RANGO_VOZ_MFCC_DB)[:, None]
+    acumulado = np.cumsum(np.where(voz, coeficientes, 0), axis=0)
+    cuadros_con_voz = np.cumsum(voz, axis=0)
+    # Suma y cuenta del último segundo: lo acumulado menos lo de hace un segundo
+    acumulado[VENTANA_MEDIA_MFCC:] -= acumulado[:-VENTANA_MEDIA_MFCC].copy()
+    cuadros_con_voz[VENTANA_MEDIA_MFCC:] -= cuadros_con_voz[:-VENTANA_MEDIA_MFCC].copy()
+    return (coeficientes - acumulado / np.maximum(cuadros_con_voz, 1)).astype(np.float32)
+
+def distancia_dtw(plantilla, frase):
+    """DTW de subsecuencia: la plantilla puede empezar y terminar en cualquier
+    cuadro de la frase. Pasos (plantilla, frase) (1,1), (1,2) y (2,1), que
+    limitan la velocidad a entre la mitad y el doble, y permiten calcular una
+    fila completa de golpe. Devuelve el costo medio por cuadro de la plantilla"""
+    filas, columnas = len(plantilla), len(frase)
+    # Al doble de velocidad la plantilla ocupa filas // 2 + 1 cuadros de la frase
+    if filas == 0 or columnas <= filas // 2:
+        return math.inf
+    
+    costo = np.sqrt(((plantilla[:, None, :] - frase[None, :, :]) ** 2).sum(axis=2))
+    previa = np.full(columnas, np.inf, dtype=np.float32)
+    actual = costo[0].copy()  # Empezar en cualquier cuadro no cuesta nada extra
+    for i in range(1, filas):
+        mejor = np.full(columnas, np.inf, dtype=np.float32)
+        mejor[1:] = actual[:-1]  # (1,1)
+        mejor[2:] = np.minimum(mejor[2:], actual[:-2])  # (1,2): salta un cuadro de la frase
+        # (2,1): dos cuadros de la plantilla en uno de la frase, pasando por (i - 1, j)
+        mejor[1:] = np.minimum(mejor[1:], previa[:-1] + costo[i - 1, 1:])
+        previa, actual = actual, costo[i] + mejor
+    return float(actual.min() / filas)
+
+def leer_wav(ruta):
+    """Lee un WAV PCM y lo devuelve como int16 mono a 16 kHz"""
+    with wave.open(ruta, "rb") as archivo:
+        canales = archivo.getnchannels()
+        ancho = archivo.getsampwidth()
+        frecuencia = archivo.getframerate()
+        datos = archivo.readframes(archivo.getnframes())
+    
+    if ancho == 1:
+        muestras = (np.frombuffer(datos, dtype=np.uint8).astype(np.int16) - 128) << 8
+    elif ancho == 2:
+        muestras = np.frombuffer(datos, dtype="<i2")
+    elif ancho == 4:
+        muestras = (np.frombuffer(datos, dtype="<i4") >> 16).astype(np.int16)
+    else:
+        raise wave.Error(f"{ancho * 8} bits por muestra no soportado")
+    
+    if canales > 1:
+        muestras = muestras.reshape(-1, canales).mean(axis=1)
+    if frecuencia != FRECUENCIA_MFCC and len(muestras):
+        duracion = len(muestras) / frecuencia
+        nuevas = np.arange(int(duracion * FRECUENCIA_MFCC)) / FRECUENCIA_MFCC
+        muestras = np.interp(nuevas, np.arange(len(muestras)) / frecuencia, muestras)
+    return np.asarray(muestras, dtype=np.int16)
+
+class DetectorPalabraClave:
+    """Busca la palabra clave en el audio de una frase comparándolo con
+    grabaciones de referencia (MFCC + DTW), sin usar la red"""
+    
+    def __init__(self, carpeta, umbral=None):
+        self.carpeta = carpeta
+        self.umbral_configurado = umbral
+        self.umbral = umbral
+        self.plantillas = []  # [(nombre, mfcc)]
+    
+    @property
+    def activo(self):
+        return bool(self.plantillas)
+    
+    @staticmethod
+    def _leer_carpeta(carpeta):
+        """[(nombre, mfcc)] de los WAV de una carpeta ([] si no existe)"""
+        try:
+            nombres = sorted(n for n in os.listdir(carpeta) if n.lower().endswith(".wav"))
+        except OSError:
+            return []
         
-        # Efectos especiales según emoción
-        if nueva_emocion == "FELIZ" or nueva_emocion == "EMOCIONADO":
-            crear_particulas(250, 200, 5, (255, 255, 100))
-        elif nueva_emocion == "AMOR":
-            crear_particulas(250, 150, 3, (255, 100, 100))
+        leidos = []
+        for nombre in nombres:
+            try:
+                muestras = leer_wav(os.path.join(carpeta, nombre))
+            except (OSError, EOFError, wave.Error) as e:
+                log(f"Grabación {nombre} ignorada: {e}", "warning")
+                continue
+            mfcc = calcular_mfcc(recortar_silencio(muestras))
+            if len(mfcc) >= 10:
+                leidos.append((nombre, mfcc))
+        return leidos
     
-    if texto_limpio:
-        log(f"BIMO ({ESTADO_EMOCION}): {texto_limpio}", "voice")
-        hablar(texto_limpio)
+    def cargar(self):
+        """Lee los WAV de la carpeta y calibra el umbral con las frases de
+        las subcarpetas si/ ("bimo" seguido de una orden) y no/ (frases sin
+        "bimo"), si las hay. Devuelve cuántas plantillas hay"""
+        self.plantillas = self._leer_carpeta(self.carpeta)
+        self.umbral = self.umbral_configurado
+        if self.umbral is None:
+            positivas = [mfcc for _, mfcc in self._leer_carpeta(os.path.join(self.carpeta, "si"))]
+            negativas = [mfcc for _, mfcc in self._leer_carpeta(os.path.join(self.carpeta, "no"))]
+            self.umbral = self.calibrar(positivas, negativas)
+        return len(self.plantillas)
+    
+    def calibrar(self, positivas=(), negativas=()):
+        """Con frases reales (MFCC): a medio camino entre la peor positiva y
+        la mejor negativa; si se enciman, 10% más que la peor positiva (una
+        falsa alarma solo cuesta una consulta a Google, perder una orden es
+        peor). Sin frases: 10% más que la mayor distancia entre dos plantillas"""
+        if positivas:
+            peor_positiva = max(self._distancia_mfcc(frase) for frase in positivas)
+            mejor_negativa = min((self._distancia_mfcc(frase) for frase in negativas), default=math.inf)
+            if peor_positiva < math.inf and peor_positiva < mejor_negativa < math.inf:
+                return round((peor_positiva + mejor_negativa) / 2, 2)
+            if peor_positiva < math.inf:
+                return round(peor_positiva * 1.1, 2)
+        
+        distancias = [
+            distancia_dtw(a, b)
+            for i, (_, a) in enumerate(self.plantillas)
+            for j, (_, b) in enumerate(self.plantillas)
+            if i != j
+        ]
+        distancias = [d for d in distancias if d < math.inf]
+        if not distancias:
+            return UMBRAL_SIN_CALIBRAR
+        return round(max(distancias) * 1.1, 2)
+    
+    def _distancia_mfcc(self, frase):
+        return min((distancia_dtw(p, frase) for _, p in self.plantillas), default=math.inf)
+    
+    def distancia(self, muestras):
+        """Menor distancia entre la frase y las plantillas (inf si no hay)"""
+        return self._distancia_mfcc(calcular_mfcc(recortar_silencio(muestras)))
+    
+    def detectar(self, muestras):
+        frase = calcular_mfcc(recortar_silencio(muestras))
+        return any(distancia_dtw(p, frase) <= self.umbral for _, p in self.plantillas)
     
-    threading.Timer(TIEMPO_RESET_EMOCION, lambda: globals().update(ESTADO_EMOCION="NEUTRO")).start()
+    def detectar_audio(self, audio):
+        """Igual que detectar pero con el sr.AudioData que entrega r.listen"""
+        datos = audio.get_raw_data(convert_rate=FRECUENCIA_MFCC, convert_width=2)
+        return self.detectar(np.frombuffer(datos, dtype=np.int16))
+
+DETECTOR_PALABRA_CLAVE = DetectorPalabraClave(PALABRA_CLAVE_CARPETA, UMBRAL_PALABRA_CLAVE)
+
+def cargar_palabra_clave():
+    """Carga las plantillas; sin ellas todas las frases van a Google como antes"""
+    cantidad = DETECTOR_PALABRA_CLAVE.cargar()
+    if cantidad:
+        log(f"Palabra clave local: {cantidad} plantillas, umbral {DETECTOR_PALABRA_CLAVE.umbral}", "success")
+    else:
+        log(f"Sin plantillas en {PALABRA_CLAVE_CARPETA}: el filtro local de palabra clave queda apagado", "warning")
 
 # ==========================================
-# HILO DE ESCUCHA
+# MOTORES DE RECONOCIMIENTO
 # ==========================================
 
-def hilo_escucha():
-    """Escucha constantemente el micrófono"""
-    global ESPERANDO_ORDEN, ESTADO_EMOCION, GENERANDO_RESPUESTA
+class MotorGoogle:
+    """Reconocimiento en la nube (el de siempre)"""
+    nombre = "google"
     
-    r = sr.Recognizer()
-    r.dynamic_energy_threshold = ENERGIA_DINAMICA
-    r.energy_threshold = ENERGIA_THRESHOLD
-    r.pause_threshold = PAUSA_THRESHOLD
-    r.phrase_threshold = 0.3
+    def __init__(self, r):
+        self.r = r
     
-    log("Iniciando sistema de escucha", "mic")
+    def disponible(self):
+        return True
+    
+    def reconocer(self, audio):
+        """Devuelve (texto, confianza); lanza UnknownValueError o RequestError"""
+        respuesta = self.r.recognize_google(audio, language=IDIOMA_RECONOCIMIENTO, show_all=True)
+        alternativas = respuesta.get("alternative") if isinstance(respuesta, dict) else None
+        if not alternativas or not alternativas[0].get("transcript"):
+            raise sr.UnknownValueError()
+        # Google solo incluye la confianza cuando hay varias hipótesis
+        return alternativas[0]["transcript"], alternativas[0].get("confidence", 1.0)
+
+class MotorVosk:
+    """Reconocimiento local con Vosk (pip install vosk y un modelo en español
+    descomprimido en MODELO_VOSK, p. ej. vosk-model-small-es-0.42)"""
+    nombre = "vosk"
     
+    def __init__(self, carpeta_modelo):
+        self.carpeta_modelo = carpeta_modelo
+        self._modelo = None
+        self._candado = threading.Lock()
+    
+    def disponible(self):
+        if not os.path.isdir(self.carpeta_modelo):
+            log(f"Vosk desactivado: no existe el modelo {self.carpeta_modelo}", "warning")
+            return False
+        try:
+            importlib.import_module("vosk")
+        except ImportError:
+            log("Vosk desactivado: falta instalar el paquete vosk", "warning")
+            return False
+        return True
+    
+    def _cargar(self):
+        with self._candado:
+            if self._modelo is None:
+                vosk = importlib.import_module("vosk")
+                vosk.SetLogLevel(-1)
+                self._modelo = vosk.Model(self.carpeta_modelo)
+        return self._modelo
+    
+    def reconocer(self, audio):
+        vosk = importlib.import_module("vosk")
+        reconocedor = vosk.KaldiRecognizer(self._cargar(), FRECUENCIA_MFCC)
+        reconocedor.SetWords(True)
+        reconocedor.AcceptWaveform(audio.get_raw_data(convert_rate=FRECUENCIA_MFCC, convert_width=2))
+        resultado = json.loads(reconocedor.FinalResult())
+        palabras = resultado.get("result") or []
+        if not resultado.get("text") or not palabras:
+            raise sr.UnknownValueError()
+        return resultado["text"], sum(p.get("conf", 0) for p in palabras) / len(palabras)
+
+class ReconocedorVoz:
+    """Lanza todos los motores a la vez y se queda con el primer resultado
+    confiable dentro del plazo. Los que terminan después se comparan con el
+    ganador para llevar la cuenta de coincidencias de cada motor"""
+    
+    def __init__(self, motores, plazo, confianza_minima):
+        self.motores = motores
+        self.plazo = plazo
+        self.confianza_minima = confianza_minima
+        # Dos hilos por motor: uno lento de la frase anterior no frena a la siguiente
+        self._ejecutor = futures.ThreadPoolExecutor(max_workers=2 * max(1, len(motores)), thread_name_prefix="reconocer")
+        self._candado = threading.Lock()
+        self.estadisticas = {
+            m.nombre: {"llamadas": 0, "ganadas": 0, "errores": 0, "sin_texto": 0,
+                       "segundos": 0.0, "comparadas": 0, "coincidencias": 0}
+            for m in motores
+        }
+        self._frases = 0
+    
+    def _ejecutar(self, motor, audio):
+        inicio = time.perf_counter()
+        try:
+            with Tramo(f"motor:{motor.nombre}"):
+                return motor.reconocer(audio)
+        finally:
+            with self._candado:
+                estadistica = self.estadisticas[motor.nombre]
+                estadistica["llamadas"] += 1
+                estadistica["segundos"] += time.perf_counter() - inicio
+    
+    def _anotar(self, nombre, campo):
+        with self._candado:
+            self.estadisticas[nombre][campo] += 1
+    
+    def _comparar_tarde(self, nombre, futuro, ganador):
+        """Cuenta si un motor que perdió la carrera dijo lo mismo que el ganador"""
+        try:
+            texto, _ = futuro.result()
+        except Exception:
+            return
+        with self._candado:
+            estadistica = self.estadisticas[nombre]
+            estadistica["comparadas"] += 1
+            estadistica["coincidencias"] += texto.lower().split() == ganador.lower().split()
+    
+    def reconocer(self, audio):
+        """Devuelve el texto; lanza UnknownValueError si algún motor escuchó
+        pero no entendió y RequestError si todos fallaron o se acabó el plazo"""
+        if not self.motores:
+            raise sr.RequestError("No hay motores de reconocimiento disponibles")
+        
+        futuros = {self._ejecutor.submit(con_traza(self._ejecutar), m, audio): m.nombre for m in self.motores}
+        pendientes = set(futuros)
+        limite = time.monotonic() + self.plazo
+        ganador = respaldo = None  # (nombre, texto, confianza)
+        errores = []
+        sin_texto = False
+        
+        while pendientes and ganador is None:
+            restante = limite - time.monotonic()
+            if restante <= 0:
+                break
+            listos, pendientes = futures.wait(pendientes, timeout=restante, return_when=futures.FIRST_COMPLETED)
+            for futuro in listos:
+                nombre = futuros[futuro]
+                try:
+                    texto, confianza = futuro.result()
+                except sr.UnknownValueError:
+                    self._anotar(nombre, "sin_texto")
+                    sin_texto = True
+                    continue
+                except Exception as e:
+                    self._anotar(nombre, "errores")
+                    errores.append(f"{nombre}: {e}")
+                    continue
+                if confianza >= self.confianza_minima:
+                    ganador = ganador or (nombre, texto, confianza)
+                elif respaldo is None or confianza > respaldo[2]:
+                    respaldo = (nombre, texto, confianza)
+        
+        elegido = ganador or respaldo
+        if elegido is None:
+            if pendientes:
+                raise sr.RequestError(f"Ningún motor respondió en {self.plazo:.1f} s")
+            if errores and not sin_texto:
+                raise sr.RequestError("; ".join(errores))
+            raise sr.UnknownValueError()
+        
+        nombre, texto, confianza = elegido
+        self._anotar(nombre, "ganadas")
+        for futuro, otro in futuros.items():
+            if otro != nombre:
+                futuro.add_done_callback(lambda f, otro=otro: self._comparar_tarde(otro, f, texto))
+        
+        self._frases += 1
+        if self._frases % 20 == 0:
+            log(f"Reconocimiento: {self.resumen()}")
+        log(f"Reconoció {nombre} (confianza {confianza:.2f})")
+        return texto
+    
+    def resumen(self):
+        """Latencia media, victorias y coincidencias de cada motor"""
+        with self._candado:
+            partes = []
+            for nombre, e in self.estadisticas.items():
+                latencia = e["segundos"] / e["llamadas"] if e["llamadas"] else 0
+                coincidencia = f"{e['coincidencias']}/{e['comparadas']}" if e["comparadas"] else "-"
+                partes.append(f"{nombre} {latencia:.2f}s ganó {e['ganadas']} coincidió {coincidencia} errores {e['errores']}")
+            return " | ".join(partes)
+
+def crear_reconocedor(r):
+    """Arma el reconocedor con los motores configurados que estén disponibles"""
+    fabricas = {
+        "google": lambda: MotorGoogle(r),
+        "vosk": lambda: MotorVosk(MODELO_VOSK),
+    }
+    motores = []
+    for nombre in MOTORES_RECONOCIMIENTO:
+        if nombre not in fabricas:
+            log(f"Motor de reconocimiento desconocido: {nombre}", "warning")
+            continue
+        motor = fabricas[nombre]()
+        if motor.disponible():
+            motores.append(motor)
+    log(f"Motores de reconocimiento: {', '.join(m.nombre for m in motores) or 'ninguno'}", "mic")
+    return ReconocedorVoz(motores, PLAZO_RECONOCIMIENTO, CONFIANZA_MINIMA_RECONOCIMIENTO)
+
+# ==========================================
+# HILO DE ESCUCHA
+# ==========================================
+
+def calibrar_microfono(r):
+    """Abre el micrófono y ajusta el umbral al ruido ambiente"""
     try:
         mic = sr.Microphone()
         with mic as source:
             log("Calibrando micrófono...")
             r.adjust_for_ambient_noise(source, duration=1)
             log("Micrófono listo", "success")
+        return mic
     except Exception as e:
         log(f"Error micrófono: {e}", "error")
+        return None
+
+def _energia(bloque):
+    """RMS de un bloque de audio int16"""
+    muestras = np.frombuffer(bloque, dtype=np.int16).astype(np.float32)
+    return float(np.sqrt(np.mean(muestras * muestras))) if len(muestras) else 0.0
+
+class CapturaMicrofono:
+    """Mantiene el micrófono abierto en su propio hilo. Cada bloque pasa por
+    un detector de voz por energía; las frases terminadas (con el audio
+    previo del anillo, para no cortar el inicio) salen por una cola sin
+    frenar la captura"""
+    
+    def __init__(self, mic, r):
+        self.mic = mic
+        self.r = r  # Aporta el umbral calibrado y los tiempos de pausa
+        self.frases = Queue(maxsize=MAX_FRASES_EN_COLA)
+        self.descartadas = 0
+        self._hilo = None
+    
+    def iniciar(self):
+        self._hilo = threading.Thread(target=self._bucle, daemon=True, name="captura")
+        self._hilo.start()
+    
+    def siguiente_frase(self, timeout=None):
+        """Devuelve la próxima frase como sr.AudioData"""
+        try:
+            return self.frases.get(timeout=timeout)
+        except Empty:
+            raise sr.WaitTimeoutError("No hubo frases a tiempo")
+    
+    def _bucle(self):
+        while True:
+            try:
+                with self.mic as source:
+                    log("Micrófono abierto en modo continuo", "mic")
+                    self._capturar(source)
+            except Exception as e:
+                log(f"Error captura: {e}", "error")
+            time.sleep(1)  # Reabrir el micrófono si se cerró
+    
+    def _capturar(self, source):
+        segundos_bloque = source.CHUNK / source.SAMPLE_RATE
+        bloques_pausa = int(math.ceil(self.r.pause_threshold / segundos_bloque))
+        bloques_minimos = int(math.ceil(self.r.phrase_threshold / segundos_bloque))
+        bloques_maximos = int(math.ceil(FRASE_LIMITE / segundos_bloque))
+        anillo = deque(maxlen=max(1, int(math.ceil(PREROLL_SEGUNDOS / segundos_bloque))))
+        
+        frase = None  # Bloques de la frase en curso
+        con_voz = silencio = 0
+        while True:
+            bloque = source.stream.read(source.CHUNK)
+            if not bloque:
+                return
+            
+            if ESTADO.hablando:
+                # Lo que entra mientras BIMO habla es su propia voz
+                anillo.clear()
+                frase = None
+                continue
+            
+            energia = _energia(bloque)
+            hay_voz = energia > self.r.energy_threshold
+            
+            if frase is None:
+                if hay_voz:
+                    frase = list(anillo)
+                    frase.append(bloque)
+                    anillo.clear()
+                    con_voz, silencio = 1, 0
+                    inicio_voz = ultima_voz = time.perf_counter() - segundos_bloque
+                else:
+                    anillo.append(bloque)
+                    if self.r.dynamic_energy_threshold:
+                        # El mismo promedio asimétrico que usa r.listen
+                        amortiguacion = self.r.dynamic_energy_adjustment_damping ** segundos_bloque
+                        objetivo = energia * self.r.dynamic_energy_ratio
+                        self.r.energy_threshold = self.r.energy_threshold * amortiguacion + objetivo * (1 - amortiguacion)
+                continue
+            
+            frase.append(bloque)
+            if hay_voz:
+                con_voz += 1
+                silencio = 0
+                ultima_voz = time.perf_counter()
+            else:
+                silencio += 1
+            
+            if silencio > bloques_pausa or len(frase) >= bloques_maximos:
+                if con_voz >= bloques_minimos:
+                    audio = sr.AudioData(b"".join(frase), source.SAMPLE_RATE, source.SAMPLE_WIDTH)
+                    audio.tiempos = (inicio_voz, ultima_voz, time.perf_counter())  # Para la traza
+                    self._entregar(audio)
+                frase = None
+    
+    def _entregar(self, audio):
+        while True:
+            try:
+                self.frases.put_nowait(audio)
+                return
+            except Full:
+                try:
+                    self.frases.get_nowait()
+                    self.descartadas += 1
+                    log("Cola de frases llena, descartando la más vieja", "warning")
+                except Empty:
+                    pass
+
+def hilo_escucha():
+    """Escucha constantemente el micrófono"""
+    r = sr.Recognizer()
+    r.dynamic_energy_threshold = ENERGIA_DINAMICA
+    r.energy_threshold = ENERGIA_THRESHOLD
+    r.pause_threshold = PAUSA_THRESHOLD
+    r.phrase_threshold = 0.3
+    
+    log("Iniciando sistema de escucha", "mic")
+    
+    mic = ejecutar_fase("microfono", calibrar_microfono, r)
+    if mic is None:
         return
     
+    if PALABRA_CLAVE_LOCAL:
+        cargar_palabra_clave()
+    
+    reconocedor = crear_reconocedor(r)
+    captura = CapturaMicrofono(mic, r)
+    captura.iniciar()
+    
     while True:
+        traza = None
         try:
-            with mic as source:
-                audio = r.listen(source, timeout=None, phrase_time_limit=FRASE_LIMITE)
+            audio = captura.siguiente_frase()
+            traza = iniciar_traza(audio)
+            traza.datos["ruta"] = "descartada"
+            
+            # Sin palabra clave (y sin orden pendiente) la frase no era para BIMO
+            if not ESTADO.esperando_orden and DETECTOR_PALABRA_CLAVE.activo:
+                with Tramo("palabra_clave"):
+                    detectada = DETECTOR_PALABRA_CLAVE.detectar_audio(audio)
+                if not detectada:
+                    log("Frase sin palabra clave, descartada en el dispositivo")
+                    continue
             
-            texto = r.recognize_google(audio, language=IDIOMA_RECONOCIMIENTO).lower()
+            with Tramo("reconocimiento"):
+                texto = reconocedor.reconocer(audio).lower()
+            escuchado = texto  # Completo, antes de quitar la activación
+            traza.datos["texto"] = texto
             log(f"Escuché: '{texto}'", "voice")
             
             comando = ""
@@ -861,71 +3654,141 @@ def hilo_escucha():
                 comando = texto.strip()
                 
                 if not comando:
-                    ESPERANDO_ORDEN = True
-                    ESTADO_EMOCION = "SORPRENDIDO"
-                    hablar(random.choice(RESPUESTAS_ACTIVACION))
-                    ESTADO_EMOCION = "ESCUCHANDO"
+                    traza.datos["ruta"] = "activacion"
+                    ESTADO.actualizar(esperando_orden=True, emocion="SORPRENDIDO")
+                    hablar(random.choice(RESPUESTAS_ACTIVACION), cachear=True)
+                    ESTADO.actualizar(emocion="ESCUCHANDO")
                     continue
                 else:
-                    ESPERANDO_ORDEN = False
+                    ESTADO.actualizar(esperando_orden=False)
             
-            elif ESPERANDO_ORDEN:
+            elif ESTADO.esperando_orden:
                 comando = texto
-                ESPERANDO_ORDEN = False
+                ESTADO.actualizar(esperando_orden=False)
             
             if comando:
                 log(f"Procesando: '{comando}'")
-                ESTADO_EMOCION = "PENSANDO"
-                GENERANDO_RESPUESTA = True
+                
+                with Tramo("intencion_local"):
+                    respuesta_local = resolver_intencion_local(comando) if INTENCIONES_LOCALES else None
+                if respuesta_local:
+                    traza.datos["ruta"] = "local"
+                    log("Respondido sin Gemini", "success")
+                    decir_con_emocion(respuesta_local)
+                    continue
+                
+                conversacion_reciente = MEMORIA.reciente(SEGUNDOS_CONTEXTO_RESPUESTAS)
+                respuesta_guardada = (CACHE_RESPUESTAS.obtener(escuchado, conversacion_reciente)
+                                      if CACHE_RESPUESTAS_ACTIVO else None)
+                if respuesta_guardada:
+                    traza.datos["ruta"] = "cache"
+                    log(f"Respondido desde el cache de respuestas ({CACHE_RESPUESTAS.resumen()})", "success")
+                    MEMORIA.anotar(comando, respuesta_guardada)
+                    decir_con_emocion(respuesta_guardada, cachear=True)
+                    continue
+                
+                ESTADO.actualizar(emocion="PENSANDO", generando=True)
+                traza.datos["ruta"] = "gemini"
                 
                 try:
-                    resp = chat.send_message(comando)
-                    procesar_respuesta_gemini(resp.text)
+                    esperar_fase("gemini")
+                    if MEMORIA.modelo is None:
+                        raise RuntimeError("Gemini no está inicializado")
+                    
+                    if MODO_STREAMING:
+                        resp = MEMORIA.enviar(comando, stream=True)
+                        texto_respuesta = procesar_respuesta_streaming(resp)
+                    else:
+                        texto_respuesta = MEMORIA.enviar(comando).text
+                        procesar_respuesta_gemini(texto_respuesta)
+                    
+                    if CACHE_RESPUESTAS_ACTIVO and CACHE_RESPUESTAS.guardar(escuchado, texto_respuesta, conversacion_reciente):
+                        # Así la próxima vez también la voz sale del cache
+                        threading.Thread(target=precalentar_frases, args=([separar_emociones(texto_respuesta)[0]],),
+                                         daemon=True).start()
                 except Exception as e:
+                    traza.datos["ruta"] = "error"
                     log(f"Error Gemini: {e}", "error")
-                    GENERANDO_RESPUESTA = False
-                    ESTADO_EMOCION = "TRISTE"
-                    hablar("Tuve un problema procesando eso")
-                    ESTADO_EMOCION = "NEUTRO"
+                    ESTADO.actualizar(generando=False, emocion="TRISTE")
+                    hablar("Tuve un problema procesando eso", cachear=True)
+                    ESTADO.actualizar(emocion="NEUTRO")
         
         except sr.WaitTimeoutError:
             continue
         except sr.UnknownValueError:
-            if ESPERANDO_ORDEN:
-                hablar("No te escuché bien")
-                ESPERANDO_ORDEN = False
+            if traza:
+                traza.datos["ruta"] = "no_entendida"
+            if ESTADO.esperando_orden:
+                hablar("No te escuché bien", cachear=True)
+                ESTADO.actualizar(esperando_orden=False)
         except sr.RequestError as e:
             log(f"Error reconocimiento: {e}", "error")
             time.sleep(2)
         except Exception as e:
             log(f"Error inesperado: {e}", "error")
             time.sleep(1)
+        finally:
+            if traza:
+                terminar_traza(traza)
 
 # ==========================================
 # MAIN
 # ==========================================
 
-def main():
-    """Función principal"""
-    print("="*60)
-    print("🎮 BIMO V7 ULTRA - ASISTENTE VIRTUAL MEJORADO")
-    print("="*60)
-    
-    if GEMINI_API_KEY == "TU_API_KEY_AQUI":
-        print("❌ ERROR: Configura GEMINI_API_KEY en config_bimo.py")
-        return
+TIEMPOS_ARRANQUE = {}
+_FASES_ARRANQUE = {}
+FASES_REPORTADAS = ["ventana", "ubicacion", "gemini", "microfono", "voz"]
+
+def _evento_fase(nombre):
+    return _FASES_ARRANQUE.setdefault(nombre, threading.Event())
+
+def ejecutar_fase(nombre, funcion, *args):
+    """Ejecuta una fase del arranque y registra cuánto tardó"""
+    inicio = time.perf_counter()
+    try:
+        return funcion(*args)
+    except Exception as e:
+        log(f"Error en fase '{nombre}': {e}", "error")
+        return None
+    finally:
+        TIEMPOS_ARRANQUE[nombre] = time.perf_counter() - inicio
+        _evento_fase(nombre).set()
+
+def lanzar_fase(nombre, funcion, *args):
+    """Ejecuta una fase del arranque en su propio hilo"""
+    hilo = threading.Thread(target=ejecutar_fase, args=(nombre, funcion) + args, daemon=True)
+    hilo.start()
+    return hilo
+
+def esperar_fase(nombre, timeout=None):
+    """Bloquea hasta que la fase termine (con éxito o no)"""
+    return _evento_fase(nombre).wait(timeout)
+
+def reportar_arranque(inicio):
+    """Espera a todas las fases e imprime (y guarda) cuánto tardó cada una"""
+    for nombre in FASES_REPORTADAS:
+        esperar_fase(nombre)
+    total = time.perf_counter() - inicio
     
-    # Obtener ubicación al inicio
-    log("🌍 Detectando ubicación...")
-    ubicacion = obtener_ubicacion_automatica()
-    print(f"📍 Ubicación detectada: {ubicacion['ciudad']}, {ubicacion['pais']}")
+    detalle = " | ".join(f"{n} {TIEMPOS_ARRANQUE[n]:.2f}s" for n in FASES_REPORTADAS)
+    print(f"⏱️ Arranque: {detalle} | total {total:.2f}s")
     
+    if ARCHIVO_TIEMPOS_ARRANQUE:
+        registro = {"fecha": datetime.datetime.now().isoformat(timespec="seconds"), "total": round(total, 3)}
+        registro.update({n: round(t, 3) for n, t in TIEMPOS_ARRANQUE.items()})
+        try:
+            with open(ARCHIVO_TIEMPOS_ARRANQUE, "a", encoding="utf-8") as archivo:
+                archivo.write(json.dumps(registro, ensure_ascii=False) + "\n")
+        except OSError as e:
+            log(f"No pude guardar los tiempos de arranque: {e}", "error")
+
+def abrir_ventana():
+    """Inicializa pygame y muestra la ventana de BIMO"""
     pygame.init()
     pygame.mixer.init()
     
     pantalla = pygame.display.set_mode(VENTANA_TAMAÑO)
     pygame.display.set_caption(VENTANA_TITULO)
-    reloj = pygame.time.Clock()
     
     # Ícono personalizado (opcional)
     try:
@@ -935,37 +3798,103 @@ def main():
     except:
         pass
     
+    return pantalla
+
+def detectar_ubicacion_inicial():
+    log("🌍 Detectando ubicación...")
+    ubicacion = UBICACION.obtener(esperar=True)
+    print(f"📍 Ubicación detectada: {ubicacion['ciudad']}, {ubicacion['pais']}")
+
+def main():
+    """Función principal"""
+    print("="*60)
+    print("🎮 BIMO V7 ULTRA - ASISTENTE VIRTUAL MEJORADO")
+    print("="*60)
+    
+    if GEMINI_API_KEY == "TU_API_KEY_AQUI":
+        print("❌ ERROR: Configura GEMINI_API_KEY en config_bimo.py")
+        return
+    
+    # La ventana aparece primero; lo lento arranca en paralelo
+    inicio = time.perf_counter()
+    pantalla = ejecutar_fase("ventana", abrir_ventana)
+    if pantalla is None:
+        return
+    reloj = pygame.time.Clock()
+    
+    PLANIFICADOR.iniciar()
+    lanzar_fase("ubicacion", detectar_ubicacion_inicial)
+    lanzar_fase("gemini", iniciar_gemini)
+    lanzar_fase("voz", precalentar_cache_voz)
+    
     log("Iniciando hilo de escucha", "mic")
     t = threading.Thread(target=hilo_escucha, daemon=True)
     t.start()
     
+    threading.Thread(target=reportar_arranque, args=(inicio,), daemon=True).start()
+    
     print("✅ BIMO está listo y escuchando")
     print(f"💬 Di '{TRIGGERS[0].upper()}' seguido de tu comando")
     print("🌍 Para clima sin ubicación, solo di 'clima' o '¿cómo está el tiempo?'")
     print("="*60)
     
+    global EVENTO_DESPERTAR
+    EVENTO_DESPERTAR = pygame.event.custom_type()
+    ESTADO.suscribir(lambda estado, cambios: despertar_render())
+    
     corriendo = True
+    eventos = []
+    ultimo_cuadro = time.monotonic()
+    pasos_pendientes = 0.0
     while corriendo:
-        for event in pygame.event.get():
+        eventos.extend(pygame.event.get())
+        # Solo entrada o ventana: los EVENTO_DESPERTAR ya marcaron la actividad
+        # al publicarse, y volver a publicar aquí nunca dejaría bajar los FPS
+        if any(event.type != EVENTO_DESPERTAR for event in eventos):
+            registrar_actividad()
+        for event in eventos:
             if event.type == pygame.QUIT:
                 corriendo = False
+            elif event.type in (pygame.VIDEOEXPOSE, pygame.WINDOWEXPOSED):
+                forzar_redibujado()
             elif event.type == pygame.KEYDOWN:
                 if event.key == pygame.K_SPACE:
                     # Easter egg
-                    global ESTADO_EMOCION
-                    ESTADO_EMOCION = "EMOCIONADO"
+                    ESTADO.actualizar(emocion="EMOCIONADO")
                     crear_particulas(250, 200, 20, (255, 255, 100))
-                    hablar("¡Hola! ¿Quieres jugar videojuegos?")
+                    hablar_en_segundo_plano("¡Hola! ¿Quieres jugar videojuegos?", cachear=True)
                 elif event.key == pygame.K_h:
                     # Easter egg - mostrar corazones
-                    ESTADO_EMOCION = "AMOR"
+                    ESTADO.actualizar(emocion="AMOR")
                     for _ in range(10):
                         crear_particulas(250, 150, 1, (255, 100, 100))
-                    hablar("¡Te quiero mucho!")
+                    hablar_en_segundo_plano("¡Te quiero mucho!", cachear=True)
+        eventos.clear()
         
-        dibujar_bimo(pantalla)
-        pygame.display.flip()
-        reloj.tick(FPS)
+        # La animación avanza por tiempo real, aunque se dibuje a menos FPS
+        ahora = time.monotonic()
+        pasos_pendientes = min(pasos_pendientes + (ahora - ultimo_cuadro) * FPS, FPS)
+        ultimo_cuadro = ahora
+        pasos = max(1, int(pasos_pendientes))
+        pasos_pendientes = max(pasos_pendientes - pasos, 0.0)
+        
+        rects = dibujar_bimo(pantalla, pasos)
+        if rects:
+            pygame.display.update(rects)
+        if "primer_cuadro" not in TIEMPOS_ARRANQUE:
+            TIEMPOS_ARRANQUE["primer_cuadro"] = time.perf_counter() - inicio
+        
+        objetivo = fps_objetivo()
+        if objetivo >= FPS:
+            reloj.tick(FPS)
+        else:
+            # Dormir hasta el siguiente cuadro, pero despertar ante cualquier evento
+            espera = int(1000 / objetivo - (time.monotonic() - ahora) * 1000)
+            if espera > 0:
+                evento = pygame.event.wait(espera)
+                if evento.type != pygame.NOEVENT:
+                    eventos.append(evento)
+            reloj.tick()  # Solo para que el reloj no acumule el tiempo dormido
     
     log("Cerrando BIMO", "warning")
     pygame.quit()
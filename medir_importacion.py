@@ -0,0 +1,44 @@
+# Este script mide cuánto tarda "import index" con python -X importtime
+# y falla si se pasa del presupuesto o si se cargan dependencias pesadas
+
+import subprocess
+import sys
+
+PRESUPUESTO_MS = 50  # Tiempo máximo permitido para importar index.py
+MODULOS_PESADOS = ["pygame", "speech_recognition", "google.generativeai", "edge_tts", "requests", "asyncio", "numpy"]
+
+def medir():
+    proceso = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import index"],
+        capture_output=True, text=True
+    )
+    if proceso.returncode != 0:
+        print(proceso.stderr)
+        sys.exit("❌ No se pudo importar index.py")
+
+    # Formato: "import time: self [us] | cumulative | imported package"
+    registros = []
+    for linea in proceso.stderr.splitlines():
+        if not linea.startswith("import time:") or "cumulative" in linea:
+            continue
+        _, propio, acumulado, nombre = [c.strip() for c in linea.replace("import time:", "|").split("|")]
+        registros.append((nombre, int(propio), int(acumulado)))
+    return registros
+
+if __name__ == "__main__":
+    presupuesto = float(sys.argv[1]) if len(sys.argv) > 1 else PRESUPUESTO_MS
+    registros = medir()
+
+    total_ms = next(acum for nombre, _, acum in registros if nombre == "index") / 1000
+    print(f"--- IMPORTAR index.py: {total_ms:.1f} ms (presupuesto {presupuesto:.0f} ms) ---")
+    for nombre, propio, acumulado in sorted(registros, key=lambda r: -r[1])[:10]:
+        print(f"- {nombre:<30} {propio / 1000:6.1f} ms")
+
+    cargados = {nombre for nombre, _, _ in registros}
+    pesados = [m for m in MODULOS_PESADOS if m in cargados]
+
+    if pesados:
+        sys.exit(f"❌ Se importaron dependencias pesadas: {', '.join(pesados)}")
+    if total_ms > presupuesto:
+        sys.exit("❌ Importar index.py tarda más que el presupuesto")
+    print("✅ Dentro del presupuesto")
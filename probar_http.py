@@ -0,0 +1,183 @@
+# Este script prueba la capa HTTP de index.py contra un servidor local falso
+# (sin internet): carrera y cache de geolocalización, conexiones reutilizadas,
+# clima, caches, tipo de cambio y métricas por servicio
+
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import index
+
+RESPUESTAS_IP_API = {"status": "success", "city": "Colima", "regionName": "Colima",
+                     "country": "México", "lat": 19.24, "lon": -103.72}
+# Ruta -> (segundos de espera, código HTTP, respuesta JSON)
+RESPUESTAS = {
+    "/ipapi": (0.8, 200, {"city": "Guadalajara", "region": "Jalisco", "country_name": "México",
+                          "latitude": 20.67, "longitude": -103.35}),
+    "/ip-api": (0.05, 200, RESPUESTAS_IP_API),
+    "/geo": (0.0, 200, {"results": [{"name": "Colima", "country": "México", "latitude": 19.24, "longitude": -103.72}]}),
+    "/pronostico": (0.0, 200, {"current_weather": {"temperature": 27.5, "weathercode": 61, "windspeed": 8.0}}),
+    "/cambio/USD": (0.0, 200, {"rates": {"MXN": 17.0, "EUR": 0.9}}),
+}
+CONEXIONES = set()  # Puertos de cliente vistos: uno por conexión TCP
+PETICIONES = []
+
+class ServidorFalso(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # Necesario para keep-alive
+    disable_nagle_algorithm = True  # Si no, cada respuesta espera ~40 ms el ACK retrasado
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        CONEXIONES.add(self.client_address[1])
+        PETICIONES.append((url.path, parse_qs(url.query)))
+        espera, codigo, datos = RESPUESTAS.get(url.path, (0.0, 404, {"error": "no existe"}))
+        time.sleep(espera)
+        cuerpo = json.dumps(datos).encode("utf-8")
+        self.send_response(codigo)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(cuerpo)))
+        self.end_headers()
+        self.wfile.write(cuerpo)
+
+    def log_message(self, *args):
+        pass
+
+def revisar(condicion, descripcion, fallas):
+    print(f"{'✅' if condicion else '❌'} {descripcion}")
+    if not condicion:
+        fallas.append(descripcion)
+
+if __name__ == "__main__":
+    servidor = ThreadingHTTPServer(("127.0.0.1", 0), ServidorFalso)
+    threading.Thread(target=servidor.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{servidor.server_address[1]}"
+    index.URLS_SERVICIOS.update({
+        "ipapi": f"{base}/ipapi",
+        "ip-api": f"{base}/ip-api",
+        "geocodificacion": f"{base}/geo",
+        "pronostico": f"{base}/pronostico",
+        "tipo_cambio": f"{base}/cambio/{{moneda}}",
+    })
+    index.DEBUG_MODE = False
+    index.CACHE_GEOCODIFICACION.archivo = None  # No tocar los archivos reales
+    temporal = tempfile.mkdtemp()
+    index.CAMBIOS.archivo = os.path.join(temporal, "tipo_cambio.json")
+    index.UBICACION = index.CacheUbicacion(os.path.join(temporal, "ubicacion.json"), ttl=3600)
+    fallas = []
+
+    # 1. Carrera: gana el servicio rápido aunque sea el de respaldo
+    inicio = time.perf_counter()
+    ubicacion = index.UBICACION.obtener(esperar=True)
+    segundos = time.perf_counter() - inicio
+    revisar(ubicacion["ciudad"] == "Colima" and segundos < 0.5,
+            f"Geolocalización por carrera: {ubicacion['ciudad']} en {segundos * 1000:.0f} ms", fallas)
+
+    # 2. Si el rápido falla, gana el lento
+    RESPUESTAS["/ip-api"] = (0.0, 500, {})
+    ubicacion = index.UBICACION.actualizar()
+    revisar(ubicacion["ciudad"] == "Guadalajara", f"Respaldo cuando un servicio falla: {ubicacion['ciudad']}", fallas)
+
+    # 3. Si los dos fallan se conserva la última ubicación conocida
+    RESPUESTAS["/ipapi"] = (0.0, 500, {})
+    index.UBICACION.actualizar()
+    ubicacion = index.obtener_ubicacion_automatica()
+    revisar(ubicacion["ciudad"] == "Guadalajara", f"Sin servicios se usa la última ubicación: {ubicacion['ciudad']}", fallas)
+
+    # Al reiniciar se lee del disco sin salir a la red; vieja, se actualiza en segundo plano
+    RESPUESTAS["/ip-api"] = (0.3, 200, RESPUESTAS_IP_API)
+    index.UBICACION = index.CacheUbicacion(index.UBICACION.archivo, ttl=0)
+    inicio = time.perf_counter()
+    ubicacion = index.obtener_ubicacion_automatica()
+    segundos = time.perf_counter() - inicio
+    revisar(ubicacion["ciudad"] == "Guadalajara" and segundos < 0.05,
+            f"Ubicación guardada servida en {segundos * 1000:.1f} ms", fallas)
+    time.sleep(0.6)
+    revisar(index.obtener_ubicacion_automatica()["ciudad"] == "Colima", "Ubicación actualizada en segundo plano", fallas)
+
+    # Ubicación fija: nunca se consulta la IP
+    antes = len(PETICIONES)
+    fija = index.CacheUbicacion(None, ttl=0, fija="Manzanillo").obtener(esperar=True)
+    revisar(fija["ciudad"] == "Manzanillo" and len(PETICIONES) == antes, f"Ubicación fija: {fija['ciudad']}", fallas)
+    index.UBICACION.ttl = 3600
+
+    # 4. Clima (geocodificación + pronóstico) con datos estructurados
+    datos = index.obtener_datos_clima("Colima")
+    revisar(datos.get("temperatura") == 27.5 and datos.get("estado") == "lluvioso",
+            f"Clima: {index.describir_clima(datos)}", fallas)
+    consulta = next(q for ruta, q in PETICIONES if ruta == "/geo")
+    revisar(consulta.get("name") == ["Colima"], "Parámetros de geocodificación", fallas)
+
+    # 5. Tipo de cambio: una tabla descargada sirve para todos los cruces
+    antes = len(PETICIONES)
+    resultado = index.convertir_moneda(10, "USD", "MXN")
+    revisar(resultado == 170.0, f"Tipo de cambio: 10 USD = {resultado} MXN", fallas)
+    resultado = index.convertir_unidades(10, "EUR", "MXN")
+    revisar(round(resultado, 2) == 188.89 and len(PETICIONES) - antes == 1,
+            f"Cruce desde la misma tabla: 10 EUR = {resultado:.2f} MXN ({len(PETICIONES) - antes} descarga)", fallas)
+
+    # Sin red: la última tabla guardada en disco
+    RESPUESTAS["/cambio/USD"] = (0.0, 500, {})
+    index.CAMBIOS = index.TablaCambios("USD", index.TTL_TIPO_CAMBIO, index.CAMBIOS.archivo)
+    resultado = index.convertir_moneda(10, "USD", "MXN")
+    revisar(resultado == 170.0, f"Tipo de cambio sin red desde el respaldo: {resultado} MXN", fallas)
+
+    # Equipo nuevo sin red y sin respaldo en disco: la tabla incluida
+    os.remove(index.CAMBIOS.archivo)
+    index.CAMBIOS = index.TablaCambios("USD", index.TTL_TIPO_CAMBIO, index.CAMBIOS.archivo)
+    resultado = index.convertir_moneda(10, "USD", "MXN")
+    esperado = 10 * index.TASAS_INCLUIDAS["tasas"]["MXN"]
+    revisar(resultado == esperado, f"Tipo de cambio sin red ni respaldo, tabla incluida: {resultado} MXN", fallas)
+
+    # Una moneda que no viene en la tabla solo se busca una vez por TTL
+    RESPUESTAS["/cambio/USD"] = (0.0, 200, {"rates": {"MXN": 17.0, "EUR": 0.9}})
+    index.CAMBIOS = index.TablaCambios("USD", index.TTL_TIPO_CAMBIO, index.CAMBIOS.archivo)
+    antes = len(PETICIONES)
+    resultados = [index.convertir_moneda(10, "USD", "XYZ") for _ in range(3)]
+    revisar(resultados == [None] * 3 and len(PETICIONES) - antes == 1,
+            f"Moneda desconocida recordada ({len(PETICIONES) - antes} descarga)", fallas)
+
+    # 6. Cache: repetir la pregunta (aun mal escrita) no sale a la red
+    antes = len(PETICIONES)
+    for ciudad in ("Colima", "colima", "Cólima", "colimma"):
+        index.obtener_datos_clima(ciudad)
+    revisar(len(PETICIONES) == antes, f"Clima repetido desde cache ({len(PETICIONES) - antes} consultas)", fallas)
+
+    # 7. Clima viejo: se responde al instante y se actualiza en segundo plano
+    RESPUESTAS["/pronostico"] = (0.5, 200, {"current_weather": {"temperature": 30.0, "weathercode": 0, "windspeed": 3.0}})
+    index.CACHE_CLIMA.ttl = 0
+    inicio = time.perf_counter()
+    datos = index.obtener_datos_clima("Colima")
+    segundos = time.perf_counter() - inicio
+    revisar(datos["temperatura"] == 27.5 and segundos < 0.2, f"Clima viejo servido en {segundos * 1000:.0f} ms", fallas)
+    time.sleep(0.8)
+    index.CACHE_CLIMA.ttl = 600
+    revisar(index.obtener_datos_clima("Colima")["temperatura"] == 30.0, "Clima actualizado en segundo plano", fallas)
+
+    # 8. Consultas simultáneas del mismo lugar: una sola va a la red
+    index.CACHE_CLIMA.ttl = index.CACHE_CLIMA.ttl_viejo = 0
+    antes = len(PETICIONES)
+    hilos = [threading.Thread(target=index.obtener_datos_clima, args=("Colima",)) for _ in range(5)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    revisar(len(PETICIONES) - antes == 1, f"5 consultas simultáneas, {len(PETICIONES) - antes} a la red", fallas)
+
+    # 9. Keep-alive: muchas consultas seguidas (sin cache) no abren conexiones nuevas
+    RESPUESTAS["/pronostico"] = (0.0, 200, {"current_weather": {"temperature": 27.5, "weathercode": 61, "windspeed": 8.0}})
+    index.CACHE_GEOCODIFICACION.obtener = lambda ciudad: None
+    CONEXIONES.clear()
+    for _ in range(20):
+        index.obtener_datos_clima("Colima")
+    revisar(len(CONEXIONES) == 1, f"40 consultas por {len(CONEXIONES)} conexión(es)", fallas)
+
+    print(f"--- Métricas: {index.HTTP.resumen()} ---")
+    servidor.shutdown()
+    if fallas:
+        sys.exit(f"❌ {len(fallas)} pruebas fallaron")
+    print("✅ Capa HTTP correcta")
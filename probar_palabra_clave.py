@@ -0,0 +1,109 @@
+# Este script prueba el detector local de palabra clave con grabaciones WAV:
+# frases que sí dicen "bimo", frases que no, y "bimo" seguido de una orden
+# (cada frase del sí pegada a una del no), y sugiere un umbral
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+import index
+
+PAUSA_ORDEN = 0.2  # Segundos entre "bimo" y la orden al pegar dos grabaciones
+
+def leer_carpeta(carpeta):
+    if not carpeta:
+        return []
+    return [os.path.join(carpeta, n) for n in sorted(os.listdir(carpeta)) if n.lower().endswith(".wav")]
+
+def con_orden(positivas, negativas):
+    """[(nombre, muestras)]: cada frase con "bimo" seguida de una sin él,
+    para comprobar que lo que se dice después no cambia la detección"""
+    if not negativas:
+        return []
+    pausa = np.zeros(int(PAUSA_ORDEN * index.FRECUENCIA_MFCC), dtype=np.int16)
+    casos = []
+    for numero, ruta in enumerate(positivas):
+        orden = negativas[numero % len(negativas)]
+        muestras = np.concatenate([index.leer_wav(ruta), pausa, index.leer_wav(orden)])
+        casos.append((f"{os.path.basename(ruta)} + {os.path.basename(orden)}", muestras))
+    return casos
+
+def grabar_plantillas(carpeta, cantidad):
+    """Graba plantillas con el micrófono: una palabra clave por toma"""
+    import speech_recognition as sr
+    os.makedirs(carpeta, exist_ok=True)
+    r = sr.Recognizer()
+    with sr.Microphone(sample_rate=index.FRECUENCIA_MFCC) as source:
+        r.adjust_for_ambient_noise(source, duration=1)
+        for numero in range(cantidad):
+            input(f"Toma {numero + 1}/{cantidad}: presiona Enter y di \"bimo\"...")
+            audio = r.listen(source, phrase_time_limit=2)
+            ruta = os.path.join(carpeta, f"bimo_{int(time.time())}_{numero}.wav")
+            with open(ruta, "wb") as archivo:
+                archivo.write(audio.get_wav_data(convert_rate=index.FRECUENCIA_MFCC, convert_width=2))
+            print(f"✅ {ruta}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Prueba el detector de palabra clave con archivos WAV")
+    parser.add_argument("--plantillas", default=index.PALABRA_CLAVE_CARPETA, help="carpeta con los WAV de referencia")
+    parser.add_argument("--si", help="carpeta con frases que contienen la palabra clave (por defecto plantillas/si)")
+    parser.add_argument("--no", help="carpeta con frases que no la contienen (por defecto plantillas/no)")
+    parser.add_argument("--umbral", type=float, help="umbral a probar (por defecto el calibrado)")
+    parser.add_argument("--grabar", type=int, metavar="N", help="grabar N plantillas nuevas con el micrófono y salir")
+    args = parser.parse_args()
+
+    if args.grabar:
+        grabar_plantillas(args.plantillas, args.grabar)
+        sys.exit()
+
+    args.si = args.si or os.path.join(args.plantillas, "si")
+    args.no = args.no or os.path.join(args.plantillas, "no")
+    positivas = leer_carpeta(args.si) if os.path.isdir(args.si) else []
+    negativas = leer_carpeta(args.no) if os.path.isdir(args.no) else []
+
+    detector = index.DetectorPalabraClave(args.plantillas, args.umbral)
+    if not detector.cargar():
+        sys.exit(f"❌ No hay plantillas WAV en {args.plantillas}")
+    print(f"--- {len(detector.plantillas)} plantillas, umbral {detector.umbral} ---")
+
+    casos = [(True, os.path.basename(r), index.leer_wav(r)) for r in positivas]
+    casos += [(True, nombre, muestras) for nombre, muestras in con_orden(positivas, negativas)]
+    casos += [(False, os.path.basename(r), index.leer_wav(r)) for r in negativas]
+
+    resultados = []  # (esperado, distancia, nombre)
+    tiempos = []
+    for esperado, nombre, muestras in casos:
+        inicio = time.perf_counter()
+        distancia = detector.distancia(muestras)
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+        resultados.append((esperado, distancia, nombre))
+        detectada = distancia <= detector.umbral
+        marca = "✅" if detectada == esperado else "❌"
+        print(f"{marca} {'sí' if esperado else 'no'}  {distancia:7.2f}  {nombre}")
+
+    if not resultados:
+        sys.exit(f"❌ No hay frases en {args.si} ni en {args.no}")
+
+    positivos = [d for e, d, _ in resultados if e]
+    negativos = [d for e, d, _ in resultados if not e]
+    perdidas = sum(d > detector.umbral for d in positivos)
+    falsas = sum(d <= detector.umbral for d in negativos)
+    tiempos.sort()
+    print(f"--- {len(resultados)} frases, {tiempos[len(tiempos) // 2]:.1f} ms por frase (mediana) ---")
+    if positivos:
+        print(f"- Detectadas: {len(positivos) - perdidas}/{len(positivos)}")
+    if negativos:
+        print(f"- Falsas alarmas: {falsas}/{len(negativos)}")
+    if positivos and negativos:
+        if max(positivos) < min(negativos):
+            print(f"- Umbral sugerido: {(max(positivos) + min(negativos)) / 2:.2f} (separación completa)")
+        else:
+            print(f"- Sin separación completa: el peor positivo está en {max(positivos):.2f}, "
+                  f"el mejor negativo en {min(negativos):.2f}")
+
+    if perdidas or falsas:
+        sys.exit(f"❌ {perdidas + falsas} frases mal clasificadas")
+    print("✅ Todas las frases bien clasificadas")
@@ -0,0 +1,78 @@
+# Este script lee las trazas que guarda index.py (una línea JSON por frase)
+# e imprime cuánto tarda cada etapa: p50, p95 y máximo, en orden de aparición
+
+import argparse
+import json
+import os
+import sys
+from collections import defaultdict
+
+import index
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def leer_trazas(ruta):
+    """Lee también ruta.1, lo que quedó de antes de la última rotación"""
+    trazas = []
+    for parte in (f"{ruta}.1", ruta):
+        if parte != ruta and not os.path.exists(parte):
+            continue
+        with open(parte, encoding="utf-8") as archivo:
+            for linea in archivo:
+                try:
+                    traza = json.loads(linea)
+                except ValueError:
+                    continue  # Línea a medio escribir (corte de luz)
+                if traza.get("clase") == "traza":
+                    trazas.append(traza)
+    return trazas
+
+def imprimir_tabla(titulo, filas):
+    print(f"--- {titulo} ---")
+    print(f"{'':<30} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'máx ms':>9}")
+    for nombre, valores in filas:
+        print(f"- {nombre:<28} {len(valores):>5} {percentil(valores, 50):>9.0f} "
+              f"{percentil(valores, 95):>9.0f} {max(valores):>9.0f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Resumen de latencias por etapa de BIMO")
+    parser.add_argument("archivo", nargs="?", default=index.ARCHIVO_TRAZAS, help="archivo de trazas (JSON por línea)")
+    parser.add_argument("--ruta", help="solo frases de una ruta (gemini, local, cache, activacion...)")
+    parser.add_argument("--ultimas", type=int, help="solo las últimas N frases")
+    args = parser.parse_args()
+
+    try:
+        trazas = leer_trazas(args.archivo)
+    except OSError as e:
+        sys.exit(f"❌ No pude leer {args.archivo}: {e}")
+    trazas = [t for t in trazas if t.get("ruta") != "descartada"]
+    if args.ruta:
+        trazas = [t for t in trazas if t.get("ruta") == args.ruta]
+    if args.ultimas:
+        trazas = trazas[-args.ultimas:]
+    if not trazas:
+        sys.exit("❌ No hay trazas que resumir")
+
+    etapas = defaultdict(list)
+    inicios = defaultdict(list)  # Para ordenar las etapas como ocurren
+    primer_sonido = []
+    for traza in trazas:
+        for tramo in traza["tramos"]:
+            etapas[tramo["etapa"]].append(tramo["ms"])
+            inicios[tramo["etapa"]].append(tramo["inicio_ms"])
+        sonidos = [t["inicio_ms"] + t["ms"] for t in traza["tramos"] if t["etapa"] == "carga_audio"]
+        if sonidos:
+            primer_sonido.append(min(sonidos))
+
+    orden = sorted(etapas, key=lambda etapa: percentil(inicios[etapa], 50))
+    imprimir_tabla(f"{len(trazas)} frases, por etapa", [(etapa, etapas[etapa]) for etapa in orden])
+
+    por_ruta = defaultdict(list)
+    for traza in trazas:
+        por_ruta[traza.get("ruta", "?")].append(traza["total_ms"])
+    filas = sorted(por_ruta.items(), key=lambda fila: -len(fila[1]))
+    if primer_sonido:
+        filas.append(("(primer sonido)", primer_sonido))
+    imprimir_tabla("Total por ruta", filas)
@@ -0,0 +1,50 @@
+# Este script verifica que el render con capas prerenderizadas y rectángulos
+# sucios produce exactamente los mismos píxeles que dibujar con primitivas
+
+import os
+import random
+import sys
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+os.environ.setdefault("SDL_AUDIODRIVER", "dummy")
+
+import pygame
+import index
+
+EMOCIONES = ["NEUTRO", "FELIZ", "TRISTE", "ENOJADO", "SORPRENDIDO", "DUDOSO",
+             "AMOR", "ESCUCHANDO", "PENSANDO", "EMOCIONADO", "CANSADO"]
+CUADROS_POR_CASO = 200
+
+def pixeles(superficie):
+    return bytes(superficie.get_buffer())
+
+if __name__ == "__main__":
+    pygame.init()
+    pygame.display.set_mode(index.VENTANA_TAMAÑO)
+    incremental = pygame.Surface(index.VENTANA_TAMAÑO)
+    referencia = pygame.Surface(index.VENTANA_TAMAÑO)
+    ancho, alto = index.VENTANA_TAMAÑO
+    random.seed(7)
+
+    cuadros = 0
+    distintos = []
+    for generando in (False, True):
+        for hablando in (False, True):
+            for esperando in (False, True):
+                for emocion in EMOCIONES:
+                    estado = index.ESTADO.actualizar(emocion=emocion, hablando=hablando,
+                                                     generando=generando, esperando_orden=esperando)
+                    for _ in range(CUADROS_POR_CASO):
+                        index.actualizar_animacion(ancho, alto, estado)
+                        index.pintar_bimo(incremental, estado)
+                        index.pintar_bimo_directo(referencia, estado)
+                        cuadros += 1
+                        if pixeles(incremental) != pixeles(referencia):
+                            distintos.append((emocion, hablando, generando, esperando, index.TICK))
+
+    print(f"--- {cuadros} cuadros comparados, {len(index._CACHE_CAPAS)} capas en cache ---")
+    if distintos:
+        for caso in distintos[:10]:
+            print(f"- Diferencia: emoción={caso[0]} hablando={caso[1]} generando={caso[2]} esperando={caso[3]} tick={caso[4]}")
+        sys.exit(f"❌ {len(distintos)} cuadros distintos")
+    print("✅ Píxeles idénticos")